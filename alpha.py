@@ -1,7 +1,7 @@
 # alpha.py — spaces only, LF
 
 from collections import deque
-from statistics import pstdev
+from rolling import RollingVar
 
 class AlphaDetector:
     def __init__(
@@ -20,23 +20,46 @@ class AlphaDetector:
         self.max_box = float(max_box_range_pct) / 100.0
         self.hyst = int(signal_hysteresis_bars)
 
-        self.cl = deque(maxlen=max(self.norm_len, self.box_len) + 5)
-        self.hi = deque(maxlen=max(self.norm_len, self.box_len) + 5)
-        self.lo = deque(maxlen=max(self.norm_len, self.box_len) + 5)
-        self.vo = deque(maxlen=200)
+        # ring buffer degli ultimi box_len hi/lo + deque monotone di indici
+        # (max decrescente, min crescente): top/bottom del box in O(1) ammortizzato
+        self._hi = [0.0] * max(1, self.box_len)
+        self._lo = [0.0] * max(1, self.box_len)
+        self._maxq = deque()
+        self._minq = deque()
+        self._n = 0
+        self._vol = RollingVar(maxlen=200)
 
         self.box_top = None
         self.box_bot = None
         self._last_signal = None
         self._persist = 0
 
+    def get_state(self):
+        return {
+            "box_len": self.box_len, "n": self._n, "hi": list(self._hi), "lo": list(self._lo),
+            "maxq": list(self._maxq), "minq": list(self._minq), "vol": self._vol.get_state(),
+            "box_top": self.box_top, "box_bot": self.box_bot,
+            "last_signal": self._last_signal, "persist": self._persist,
+        }
+
+    def set_state(self, st):
+        """Ripristina lo stato da get_state(); ignorato (False) se box_len è cambiato."""
+        if int(st.get("box_len", -1)) != self.box_len or len(st["hi"]) != len(self._hi):
+            return False
+        self._n = int(st["n"])
+        self._hi[:] = [float(x) for x in st["hi"]]
+        self._lo[:] = [float(x) for x in st["lo"]]
+        self._maxq = deque(int(i) for i in st["maxq"])
+        self._minq = deque(int(i) for i in st["minq"])
+        self._vol.set_state(st["vol"])
+        self.box_top, self.box_bot = st.get("box_top"), st.get("box_bot")
+        self._last_signal, self._persist = st.get("last_signal"), int(st.get("persist", 0))
+        return True
+
     def _norm_vol(self):
-        if len(self.vo) < 5:
-            return 0.0
-        try:
-            return pstdev(self.vo)
-        except Exception:
+        if len(self._vol) < 5:
             return 0.0
+        return self._vol.pstdev()
 
     def update(self, *args, **kwargs):
         """
@@ -46,57 +69,68 @@ class AlphaDetector:
           - update(o=o,h=h,l=l,c=c,v=v)
         Ritorna: (signal|None, box_top, box_bot, vol_norm)
         """
-        # normalizza input
         if len(args) == 1 and isinstance(args[0], dict):
             candle = args[0]
+            o, h, l, c, v = candle.get("o"), candle.get("h"), candle.get("l"), candle.get("c"), candle.get("v", 0.0)
         elif len(args) >= 4:
             o, h, l, c = args[:4]
             v = args[4] if len(args) >= 5 else kwargs.get("v", 0.0)
-            candle = {"o": o, "h": h, "l": l, "c": c, "v": v}
         else:
             try:
-                candle = {
-                    "o": kwargs["o"], "h": kwargs["h"],
-                    "l": kwargs["l"], "c": kwargs["c"],
-                    "v": kwargs.get("v", 0.0)
-                }
+                o, h, l, c = kwargs["o"], kwargs["h"], kwargs["l"], kwargs["c"]
             except KeyError:
                 raise TypeError("AlphaDetector.update(): expected candle dict or (o,h,l,c[,v]).")
+            v = kwargs.get("v", 0.0)
+        return self.update_fast(float(o), float(h), float(l), float(c), float(v or 0.0))
 
-        o = float(candle.get("o"))
-        h = float(candle.get("h"))
-        l = float(candle.get("l"))
-        c = float(candle.get("c"))
-        v = float(candle.get("v", 0.0))
-
-        self.cl.append(c)
-        self.hi.append(h)
-        self.lo.append(l)
-        self.vo.append(v)
-
-        if len(self.cl) < self.box_len:
+    def update_fast(self, o, h, l, c, v):
+        """
+        Percorso posizionale con float già convertiti; nessuna copia delle finestre.
+        Il box è quello delle box_len barre precedenti: la barra corrente rompe
+        il box (c oltre top/bottom) e poi entra nella finestra.
+        """
+        n = len(self._hi)
+        i = self._n
+        self._n = i + 1
+        hi, lo, maxq, minq = self._hi, self._lo, self._maxq, self._minq
+        self._vol.push(v)
+        ready = i >= n
+        if ready:
+            box_top = hi[maxq[0] % n]
+            box_bot = lo[minq[0] % n]
+
+        # la barra i entra nella finestra, esce la i - n (stesso slot del ring)
+        k = i % n
+        while maxq and maxq[0] <= i - n:
+            maxq.popleft()
+        while maxq and hi[maxq[-1] % n] <= h:
+            maxq.pop()
+        maxq.append(i)
+        while minq and minq[0] <= i - n:
+            minq.popleft()
+        while minq and lo[minq[-1] % n] >= l:
+            minq.pop()
+        minq.append(i)
+        hi[k] = h
+        lo[k] = l
+
+        if not ready:
             return None, self.box_top, self.box_bot, 0.0
 
-        window_hi = list(self.hi)[-self.box_len:]
-        window_lo = list(self.lo)[-self.box_len:]
-        box_top = max(window_hi)
-        box_bot = min(window_lo)
-
         mid = (box_top + box_bot) / 2.0
         box_range = max(1e-9, box_top - box_bot)
         box_range_pct = box_range / max(1e-9, mid)
 
+        self.box_top, self.box_bot = box_top, box_bot
+
         if box_range_pct < self.min_box or box_range_pct > self.max_box:
-            self.box_top, self.box_bot = box_top, box_bot
             self._last_signal = None
             self._persist = 0
-            return None, self.box_top, self.box_bot, self._norm_vol()
-
-        self.box_top, self.box_bot = box_top, box_bot
+            return None, box_top, box_bot, self._norm_vol()
 
         body_mid = (o + c) / 2.0
-        long_break = c > self.box_top and (not self.strong_close or body_mid > self.box_top)
-        short_break = c < self.box_bot and (not self.strong_close or body_mid < self.box_bot)
+        long_break = c > box_top and (not self.strong_close or body_mid > box_top)
+        short_break = c < box_bot and (not self.strong_close or body_mid < box_bot)
 
         sig = "long" if long_break else ("short" if short_break else None)
 
@@ -107,6 +141,6 @@ class AlphaDetector:
         self._last_signal = sig
 
         if sig and self._persist >= max(1, self.hyst):
-            return sig, self.box_top, self.box_bot, self._norm_vol()
+            return sig, box_top, box_bot, self._norm_vol()
 
-        return None, self.box_top, self.box_bot, self._norm_vol()
+        return None, box_top, box_bot, self._norm_vol()
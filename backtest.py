@@ -0,0 +1,404 @@
+# backtest.py — spaces only, LF
+"""
+Backtest offline della pipeline breakout + grid su array OHLCV.
+
+  python backtest.py candles.csv [--config config.yaml] [--tf 1m|5m] [--out backtest.json]
+
+Il CSV ha intestazione t,o,h,l,c,v (t in ms, barre 1m). Box + hysteresis,
+volatilità, stato safe_mode e leva PID sono calcolati in blocco con NumPy;
+si itera solo sugli eventi (re-grid, segnali, uscite SL/TP), ognuno risolto
+con ricerche vettoriali sulle barre successive.
+
+Scala della volatilità: qui vol_pct è la pstdev dei rendimenti close-to-close
+per barra, nel loop live quella dei mid campionati ogni daemon.loop_seconds
+(~6 s). Su un random walk la seconda è circa sqrt(loop_seconds / barra) volte
+la prima (~0.32 con barre 1m), quindi a parità di soglie safe_mode e
+target_vol_pct il backtest vede più WARN/PANIC e una leva PID più bassa del
+live. Il summary riporta entrambi i passi (vol_sample_s, live_vol_sample_s).
+"""
+import sys, json, argparse, heapq
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from util import load_cfg
+from grid import compute_grid
+from pid import leverage_from_pid
+from ledger import streak_mult
+from stops import DynamicStops
+
+OK, WARN, PANIC = 0, 1, 2
+STATUS_NAMES = ("OK", "WARN", "PANIC")
+DAY_MS = 86_400_000
+
+def load_csv(path):
+    a = np.genfromtxt(path, delimiter=",", names=True)
+    return {k: np.asarray(a[k], dtype=float) for k in ("t", "o", "h", "l", "c", "v")}
+
+def resample(bars, minutes):
+    """Aggrega barre 1m in barre da `minutes` minuti (allineate all'epoch)."""
+    if minutes <= 1:
+        return bars
+    bucket = (bars["t"] // (minutes * 60_000)).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(bucket)] - 1
+    return {
+        "t": bucket[starts].astype(float) * minutes * 60_000,
+        "o": bars["o"][starts],
+        "h": np.maximum.reduceat(bars["h"], starts),
+        "l": np.minimum.reduceat(bars["l"], starts),
+        "c": bars["c"][ends],
+        "v": np.add.reduceat(bars["v"], starts),
+    }
+
+def rolling_max(x, n):
+    out = np.full(len(x), np.nan)
+    if n >= 1 and len(x) >= n:
+        out[n-1:] = sliding_window_view(x, n).max(axis=1)
+    return out
+
+def rolling_min(x, n):
+    out = np.full(len(x), np.nan)
+    if n >= 1 and len(x) >= n:
+        out[n-1:] = sliding_window_view(x, n).min(axis=1)
+    return out
+
+def box_signals(o, h, l, c, box_len=14, strong_close=True, min_box_range_pct=0.15,
+                max_box_range_pct=2.0, signal_hysteresis_bars=2, **_):
+    """
+    Equivalente vettoriale di AlphaDetector.update() barra per barra: il box
+    della barra i è quello delle box_len barre precedenti.
+    Ritorna (sig, box_top, box_bot) con sig in {1, -1, 0}.
+    """
+    top = np.r_[np.nan, rolling_max(h, int(box_len))[:-1]]
+    bot = np.r_[np.nan, rolling_min(l, int(box_len))[:-1]]
+    with np.errstate(invalid="ignore"):
+        mid = (top + bot) / 2.0
+        pct = np.maximum(1e-9, top - bot) / np.maximum(1e-9, mid)
+        ok = (pct >= min_box_range_pct / 100.0) & (pct <= max_box_range_pct / 100.0)
+        body = (o + c) / 2.0
+        lb = ok & (c > top)
+        sb = ok & (c < bot)
+        if strong_close:
+            lb &= body > top
+            sb &= body < bot
+    s = np.where(lb, 1, np.where(sb, -1, 0)).astype(np.int8)
+    # persistenza = posizione nella run di valori uguali consecutivi
+    idx = np.arange(len(s))
+    run_start = np.maximum.accumulate(np.where(np.r_[True, s[1:] != s[:-1]], idx, 0))
+    persist = idx - run_start + 1
+    sig = np.where((s != 0) & (persist >= max(1, int(signal_hysteresis_bars))), s, 0).astype(np.int8)
+    return sig, top, bot
+
+def rolling_vol_pct(c, window):
+    """pstdev % dei rendimenti close-to-close sulle ultime `window` barre (0 con meno di 2 rendimenti)."""
+    n = len(c)
+    r = np.zeros(n)
+    r[1:] = c[1:] / c[:-1] - 1.0
+    cs = np.r_[0.0, np.cumsum(r)]
+    cs2 = np.r_[0.0, np.cumsum(r * r)]
+    i = np.arange(n)
+    lo = np.maximum(1, i - int(window) + 1)
+    m = np.maximum(0, i - lo + 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        s1 = (cs[i + 1] - cs[lo]) / m
+        var = (cs2[i + 1] - cs2[lo]) / m - s1 * s1
+    return np.where(m >= 2, np.sqrt(np.maximum(var, 0.0)) * 100.0, 0.0)
+
+def atr_sma(h, l, c, n):
+    """ATR come RollingATR: media degli ultimi n true range (meno all'inizio), la prima barra usa h - l."""
+    pc = np.r_[np.nan, c[:-1]]
+    tr = np.fmax(h - l, np.fmax(np.abs(h - pc), np.abs(l - pc)))
+    cs = np.r_[0.0, np.cumsum(tr)]
+    idx = np.arange(1, len(tr) + 1)
+    lo = np.maximum(0, idx - max(1, int(n)))
+    return (cs[idx] - cs[lo]) / (idx - lo)
+
+def status_codes(vol_pct, cfg):
+    sm = cfg["safe_mode"]
+    st = np.full(len(vol_pct), OK, dtype=np.int8)
+    if sm["enabled"]:
+        st[vol_pct >= sm["vol_warn_pct"]] = WARN
+        st[vol_pct >= sm["vol_panic_pct"]] = PANIC
+    return st
+
+def pid_steps(bar_s, cfg):
+    """(step per barra, dt di ogni step) del PID live: uno step ogni daemon.loop_seconds con dt = max(loop_seconds, 1)."""
+    loop_s = float(cfg["daemon"]["loop_seconds"])
+    return max(1, int(round(bar_s / max(loop_s, 1e-6)))), max(loop_s, 1.0)
+
+def pid_leverage(vol_pct, active, cfg, bar_s):
+    """
+    PID.step() vettoriale con la cadenza del loop live: k = pid_steps() step
+    per barra con errore costante, quindi integrale + k * ki * e * dt in forma
+    chiusa e termine D (su dt del loop) solo al primo step: con k > 1 il valore
+    di fine barra, quello usato, non ha D. L'integrale non è clampato, l'output
+    sì; le barre inattive non fanno step.
+    """
+    p = cfg["pid"]
+    k, dt = pid_steps(bar_s, cfg)
+    e = p["target_vol_pct"] - vol_pct
+    integ = np.cumsum(np.where(active, p["ki"] * e * dt * k, 0.0))
+    if k == 1:
+        last = np.maximum.accumulate(np.where(active, np.arange(len(e)), -1))
+        prev = np.r_[-1, last[:-1]]
+        d = np.where(prev >= 0, p["kd"] * (e - e[np.maximum(prev, 0)]) / dt, 0.0)
+    else:
+        d = 0.0
+    u = np.clip(p["kp"] * e + integ + d, p["out_min"], p["out_max"])
+    return leverage_from_pid(u, cfg["leverage"]["min"], cfg["leverage"]["max"])
+
+def grid_fills(l, h, k, upto, prices, qtys):
+    """
+    Livelli di una griglia piazzata alla barra k toccati nelle barre (k, upto]:
+    buy quando il low scende al prezzo, sell quando l'high lo raggiunge, ogni
+    livello una volta sola. Ritorna (barre, qty, prezzi) dei livelli eseguiti.
+    """
+    seg = slice(k + 1, upto + 1)
+    runmin = np.minimum.accumulate(l[seg])
+    runmax = np.maximum.accumulate(h[seg])
+    buys = qtys > 0
+    at = np.where(buys, np.searchsorted(-runmin, -prices, side="left"),
+                  np.searchsorted(runmax, prices, side="left"))
+    hit = at < (upto - k)
+    return k + 1 + at[hit], qtys[hit], prices[hit]
+
+def bracket_exit(l, h, j, side, sl, tp):
+    """
+    Prima barra dopo j che tocca SL o TP di un bracket (side 1 long, -1 short):
+    (barra, True se SL). Se nella stessa barra si toccano entrambi vince lo SL;
+    (len(l), False) se non esce mai.
+    """
+    n = len(l)
+    if side == 1:
+        x = _first(lambda a, b: (l[a:b] <= sl) | (h[a:b] >= tp), j + 1, n)
+        return x, bool(x < n and l[x] <= sl)
+    x = _first(lambda a, b: (h[a:b] >= sl) | (l[a:b] <= tp), j + 1, n)
+    return x, bool(x < n and h[x] >= sl)
+
+def _first(pred, start, n, chunk=256):
+    """Primo indice >= start per cui pred(a, b) (maschera sulla fetta [a, b)) è vero; n se nessuno."""
+    j = start
+    while j < n:
+        b = min(n, j + chunk)
+        k = np.flatnonzero(pred(j, b))
+        if k.size:
+            return j + int(k[0])
+        j = b
+        chunk *= 2
+    return n
+
+def run_backtest(bars, cfg, equity0=None):
+    """
+    bars: dict di array t,o,h,l,c,v (stesso timeframe per tutto il backtest).
+    Ritorna {"trades", "fills", "equity", "summary"}.
+    """
+    t, o, h, l, c = (np.asarray(bars[k], dtype=float) for k in ("t", "o", "h", "l", "c"))
+    n = len(c)
+    if n < 2:
+        raise ValueError("backtest needs at least 2 bars")
+    bar_ms = float(np.median(np.diff(t)))
+    dt = bar_ms / 1000.0
+
+    a_cfg = cfg.get("alpha", {})
+    tr_cfg = cfg.get("trading", {})
+    risk_cfg = cfg.get("risk", {})
+    mode = tr_cfg.get("mode", "grid")
+    sltp_on = bool(tr_cfg.get("sltp_enabled", True))
+    bracket = mode == "breakout" and sltp_on
+    alpha_on = bool(a_cfg.get("enabled", True))
+    stops = DynamicStops(cfg)
+    atr = atr_sma(h, l, c, stops.atr_len) if bracket else None
+    slip = float(tr_cfg.get("slip_bps", 0.0)) / 1e4
+    target_trades = int(a_cfg.get("daily_trade_target", 6))
+    cooloff_ms = int(a_cfg.get("cooloff_seconds", 900)) * 1000
+    eq0 = float(equity0 if equity0 is not None else risk_cfg.get("portfolio_usdt_fallback", 10_000))
+
+    lookback = max(2, int(round(cfg["safe_mode"].get("lookback_minutes", 30) * 60_000 / bar_ms)))
+    vol = rolling_vol_pct(c, lookback)
+    status = status_codes(vol, cfg)
+    active = status != PANIC
+    lev = pid_leverage(vol, active, cfg, dt)
+    pid_k, pid_dt = pid_steps(dt, cfg)
+    if alpha_on:
+        sig, box_top, box_bot = box_signals(o, h, l, c, **a_cfg)
+    else:
+        sig = np.zeros(n, dtype=np.int8); box_top = box_bot = np.full(n, np.nan)
+    sig_idx = np.flatnonzero((sig != 0) & active)
+
+    fill_bar, fill_qty, fill_px = [], [], []
+    trades = []
+    cash = 0.0; pos = 0.0; realized = 0.0
+    trades_day = {}
+    last_ts = {1: -np.inf, -1: -np.inf}
+    last_res, streak = None, 0
+    exits = []   # heap (exit_bar, seq, trade)
+    book = None  # (placed_at, prices, qtys)
+    last_mid = None; last_status = None
+    n_regrids = 0
+
+    def settle_book(upto):
+        nonlocal cash, pos
+        if book is None or upto <= book[0]:
+            return
+        k, prices, qtys = book
+        for b, q, p in zip(*grid_fills(l, h, k, upto, prices, qtys)):
+            fill_bar.append(int(b)); fill_qty.append(float(q)); fill_px.append(float(p))
+            cash -= q * p; pos += q
+
+    def close_exits(upto):
+        nonlocal last_res, streak, realized
+        while exits and exits[0][0] <= upto:
+            _, _, tr = heapq.heappop(exits)
+            res = tr["result"]
+            streak = streak + 1 if res == last_res else 1
+            last_res = res
+            realized += tr["pl"]
+
+    def sizing(j):
+        eq = eq0 + realized + cash + pos * c[j]
+        cap = max(0.0, min(eq * (risk_cfg.get("max_portfolio_pct", 3.0) / 100.0), eq))
+        base = min(cap, cfg["grid"]["notional_per_side_usdt"])
+        return base * streak_mult(last_res, streak, cfg), max(float(lev[j]), 0.01)
+
+    def place_grid(j, lower, upper, levels, qty):
+        nonlocal book, n_regrids
+        step = (upper - lower) / max(1, levels - 1)
+        prices = lower + np.arange(levels) * step
+        qtys = np.where(prices <= c[j], qty, -qty)
+        book = (j, prices, qtys)
+        n_regrids += 1
+
+    def open_bracket(j, side):
+        adj, lv = sizing(j)
+        qty = adj / c[j] * lv
+        ref = box_top[j] if side == 1 else box_bot[j]
+        ref = ref if np.isfinite(ref) else c[j]
+        bt, bb = box_top[j], box_bot[j]
+        sl, tp = stops.levels("BUY" if side == 1 else "SELL", ref, atr[j],
+                              bt if np.isfinite(bt) else None, bb if np.isfinite(bb) else None)
+        entry = c[j] * (1.0 + side * slip)
+        x, sl_hit = bracket_exit(l, h, j, side, sl, tp)
+        closed = x < n
+        if closed:
+            exit_px = sl * (1.0 - side * slip) if sl_hit else tp
+        else:
+            x, exit_px = n - 1, c[-1]
+        pl = (exit_px - entry) * qty * side
+        # esito dal segno di pl, come nel ledger live
+        res = ("win" if pl > 0 else "loss") if closed else "open"
+        tr = {"side": "BUY" if side == 1 else "SELL", "entry_bar": int(j), "entry_t": int(t[j]),
+              "entry": float(entry), "qty": float(qty), "sl": float(sl), "tp": float(tp),
+              "exit_bar": int(x), "exit_t": int(t[x]), "exit": float(exit_px), "result": res, "pl": float(pl)}
+        trades.append(tr)
+        for b, q, p in ((j, side * qty, entry), (x, -side * qty, exit_px)):
+            fill_bar.append(int(b)); fill_qty.append(float(q)); fill_px.append(float(p))
+        if res != "open":
+            heapq.heappush(exits, (int(x), len(trades), tr))
+
+    def eligible(j):
+        s = int(sig[j])
+        if trades_day.get(int(t[j] // DAY_MS), 0) >= target_trades:
+            return False
+        return t[j] - last_ts[s] >= cooloff_ms
+
+    def move_pred(a, b):
+        cb = c[a:b]
+        return active[a:b] & ((np.abs(cb - last_mid) / cb > 0.003) | (status[a:b] != last_status))
+
+    j = int(np.argmax(active)) if active.any() else n
+    si = 0
+    while j < n:
+        # prossimo segnale utilizzabile (>= j)
+        si = int(np.searchsorted(sig_idx, j, side="left"))
+        while si < len(sig_idx) and not eligible(sig_idx[si]):
+            si += 1
+        j_sig = int(sig_idx[si]) if si < len(sig_idx) else n
+        if mode == "grid" and last_mid is not None:
+            j_move = _first(move_pred, j, min(n, j_sig))
+        elif mode == "grid":
+            j_move = j
+        else:
+            j_move = n
+        e = min(j_sig, j_move)
+        if e >= n:
+            break
+        settle_book(e)
+        close_exits(e)
+        if e == j_sig and eligible(e):
+            s = int(sig[e])
+            day = int(t[e] // DAY_MS)
+            trades_day[day] = trades_day.get(day, 0) + 1
+            last_ts[s] = t[e]
+            if bracket:
+                open_bracket(e, s)
+            else:
+                st = STATUS_NAMES[status[e]]
+                lower, upper, levels = compute_grid(c[e], std_pct=vol[e], cfg=cfg, status=st)
+                micro = max(3, min(6, levels // 2))
+                center = (box_top[e] if s == 1 else box_bot[e]) if np.isfinite(box_top[e]) else c[e]
+                span = max(0.002 * c[e], 0.5 * (upper - lower))
+                adj, lv = sizing(e)
+                place_grid(e, center - span, center + span, micro, adj / max(1, levels) / c[e] * lv)
+        elif e == j_move:
+            st = STATUS_NAMES[status[e]]
+            lower, upper, levels = compute_grid(c[e], std_pct=vol[e], cfg=cfg, status=st)
+            adj, lv = sizing(e)
+            place_grid(e, lower, upper, levels, adj / max(1, levels) / c[e] * lv)
+            last_mid, last_status = c[e], status[e]
+        j = e + 1
+    settle_book(n - 1)
+
+    fb = np.asarray(fill_bar, dtype=np.int64)
+    fq = np.asarray(fill_qty); fp = np.asarray(fill_px)
+    dpos = np.bincount(fb, weights=fq, minlength=n) if fb.size else np.zeros(n)
+    dcash = np.bincount(fb, weights=-fq * fp, minlength=n) if fb.size else np.zeros(n)
+    equity = eq0 + np.cumsum(dcash) + np.cumsum(dpos) * c
+
+    return {"trades": trades, "fills": {"bar": fb, "qty": fq, "px": fp}, "equity": equity,
+            "summary": {**summarize(equity, trades, bar_ms, n_fills=int(fb.size), n_regrids=n_regrids),
+                        "pid_steps_per_bar": pid_k, "pid_dt_s": pid_dt,
+                        "vol_sample_s": dt, "live_vol_sample_s": float(cfg["daemon"]["loop_seconds"])}}
+
+def summarize(equity, trades, bar_ms, n_fills=0, n_regrids=0):
+    eq0 = float(equity[0]) if len(equity) else 0.0
+    peak = np.maximum.accumulate(equity)
+    dd = float(np.max((peak - equity) / np.where(peak > 0, peak, 1.0))) if len(equity) else 0.0
+    rets = np.diff(equity) / np.where(equity[:-1] != 0, equity[:-1], 1.0)
+    sd = float(np.std(rets)) if rets.size else 0.0
+    per_year = 365 * DAY_MS / bar_ms
+    closed = [tr for tr in trades if tr["result"] != "open"]
+    wins = sum(1 for tr in closed if tr["result"] == "win")
+    return {
+        "bars": int(len(equity)),
+        "final_equity": float(equity[-1]),
+        "return_pct": (float(equity[-1]) / eq0 - 1.0) * 100.0 if eq0 else 0.0,
+        "max_drawdown_pct": dd * 100.0,
+        "sharpe": float(np.mean(rets) / sd * np.sqrt(per_year)) if sd > 0 else 0.0,
+        "trades": len(trades),
+        "win_rate": wins / len(closed) if closed else None,
+        "pl_trades": float(sum(tr["pl"] for tr in trades)),
+        "grid_fills": n_fills - 2 * len(trades),
+        "regrids": n_regrids,
+    }
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Backtest offline breakout + grid")
+    ap.add_argument("csv")
+    ap.add_argument("--config", default="config.yaml")
+    ap.add_argument("--tf", default="1m", choices=("1m", "5m"))
+    ap.add_argument("--equity", type=float, default=None)
+    ap.add_argument("--out", default=None)
+    args = ap.parse_args(argv)
+    cfg = load_cfg(args.config)
+    bars = resample(load_csv(args.csv), 5 if args.tf == "5m" else 1)
+    res = run_backtest(bars, cfg, equity0=args.equity)
+    eq = res["equity"]
+    step = max(1, len(eq) // 2000)
+    out = {"summary": res["summary"], "trades": res["trades"],
+           "equity": [[int(bars["t"][i]), float(eq[i])] for i in range(0, len(eq), step)]}
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(out, f)
+    print(json.dumps(res["summary"], indent=2))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,364 @@
+# bench.py — spaces only, LF
+"""
+Benchmark offline dei percorsi caldi del bot con gate di regressione.
+
+  python bench.py [--only calc_atr,loop_e2e] [--out bench.json]
+                  [--baseline bench_baseline.json] [--save-baseline] [--threshold 0.25]
+
+Dati sintetici (random walk di simulator.PricePath) e, per loop_e2e, risposte
+del simulatore locale in-process senza latenza iniettata. Per ogni caso: ops/s
+e percentili di latenza per operazione (misurati su batch). I throughput sono
+normalizzati con un carico Python di riferimento (calibrate) così la baseline
+salvata nel repo resta confrontabile tra macchine diverse: ogni ripetizione
+di un caso è preceduta da una calibrazione e il gate usa la mediana dei
+rapporti (throughput mediano 1 / p50) / calibrazione, così né un picco dello
+scheduler né una deriva della macchina durante la misura spostano il
+confronto. Esce con codice 1 se un caso scende oltre la soglia rispetto alla
+baseline; i micro-casi (p50 di baseline sotto MICRO_US) hanno una soglia più
+larga, perché lì il rumore del timer pesa di più.
+"""
+import os, sys, json, time, random, asyncio, argparse, platform, tempfile
+from util import load_cfg
+
+CASES = {}
+MICRO_US, MICRO_THRESHOLD = 20.0, 0.4
+
+def case(name, batch=1, threshold=None):
+    """Registra un caso: fn(cfg) ritorna op() oppure (op, teardown)."""
+    def deco(fn):
+        CASES[name] = (fn, int(batch), threshold)
+        return fn
+    return deco
+
+def synthetic_bars(n=2000, seed=7, start_price=150.0, vol_bps=8.0):
+    from simulator import PricePath
+    return PricePath(start_price=start_price, vol_bps=vol_bps, history_bars=n, seed=seed).bars[:n]
+
+# --- casi ---
+
+@case("calc_atr", batch=20)
+def _calc_atr(cfg):
+    from main import calc_atr
+    # stesso formato di CandleCache / get_candles: (t, o, h, l, c, v)
+    candles = [(i * 60_000, o, h, l, c, v) for i, (o, h, l, c, v) in enumerate(synthetic_bars(200))]
+    n = int(cfg.get("dynamic_sl", {}).get("atr_len", 14))
+    return lambda: calc_atr(candles, n)
+
+@case("atr_update", batch=1000)
+def _atr_update(cfg):
+    """Una barra chiusa in RollingATR: il costo per barra del loop al posto di calc_atr."""
+    from rolling import RollingATR
+    atr = RollingATR(int(cfg.get("dynamic_sl", {}).get("atr_len", 14)))
+    bars = synthetic_bars(5000)
+    state = {"i": 0}
+
+    def op():
+        i = state["i"]
+        state["i"] = (i + 1) % len(bars)
+        _, h, l, c, _ = bars[i]
+        atr.update(h, l, c)
+    return op
+
+@case("alpha_update", batch=500)
+def _alpha_update(cfg):
+    from alpha import AlphaDetector
+    a = cfg.get("alpha", {})
+    det = AlphaDetector(norm_len=a.get("norm_len", 100), box_len=a.get("box_len", 14), strong_close=a.get("strong_close", True),
+                        min_box_range_pct=a.get("min_box_range_pct", 0.15), max_box_range_pct=a.get("max_box_range_pct", 2.0),
+                        signal_hysteresis_bars=a.get("signal_hysteresis_bars", 2))
+    bars = synthetic_bars(5000)
+    it = iter(())
+
+    def op():
+        nonlocal it
+        b = next(it, None)
+        if b is None:
+            it = iter(bars)
+            b = next(it)
+        det.update(*b)
+    return op
+
+@case("vol_consensus", batch=500)
+def _vol_consensus(cfg):
+    from datafeeds import consensus
+    from rolling import RollingVol
+    vol = RollingVol(maxlen=None, window_s=float(cfg["safe_mode"].get("lookback_minutes", 30)) * 60.0)
+    rng = random.Random(11)
+    mids = [[m * (1 + rng.gauss(0, 1e-4)) for _ in range(3)] for m in (c for _, _, _, c, _ in synthetic_bars(4000))]
+    state = {"i": 0, "ts": 0.0}
+
+    def op():
+        i = state["i"]
+        state["i"] = (i + 1) % len(mids)
+        state["ts"] += 1.0
+        consensus(mids[i], ts=state["ts"], vol=vol)
+    return op
+
+def _depth_diffs(n=2000, seed=5, step_bps=0.5):
+    """
+    Snapshot + n diff di simulator.DepthSim su un random walk a passi di
+    step_bps (un diff ogni 100 ms): livelli [(prezzo, size)] come dal parse.
+    """
+    import simulator
+    from l2book import _levels
+    rng = random.Random(seed)
+    ds = simulator.DepthSim(levels=50, tick=0.01, base_qty=20.0, churn=0.1, rng=rng)
+    m = 150.0
+    ds.step(m * (1 - 1e-4), m * (1 + 1e-4))
+    _, b, a = ds.snapshot()
+    diffs = []
+    for _ in range(n):
+        m *= 1.0 + rng.gauss(0.0, step_bps / 1e4)
+        diffs.append(ds.step(m * (1 - 1e-4), m * (1 + 1e-4))[2:])
+    return (_levels(b), _levels(a)), [(_levels(db), _levels(da)) for db, da in diffs]
+
+@case("l2_update", batch=500)
+def _l2_update(cfg):
+    """Un diff (una decina di livelli) su L2Book: costo per messaggio del book a array ordinati."""
+    from l2book import L2Book
+    (b, a), diffs = _depth_diffs()
+    book = L2Book(int((cfg.get("datafeed", {}).get("depth", {}) or {}).get("max_levels", 100)))
+    state = {"i": 0}
+
+    def op():
+        i = state["i"]
+        if i == 0:
+            book.snapshot(b, a, 0)
+        state["i"] = (i + 1) % len(diffs)
+        book.update(*diffs[i], seq=i + 1)
+    return op
+
+@case("l2_slippage", batch=200)
+def _l2_slippage(cfg):
+    """Microprice + slippage di un market sul book consolidato di tre venue."""
+    from l2book import L2Book, estimate_slippage, micro_weights
+    (b, a), diffs = _depth_diffs()
+    books = []
+    for k in range(3):
+        book = L2Book(100)
+        book.snapshot(b, a, 0)
+        for d in diffs[:50 * (k + 1)]:
+            book.update(*d)
+        books.append(book)
+    w = micro_weights()
+    qty = float(cfg["grid"]["notional_per_side_usdt"]) / 150.0 * 20
+
+    def op():
+        for book in books:
+            book.microprice(w)
+        estimate_slippage(books, "BUY", qty)
+    return op
+
+@case("compute_grid", batch=1000)
+def _compute_grid(cfg):
+    from grid import compute_grid
+    return lambda: compute_grid(150.0, 0.8, cfg, "WARN")
+
+@case("norm_price_qty", batch=1000)
+def _norm_price_qty(cfg):
+    from pionex_api import Pionex
+    pnx = Pionex("k", "s", cfg)
+    pnx.cache.put(("market_info", cfg["pionex"]["symbol"]), {"tick_size": 0.001, "step_size": 0.01})
+
+    def op():
+        pnx._norm_price(150.12345)
+        pnx._norm_qty(1.23456)
+    return op, pnx.close
+
+@case("ledger_mark_exit", batch=100)
+def _ledger_mark_exit(cfg):
+    from ledger import Ledger
+    d = tempfile.mkdtemp(prefix="bench-ledger-")
+    lad = Ledger(os.path.join(d, "ledger.db"), legacy_json=None)
+    for i in range(20):
+        side = "BUY" if i % 2 else "SELL"
+        lad.record_entry(side, 1.0, 150.0, sl=140.0 if side == "BUY" else 160.0, tp=160.0 if side == "BUY" else 140.0, ts=1_700_000_000 + i)
+    # percorso comune: nessuna posizione attraversata
+    return (lambda: lad.mark_exit_if_crossed(150.5, 1_700_000_100)), lad.close
+
+@case("loop_e2e", batch=1, threshold=0.5)
+def _loop_e2e(cfg):
+    """Un giro completo quote -> candles -> fills -> decide -> report contro il simulatore (griglia ripiazzata a ogni giro)."""
+    import simulator
+    from main import Engine, _Wakeup
+    s_cfg = json.loads(json.dumps(cfg))
+    s_cfg["simulator"] = {**(s_cfg.get("simulator") or {}), "faults": {"default": {"latency_ms": 0, "jitter_ms": 0, "error_rate": 0.0}},
+                          "rate_limit": {}, "ws_drop_rate": 0.0}
+    sim = simulator.Simulator(s_cfg)
+    port, stop_sim = simulator.serve_in_thread(sim)
+    e_cfg = simulator.sim_config(s_cfg, "127.0.0.1", port)
+    e_cfg["datafeed"]["stream"]["enabled"] = False
+    e_cfg["websocket"]["fills_enabled"] = False
+    e_cfg["daemon"]["snapshot"]["enabled"] = False
+    e_cfg["pionex"]["rate_limit"]["enabled"] = False
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix="bench-e2e-"))
+    eng = Engine(e_cfg)
+    loop = eng.md.loop
+    eng.stop = asyncio.Event()
+    eng.quote_evt = eng.fill_evt = eng.decide_evt = _Wakeup(loop)
+
+    async def one():
+        eng.last_mid = None
+        await eng._quote(0.0)
+        await eng._candles()
+        await eng._fills()
+        await eng._decide()
+        await eng._report()
+
+    def teardown():
+        try: eng.close()
+        finally:
+            os.chdir(cwd)
+            stop_sim()
+    return (lambda: loop.run_until_complete(one())), teardown
+
+# --- misura ---
+
+def _median(xs):
+    xs = sorted(xs)
+    n = len(xs)
+    return xs[n // 2] if n % 2 else (xs[n // 2 - 1] + xs[n // 2]) / 2.0
+
+def calibrate(min_time_s=0.2, repeat=3):
+    """ops/s (mediana di `repeat` misure) di un carico Python fisso (aritmetica float + dict + list) usato per normalizzare."""
+    def work():
+        d = {}
+        x = 1.0
+        for i in range(200):
+            x = x * 1.0000001 + i
+            d[i & 15] = x
+        return sorted(d.values())
+    return _median([_rate(measure(work, 10, min_time_s, warmup=20)) for _ in range(max(1, repeat))])
+
+def _rate(r):
+    """Throughput mediano (ops/s) da p50."""
+    return 1e6 / r["p50_us"] if r["p50_us"] > 0 else float("inf")
+
+def measure(op, batch, min_time_s, warmup=None):
+    for _ in range(warmup if warmup is not None else min(batch * 5, 200)):
+        op()
+    pc = time.perf_counter_ns
+    samples = []
+    total = 0
+    t_end = time.perf_counter() + min_time_s
+    while time.perf_counter() < t_end or len(samples) < 20:
+        t0 = pc()
+        for _ in range(batch):
+            op()
+        dt = pc() - t0
+        total += dt
+        samples.append(dt / batch)
+    samples.sort()
+    n = len(samples)
+    q = lambda p: samples[min(n - 1, int(p * n))] / 1000.0
+    return {"ops_s": batch * n / (total / 1e9), "ops": batch * n,
+            "p50_us": q(0.50), "p95_us": q(0.95), "p99_us": q(0.99), "max_us": samples[-1] / 1000.0}
+
+def run_case(name, cfg, min_time_s, repeat, cal_time_s=0.1):
+    """Ripetizione mediana del caso; "norm" = mediana di throughput / calibrazione misurata subito prima."""
+    fn, batch, _ = CASES[name]
+    r = fn(cfg)
+    op, teardown = r if isinstance(r, tuple) else (r, None)
+    runs, norms = [], []
+    try:
+        for _ in range(max(1, repeat)):
+            cal = calibrate(cal_time_s, repeat=1)
+            runs.append(measure(op, batch, min_time_s))
+            norms.append(_rate(runs[-1]) / cal)
+    finally:
+        if teardown is not None:
+            teardown()
+    out = sorted(runs, key=lambda x: x["p50_us"])[len(runs) // 2]
+    out["norm"] = _median(norms)
+    return out
+
+def check(results, ref_ops, baseline, threshold):
+    """Ritorna la lista delle regressioni rispetto alla baseline (throughput normalizzato)."""
+    fails = []
+    b_ref = baseline.get("calibration_ops_s") or ref_ops
+    for name, r in results.items():
+        b = baseline.get("cases", {}).get(name)
+        if not b:
+            continue
+        thr = CASES[name][2] if CASES[name][2] is not None else threshold
+        if b["p50_us"] < MICRO_US:
+            thr = max(thr, MICRO_THRESHOLD)
+        if r.get("norm") and b.get("norm"):
+            ratio = r["norm"] / b["norm"]
+        else:
+            ratio = (_rate(r) / ref_ops) / (_rate(b) / b_ref)
+        r["vs_baseline"] = ratio
+        if ratio < 1.0 - thr:
+            fails.append(f"{name}: {ratio:.2f}x baseline (soglia {1.0 - thr:.2f}x)")
+    return fails
+
+def rescale_case(c, k):
+    """Riporta un caso a una calibrazione k volte più veloce: ops_s per k, tutte le latenze (*_us) diviso k."""
+    return {n: (v * k if n == "ops_s" else v / k if n.endswith("_us") else v) for n, v in c.items()}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark dei percorsi caldi con gate di regressione")
+    ap.add_argument("--config", default="config.yaml")
+    ap.add_argument("--only", default=None, help="casi separati da virgola (default: tutti)")
+    ap.add_argument("--baseline", default="bench_baseline.json")
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--threshold", type=float, default=0.25, help="calo massimo di ops/s ammesso (0.25 = -25%%)")
+    ap.add_argument("--min-time", type=float, default=0.5, help="secondi di misura per ripetizione")
+    ap.add_argument("--repeat", type=int, default=5, help="ripetizioni per caso (si usa la mediana)")
+    ap.add_argument("--out", default=None)
+    args = ap.parse_args(argv)
+    cfg = load_cfg(args.config)
+    names = [n for n in (args.only.split(",") if args.only else CASES) if n]
+    unknown = [n for n in names if n not in CASES]
+    if unknown:
+        ap.error(f"casi sconosciuti: {', '.join(unknown)} (disponibili: {', '.join(CASES)})")
+
+    ref = calibrate()
+    results = {}
+    for n in names:
+        results[n] = run_case(n, cfg, args.min_time, args.repeat)
+        r = results[n]
+        print(f"{n:18s} {r['ops_s']:14,.0f} ops/s  p50 {r['p50_us']:10.2f}us  p95 {r['p95_us']:10.2f}us  p99 {r['p99_us']:10.2f}us",
+              flush=True)
+
+    out = {"ts": time.time(), "python": platform.python_version(), "machine": platform.machine(),
+           "calibration_ops_s": ref, "cases": results}
+    fails = []
+    if args.save_baseline:
+        prev = {}
+        try:
+            with open(args.baseline, "r") as f:
+                prev = json.load(f)
+        except Exception:
+            pass
+        if prev.get("calibration_ops_s") and args.only:
+            # aggiornamento parziale: i casi non rimisurati restano, riportati alla nuova calibrazione
+            # ("norm" è già relativo alla calibrazione e resta invariato)
+            k = ref / prev["calibration_ops_s"]
+            out["cases"] = {**{n: rescale_case(c, k) for n, c in prev.get("cases", {}).items()}, **results}
+        with open(args.baseline, "w") as f:
+            json.dump(out, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline salvata in {args.baseline}")
+    else:
+        try:
+            with open(args.baseline, "r") as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            baseline = None
+            print(f"nessuna baseline ({args.baseline}): solo misura")
+        if baseline:
+            fails = check(results, ref, baseline, args.threshold)
+            for n, r in results.items():
+                if "vs_baseline" in r:
+                    print(f"{n:18s} {r['vs_baseline']:.2f}x baseline")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({**out, "regressions": fails}, f, indent=2)
+    for msg in fails:
+        print(f"REGRESSIONE {msg}", file=sys.stderr)
+    return 1 if fails else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
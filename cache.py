@@ -0,0 +1,60 @@
+import time, threading
+
+class TTLCache:
+    """
+    Cache per risorsa con TTL, invalidata esplicitamente sugli eventi (ordini
+    nostri, fill). Le chiavi sono "risorsa" o (risorsa, ...); TTL e contatori
+    hit/miss sono per risorsa. I None e le eccezioni del loader non vengono
+    memorizzati; un valore caricato mentre arrivava un'invalidazione viene scartato.
+    """
+    def __init__(self, ttls=None, default_ttl=5.0):
+        self.ttls = dict(ttls or {})
+        self.default_ttl = float(default_ttl)
+        self._data = {}
+        self._gen = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _res(key):
+        return key[0] if isinstance(key, tuple) else key
+
+    def _st(self, res):
+        return self._stats.setdefault(res, {"hit": 0, "miss": 0, "invalidated": 0})
+
+    def get(self, key, loader, ttl=None):
+        res = self._res(key)
+        with self._lock:
+            e = self._data.get(key)
+            if e is not None and e[0] > time.monotonic():
+                self._st(res)["hit"] += 1
+                return e[1]
+            self._st(res)["miss"] += 1
+            gen = self._gen.get(res, 0)
+        value = loader()
+        if value is not None:
+            self.put(key, value, ttl, _gen=gen)
+        return value
+
+    def put(self, key, value, ttl=None, _gen=None):
+        res = self._res(key)
+        ttl = self.ttls.get(res, self.default_ttl) if ttl is None else ttl
+        with self._lock:
+            if _gen is not None and self._gen.get(res, 0) != _gen:
+                return
+            self._data[key] = (time.monotonic() + float(ttl), value)
+
+    def invalidate(self, *resources):
+        """Invalida le risorse indicate (tutte se nessuna)."""
+        with self._lock:
+            for key in list(self._data):
+                res = self._res(key)
+                if not resources or res in resources:
+                    del self._data[key]
+            for res in (resources or set(self._gen) | set(self._stats)):
+                self._gen[res] = self._gen.get(res, 0) + 1
+                self._st(res)["invalidated"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {r: dict(s) for r, s in self._stats.items()}
@@ -33,6 +33,29 @@ function fillOrders(id, arr){
   }
 }
 
+function fillRows(id, rows, cols){
+  const tb=$(id);
+  tb.innerHTML="";
+  if(!rows.length){
+    const tr=document.createElement("tr");
+    tr.innerHTML=`<td colspan="${cols}">—</td>`;
+    tb.appendChild(tr);
+    return;
+  }
+  for(const r of rows){
+    const tr=document.createElement("tr");
+    tr.innerHTML=r.map(v=>`<td>${v}</td>`).join("");
+    tb.appendChild(tr);
+  }
+}
+
+function fillMetrics(m){
+  const stages = Object.entries((m && m.stages) || {}).sort((a,b)=>a[0].localeCompare(b[0]));
+  fillRows("metrics-stages", stages.map(([k,h])=>[k, h.n, pretty(h.p50_ms,2), pretty(h.p95_ms,2), pretty(h.p99_ms,2), pretty(h.max_ms,2)]), 6);
+  const calls = [...Object.entries((m && m.venues) || {}), ...Object.entries((m && m.endpoints) || {})];
+  fillRows("metrics-calls", calls.map(([k,c])=>[k, c.calls, c.errors, pretty(c.p50_ms,1), pretty(c.p95_ms,1)]), 5);
+}
+
 // Minimal line chart without external libs
 function plotLine(canvas, data){
   const ctx=canvas.getContext("2d");
@@ -234,6 +257,7 @@ function render(s,o,c,r,range){
   // Orders
   fillOrders("open-orders", (o && o.open) || []);
   fillOrders("closed-orders", (o && o.closed) || []);
+  fillMetrics(s && s.metrics);
 
   // Chart data
   let series=[];
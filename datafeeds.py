@@ -1,6 +1,8 @@
 import time, asyncio, aiohttp
-from statistics import fmean, pstdev
+from math import fsum
+from statistics import fmean
 from collections import deque
+from rolling import RollingVol
 
 BINANCE_F = "https://fapi.binance.com"
 BYBIT = "https://api.bybit.com"
@@ -10,7 +12,14 @@ BINANCE_SYMBOL = "SOLUSDT"
 BYBIT_SYMBOL   = "SOLUSDT"
 OKX_INST_ID    = "SOL-USDT-SWAP"
 
-_vol_window = deque(maxlen=300)
+_vol = RollingVol(maxlen=300)
+
+def set_base_urls(binance=None, bybit=None, okx=None):
+    """Override degli host REST delle venue (es. simulator.py); None lascia il default."""
+    global BINANCE_F, BYBIT, OKX
+    if binance: BINANCE_F = binance.rstrip("/")
+    if bybit: BYBIT = bybit.rstrip("/")
+    if okx: OKX = okx.rstrip("/")
 
 async def fetch_json(session, url, params=None):
     for _ in range(2):
@@ -22,50 +31,116 @@ async def fetch_json(session, url, params=None):
             await asyncio.sleep(0.2)
     return None
 
-async def binance_mid(session):
-    j = await fetch_json(session, f"{BINANCE_F}/fapi/v1/ticker/bookTicker", {"symbol": BINANCE_SYMBOL})
+def instrument(pionex, binance=None, bybit=None, okx=None):
+    """
+    Simboli di uno strumento per venue. Default: stesso simbolo di Pionex su
+    Binance/Bybit, perpetuo <BASE>-USDT-SWAP su OKX.
+    """
+    base = pionex[:-4] if pionex.upper().endswith("USDT") else pionex
+    return {"pionex": pionex, "binance": binance or pionex, "bybit": bybit or pionex,
+            "okx": okx or f"{base.upper()}-USDT-SWAP"}
+
+def instrument_of(entry):
+    """Strumento da una voce di cfg["symbols"]: simbolo Pionex o dict con simboli per venue e tick/step."""
+    entry = {"pionex": entry} if isinstance(entry, str) else entry
+    inst = instrument(entry["pionex"], entry.get("binance"), entry.get("bybit"), entry.get("okx"))
+    inst.update({k: entry[k] for k in ("tick_size", "step_size") if k in entry})
+    return inst
+
+def default_instrument():
+    return {"pionex": BINANCE_SYMBOL, "binance": BINANCE_SYMBOL, "bybit": BYBIT_SYMBOL, "okx": OKX_INST_ID}
+
+async def binance_mid(session, symbol=None):
+    j = await fetch_json(session, f"{BINANCE_F}/fapi/v1/ticker/bookTicker", {"symbol": symbol or BINANCE_SYMBOL})
     if not j: return None
     try:
         b = float(j["bidPrice"]); a = float(j["askPrice"]); return (a+b)/2.0
     except Exception: return None
 
-async def bybit_mid(session):
-    j = await fetch_json(session, f"{BYBIT}/v5/market/tickers", {"category":"linear","symbol": BYBIT_SYMBOL})
+async def bybit_mid(session, symbol=None):
+    j = await fetch_json(session, f"{BYBIT}/v5/market/tickers", {"category":"linear","symbol": symbol or BYBIT_SYMBOL})
     try:
         it = j.get("result",{}).get("list",[]); i = it[0]
         b = float(i["bid1Price"]); a = float(i["ask1Price"]); return (a+b)/2.0
     except Exception: return None
 
-async def okx_mid(session):
-    j = await fetch_json(session, f"{OKX}/api/v5/market/ticker", {"instId": OKX_INST_ID})
+async def okx_mid(session, symbol=None):
+    j = await fetch_json(session, f"{OKX}/api/v5/market/ticker", {"instId": symbol or OKX_INST_ID})
     try:
         i = j.get("data",[])[0]
         b = float(i["bidPx"]); a = float(i["askPx"]); return (a+b)/2.0
     except Exception: return None
 
 def aggregate_quote_sync():
-    return asyncio.run(_aggregate_quote())
+    return default_client().aggregate_quote_sync()
+
+async def _aggregate_quote(session, vol=None):
+    mids = await asyncio.gather(binance_mid(session), bybit_mid(session), okx_mid(session))
+    return consensus(mids, vol=vol)
+
+def _mid_of(b, a):
+    try:
+        b, a = float(b), float(a)
+        return (a + b) / 2.0 if a > 0 and b > 0 else None
+    except (TypeError, ValueError):
+        return None
 
-async def _aggregate_quote():
-    async with aiohttp.ClientSession() as session:
-        mids = await asyncio.gather(binance_mid(session), bybit_mid(session), okx_mid(session))
-    quotes = [q for q in mids if q is not None]
-    ts = time.time()
+async def binance_mids(session, symbols):
+    """Tutti i bookTicker in una richiesta (senza symbol), filtrati su symbols: {symbol: mid}."""
+    j = await fetch_json(session, f"{BINANCE_F}/fapi/v1/ticker/bookTicker")
+    want = set(symbols)
+    return {i["symbol"]: _mid_of(i.get("bidPrice"), i.get("askPrice")) for i in (j or []) if isinstance(i, dict) and i.get("symbol") in want}
+
+async def bybit_mids(session, symbols):
+    j = await fetch_json(session, f"{BYBIT}/v5/market/tickers", {"category": "linear"})
+    want = set(symbols)
+    arr = (j or {}).get("result", {}).get("list", []) if isinstance(j, dict) else []
+    return {i["symbol"]: _mid_of(i.get("bid1Price"), i.get("ask1Price")) for i in arr if i.get("symbol") in want}
+
+async def okx_mids(session, symbols):
+    j = await fetch_json(session, f"{OKX}/api/v5/market/tickers", {"instType": "SWAP"})
+    want = set(symbols)
+    arr = (j or {}).get("data", []) if isinstance(j, dict) else []
+    return {i["instId"]: _mid_of(i.get("bidPx"), i.get("askPx")) for i in arr if i.get("instId") in want}
+
+async def batch_mids(session, insts):
+    """
+    Una richiesta per venue per tutti gli strumenti (endpoint ticker senza
+    simbolo). Ritorna {pionex_symbol: [mid_binance, mid_bybit, mid_okx]}.
+    """
+    res = await asyncio.gather(binance_mids(session, [i["binance"] for i in insts]),
+                               bybit_mids(session, [i["bybit"] for i in insts]),
+                               okx_mids(session, [i["okx"] for i in insts]), return_exceptions=True)
+    res = [r if isinstance(r, dict) else {} for r in res]
+    return {i["pionex"]: [res[0].get(i["binance"]), res[1].get(i["bybit"]), res[2].get(i["okx"])] for i in insts}
+
+def consensus(mids, ts=None, vol=None, sample=True, weights=None):
+    """
+    vol: RollingVol dell'istanza chiamante; None = stimatore condiviso di modulo.
+    sample=False legge la volatilità senza aggiungere il mid (campionamento a cadenza fissa).
+    weights: pesi per venue allineati a mids (es. profondità del book); None o
+    tutti nulli = media semplice.
+    """
+    if weights is not None:
+        pairs = [(q, w) for q, w in zip(mids, weights) if q is not None]
+        quotes = [q for q, _ in pairs]
+        wsum = fsum(w for _, w in pairs)
+    else:
+        quotes = [q for q in mids if q is not None]
+    ts = ts or time.time()
     if len(quotes) == 0:
         return None, 0.0, 0.0, ts, 0
-    mid = fmean(quotes)
+    mid = fsum(q * w for q, w in pairs) / wsum if weights is not None and wsum > 0 else fmean(quotes)
     qmax, qmin = max(quotes), min(quotes)
     divergence_bps = (qmax - qmin) / mid * 1e4
-    _vol_window.append(mid)
-    if len(_vol_window) > 2:
-        rets = [(_vol_window[i]/_vol_window[i-1]-1.0) for i in range(1, len(_vol_window))]
-        vol = (pstdev(rets) * 100.0) if len(rets) > 1 else 0.0
-    else:
-        vol = 0.0
-    return mid, vol, divergence_bps, ts, len(quotes)
+    v = vol or _vol
+    vol_pct = v.update(mid, ts) if sample else v.vol_pct()
+    return mid, vol_pct, divergence_bps, ts, len(quotes)
 
-async def binance_klines(session, interval="1m", limit=200):
-    j = await fetch_json(session, f"{BINANCE_F}/fapi/v1/klines", {"symbol": BINANCE_SYMBOL, "interval": interval, "limit": limit})
+async def binance_klines(session, interval="1m", limit=200, since=None, symbol=None):
+    params = {"symbol": symbol or BINANCE_SYMBOL, "interval": interval, "limit": limit}
+    if since is not None: params["startTime"] = int(since)
+    j = await fetch_json(session, f"{BINANCE_F}/fapi/v1/klines", params)
     if not j: return []
     out = []
     for k in j:
@@ -73,8 +148,10 @@ async def binance_klines(session, interval="1m", limit=200):
         out.append((t,o,h,l,c,v))
     return out
 
-async def bybit_klines(session, interval="1", limit=200):
-    j = await fetch_json(session, f"{BYBIT}/v5/market/kline", {"category":"linear","symbol": BYBIT_SYMBOL, "interval": interval, "limit": limit})
+async def bybit_klines(session, interval="1", limit=200, since=None, symbol=None):
+    params = {"category":"linear","symbol": symbol or BYBIT_SYMBOL, "interval": interval, "limit": limit}
+    if since is not None: params["start"] = int(since)
+    j = await fetch_json(session, f"{BYBIT}/v5/market/kline", params)
     if not j: return []
     arr = j.get("result",{}).get("list",[])
     out = []
@@ -83,8 +160,11 @@ async def bybit_klines(session, interval="1", limit=200):
         out.append((t,o,h,l,c,v))
     return out
 
-async def okx_klines(session, bar="1m", limit=200):
-    j = await fetch_json(session, f"{OKX}/api/v5/market/candles", {"instId": OKX_INST_ID, "bar": bar, "limit": limit})
+async def okx_klines(session, bar="1m", limit=200, since=None, symbol=None):
+    params = {"instId": symbol or OKX_INST_ID, "bar": bar, "limit": limit}
+    # "before" è esclusivo: -1 per includere anche la barra in corso
+    if since is not None: params["before"] = int(since) - 1
+    j = await fetch_json(session, f"{OKX}/api/v5/market/candles", params)
     if not j: return []
     arr = j.get("data",[])
     out = []
@@ -94,14 +174,276 @@ async def okx_klines(session, bar="1m", limit=200):
     return out
 
 def get_candles_sync(timeframe="1m", limit=200):
-    return asyncio.run(_get_candles(timeframe, limit))
-
-async def _get_candles(timeframe, limit):
-    async with aiohttp.ClientSession() as session:
-        if timeframe in ("1m","1"):
-            res = await binance_klines(session, "1m", limit) or await bybit_klines(session, "1", limit) or await okx_klines(session, "1m", limit)
-            return res
-        elif timeframe in ("5m","5"):
-            res = await binance_klines(session, "5m", limit) or await bybit_klines(session, "5", limit) or await okx_klines(session, "5m", limit)
-            return res
+    return default_client().get_candles_sync(timeframe, limit)
+
+async def _get_candles(session, timeframe, limit):
+    if timeframe in ("1m","1"):
+        res = await binance_klines(session, "1m", limit) or await bybit_klines(session, "1", limit) or await okx_klines(session, "1m", limit)
+        return res
+    elif timeframe in ("5m","5"):
+        res = await binance_klines(session, "5m", limit) or await bybit_klines(session, "5", limit) or await okx_klines(session, "5m", limit)
+        return res
+    return []
+
+KLINE_FETCHERS = (("binance", binance_klines), ("bybit", bybit_klines), ("okx", okx_klines))
+TF_MS = {"1m": 60_000, "5m": 300_000}
+TF_VENUE = {
+    "1m": {"binance": "1m", "bybit": "1", "okx": "1m"},
+    "5m": {"binance": "5m", "bybit": "5", "okx": "5m"},
+}
+
+def norm_tf(timeframe):
+    return {"1": "1m", "5": "5m"}.get(timeframe, timeframe)
+
+def merge_candles(series, bars):
+    """Fonde barre (t,o,h,l,c,v) ordinate: aggiorna in place la barra in corso, scarta i duplicati."""
+    added = 0
+    for b in bars:
+        if series and b[0] <= series[-1][0]:
+            if b[0] == series[-1][0]:
+                series[-1] = b
+            continue
+        series.append(b)
+        added += 1
+    return added
+
+class CandleCache:
+    """
+    Candele in memoria per (venue, timeframe): backfill una volta sola, poi solo
+    le barre dalla open time dell'ultima memorizzata in avanti. inst: simboli
+    per venue (instrument()); None = strumento di default del modulo.
+    """
+    def __init__(self, maxlen=200, timeframes=("1m", "5m"), hedge_delay_s=None, deadline_s=None, inst=None):
+        self.inst = inst
+        self.maxlen = int(maxlen)
+        self.timeframes = tuple(timeframes)
+        self.hedge_delay_s = hedge_delay_s
+        self.deadline_s = deadline_s
+        self._series = {}
+        self.stats = {"backfills": 0, "incremental": 0, "bars_fetched": 0, "timeouts": 0, "wins": {}}
+        self.last_fetch = None
+
+    async def _refresh(self, session, venue, fetch, tf):
+        s = self._series.get((venue, tf))
+        now_ms = time.time() * 1000
+        if not s or now_ms - s[-1][0] > self.maxlen * TF_MS[tf]:
+            bars = await fetch(session, TF_VENUE[tf][venue], self.maxlen, symbol=self.inst and self.inst[venue])
+            if not bars: return None
+            s = self._series[(venue, tf)] = deque(maxlen=self.maxlen)
+            self.stats["backfills"] += 1
+        else:
+            n = min(self.maxlen, int((now_ms - s[-1][0]) // TF_MS[tf]) + 2)
+            bars = await fetch(session, TF_VENUE[tf][venue], n, since=s[-1][0], symbol=self.inst and self.inst[venue])
+            if not bars: return None
+            self.stats["incremental"] += 1
+        self.stats["bars_fetched"] += len(bars)
+        merge_candles(s, bars)
+        return s
+
+    def _record(self, tf, venue, t0):
+        ms = (time.perf_counter() - t0) * 1000.0
+        self.last_fetch = {"tf": tf, "venue": venue, "ms": ms}
+        if venue:
+            self.stats["wins"][venue] = self.stats["wins"].get(venue, 0) + 1
+        else:
+            self.stats["timeouts"] += 1
+
+    async def get(self, session, timeframe="1m"):
+        tf = norm_tf(timeframe)
+        if tf not in TF_MS: return []
+        if self.hedge_delay_s is not None:
+            return await self._get_hedged(session, tf)
+        t0 = time.perf_counter()
+        for venue, fetch in KLINE_FETCHERS:
+            s = await self._refresh(session, venue, fetch, tf)
+            if s:
+                self._record(tf, venue, t0)
+                return list(s)
+        self._record(tf, None, t0)
+        return []
+
+    async def _get_hedged(self, session, tf):
+        """
+        Parte la venue primaria, poi una di backup ogni hedge_delay_s (o subito se
+        la precedente fallisce). Vince la prima risposta valida, le altre vengono
+        cancellate; oltre deadline_s si rinuncia.
+        """
+        t0 = time.perf_counter()
+        deadline = t0 + (self.deadline_s or float("inf"))
+        tasks = {}
+        nxt = 0
+        next_launch = t0
+        try:
+            while True:
+                now = time.perf_counter()
+                if nxt < len(KLINE_FETCHERS) and now >= next_launch:
+                    venue, fetch = KLINE_FETCHERS[nxt]; nxt += 1
+                    tasks[asyncio.ensure_future(self._refresh(session, venue, fetch, tf))] = venue
+                    next_launch = now + self.hedge_delay_s
+                if not tasks or now >= deadline:
+                    break
+                wake = min(deadline, next_launch) if nxt < len(KLINE_FETCHERS) else deadline
+                done, _ = await asyncio.wait(tasks, timeout=max(0.0, wake - time.perf_counter()),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    venue = tasks.pop(t)
+                    s = None if t.cancelled() or t.exception() else t.result()
+                    if s:
+                        self._record(tf, venue, t0)
+                        return list(s)
+                    next_launch = time.perf_counter()
+        finally:
+            for t in tasks:
+                t.cancel()
+        self._record(tf, None, t0)
         return []
+
+    def get_state(self):
+        return {f"{v}|{tf}": [list(b) for b in s] for (v, tf), s in self._series.items()}
+
+    def set_state(self, st):
+        for key, bars in (st or {}).items():
+            venue, _, tf = key.partition("|")
+            if tf in TF_MS and bars:
+                s = self._series[(venue, tf)] = deque(maxlen=self.maxlen)
+                merge_candles(s, [(int(b[0]), *map(float, b[1:6])) for b in bars])
+
+    async def warm(self, session):
+        for tf in self.timeframes:
+            await self.get(session, tf)
+
+class MarketData:
+    """
+    Client persistente per i datafeed: un solo event loop e una ClientSession
+    con connessioni keep-alive per venue, riusate tra un loop e l'altro.
+    """
+    def __init__(self, timeout=5, keepalive_s=75, limit_per_host=4, hedge_delay_s=None, deadline_s=None, vol=None, metrics=None):
+        self.timeout = timeout
+        self.keepalive_s = keepalive_s
+        self.limit_per_host = limit_per_host
+        self.loop = asyncio.new_event_loop()
+        self._session = None
+        self._stats = {"requests": 0, "new": 0, "reused": 0, "hosts": {}}
+        self.candle_cache = CandleCache(hedge_delay_s=hedge_delay_s, deadline_s=deadline_s)
+        self.vol = vol or RollingVol(maxlen=300)
+        self.metrics = metrics
+        # modalità multi-simbolo: ticker di tutti gli strumenti in una richiesta per venue
+        self.instruments = []
+        self.batch_max_age_s = 1.0
+        self._batch = None
+        self._batch_task = None
+        self._batches = 0
+
+    def _host_stats(self, host):
+        return self._stats["hosts"].setdefault(host or "?", {"requests": 0, "new": 0, "reused": 0})
+
+    def _trace_config(self):
+        tc = aiohttp.TraceConfig()
+
+        async def _on_start(session, ctx, params):
+            ctx.host = params.url.host
+            ctx.t0 = time.perf_counter()
+            self._stats["requests"] += 1
+            self._host_stats(ctx.host)["requests"] += 1
+
+        async def _on_new(session, ctx, params):
+            self._stats["new"] += 1
+            self._host_stats(getattr(ctx, "host", None))["new"] += 1
+
+        async def _on_reuse(session, ctx, params):
+            self._stats["reused"] += 1
+            self._host_stats(getattr(ctx, "host", None))["reused"] += 1
+
+        async def _on_end(session, ctx, params):
+            if self.metrics is not None:
+                self.metrics.call("venue", ctx.host, (time.perf_counter() - ctx.t0) * 1000.0, error=params.response.status >= 400)
+
+        async def _on_exc(session, ctx, params):
+            if self.metrics is not None:
+                self.metrics.call("venue", getattr(ctx, "host", "?"), (time.perf_counter() - getattr(ctx, "t0", time.perf_counter())) * 1000.0, error=True)
+
+        tc.on_request_start.append(_on_start)
+        tc.on_request_end.append(_on_end)
+        tc.on_request_exception.append(_on_exc)
+        tc.on_connection_create_end.append(_on_new)
+        tc.on_connection_reuseconn.append(_on_reuse)
+        return tc
+
+    async def session(self):
+        if self._session is None or self._session.closed:
+            conn = aiohttp.TCPConnector(limit_per_host=self.limit_per_host,
+                                        keepalive_timeout=self.keepalive_s, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=conn, trace_configs=[self._trace_config()])
+        return self._session
+
+    async def aggregate_quote(self, inst=None, vol=None):
+        if inst is None:
+            return await _aggregate_quote(await self.session(), vol=vol or self.vol)
+        return consensus(await self.instrument_mids(inst["pionex"]), vol=vol or self.vol)
+
+    async def instrument_mids(self, symbol):
+        """
+        Mid per venue di `symbol` dall'ultimo batch_mids() su self.instruments:
+        riusato per batch_max_age_s, i fetch concorrenti condividono la stessa richiesta.
+        """
+        b = self._batch
+        if b is None or time.monotonic() - b[0] > self.batch_max_age_s:
+            if self._batch_task is None or self._batch_task.done():
+                self._batch_task = asyncio.ensure_future(self._fetch_batch())
+            b = await asyncio.shield(self._batch_task)
+        return b[1].get(symbol) or [None, None, None]
+
+    async def _fetch_batch(self):
+        mids = await batch_mids(await self.session(), self.instruments)
+        self._batch = (time.monotonic(), mids)
+        self._batches += 1
+        return self._batch
+
+    async def get_candles(self, timeframe="1m", limit=200):
+        return await _get_candles(await self.session(), timeframe, limit)
+
+    async def candles(self, timeframe="1m"):
+        return await self.candle_cache.get(await self.session(), timeframe)
+
+    async def warm_candles(self):
+        await self.candle_cache.warm(await self.session())
+
+    def aggregate_quote_sync(self):
+        return self.loop.run_until_complete(self.aggregate_quote())
+
+    def get_candles_sync(self, timeframe="1m", limit=200):
+        return self.loop.run_until_complete(self.get_candles(timeframe, limit))
+
+    def candles_sync(self, timeframe="1m"):
+        return self.loop.run_until_complete(self.candles(timeframe))
+
+    def warm_candles_sync(self):
+        return self.loop.run_until_complete(self.warm_candles())
+
+    def stats(self, candle_cache=None):
+        """candle_cache: cache del simbolo chiamante (default quella di MarketData)."""
+        s = self._stats
+        cc = candle_cache or self.candle_cache
+        return {
+            "requests": s["requests"],
+            "conn_new": s["new"],
+            "conn_reused": s["reused"],
+            "reuse_ratio": (s["reused"] / s["requests"]) if s["requests"] else 0.0,
+            "quote_batches": self._batches,
+            "hosts": {h: dict(v) for h, v in s["hosts"].items()},
+            "candles": {**cc.stats, "wins": dict(cc.stats["wins"]), "last": cc.last_fetch},
+        }
+
+    def close(self):
+        if self.loop.is_closed(): return
+        if self._session is not None and not self._session.closed:
+            self.loop.run_until_complete(self._session.close())
+        self.loop.close()
+
+_default = None
+
+def default_client():
+    global _default
+    if _default is None or _default.loop.is_closed():
+        _default = MarketData()
+    return _default
@@ -2,7 +2,7 @@
 import json, os, time
 from util import load_cfg
 from pionex_api import Pionex
-from datafeeds import aggregate_quote_sync, get_candles_sync
+from datafeeds import aggregate_quote_sync, get_candles_sync, set_base_urls
 
 def _safe_aggregate():
     """Restituisce (mid, vol_pct, div_bps, alive) nel modo più robusto possibile."""
@@ -37,7 +37,8 @@ def _safe_aggregate():
 
 def main():
     out = {"ts": int(time.time()*1000), "checks": []}
-    cfg = load_cfg("config.yaml")
+    cfg = load_cfg()
+    set_base_urls(**(cfg.get("datafeed",{}).get("base_urls") or {}))
     key = os.getenv("PIONEX_API_KEY")
     sec = os.getenv("PIONEX_API_SECRET")
     pnx = Pionex(key, sec, cfg)
@@ -0,0 +1,473 @@
+import json, time, heapq, asyncio, operator
+from array import array
+from bisect import bisect_left, bisect_right
+import aiohttp, websockets
+import datafeeds
+from datafeeds import consensus
+from ws_quotes import QuoteStream, VENUES, BINANCE_WS
+
+BYBIT_DEPTH = 50
+# limit ammessi da /fapi/v1/depth
+_BINANCE_LIMITS = (5, 10, 20, 50, 100, 500, 1000)
+
+class BookSide:
+    """
+    Un lato del book: prezzi e size in due array('d') paralleli ordinati dal
+    livello migliore. La chiave è il prezzo per gli ask e -prezzo per i bid,
+    così entrambi i lati crescono dal migliore e basta un bisect. Oltre
+    max_levels i livelli più lontani si scartano: un inserimento o una
+    cancellazione sposta al più max_levels elementi.
+    """
+    __slots__ = ("sign", "keys", "sizes", "max_levels")
+
+    def __init__(self, bid, max_levels=100):
+        self.sign = -1.0 if bid else 1.0
+        self.keys = array("d")
+        self.sizes = array("d")
+        self.max_levels = int(max_levels)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def clear(self):
+        del self.keys[:]
+        del self.sizes[:]
+
+    def load(self, levels):
+        """Sostituisce il lato con [(prezzo, size)] in qualsiasi ordine (snapshot)."""
+        s = self.sign
+        lv = sorted((s * p, q) for p, q in levels if q > 0)[:self.max_levels]
+        self.keys = array("d", [k for k, _ in lv])
+        self.sizes = array("d", [q for _, q in lv])
+
+    def set(self, price, size):
+        """Aggiorna un livello (size 0 = rimozione). True se tocca il livello migliore."""
+        keys = self.keys
+        k = self.sign * price
+        i = bisect_left(keys, k)
+        if i < len(keys) and keys[i] == k:
+            if size > 0:
+                self.sizes[i] = size
+            else:
+                del keys[i]
+                del self.sizes[i]
+            return i == 0
+        if size <= 0 or i >= self.max_levels:
+            return False
+        keys.insert(i, k)
+        self.sizes.insert(i, size)
+        if len(keys) > self.max_levels:
+            del keys[-1]
+            del self.sizes[-1]
+        return i == 0
+
+    def best(self):
+        return self.sign * self.keys[0] if self.keys else None
+
+    def weighted_size(self, weights):
+        """Size dei primi len(weights) livelli pesate per livello."""
+        return sum(map(operator.mul, self.sizes, weights))
+
+    def notional_within(self, limit):
+        """Controvalore (prezzo * size) dei livelli fino al prezzo limit compreso."""
+        n = bisect_right(self.keys, self.sign * limit)
+        return self.sign * sum(map(operator.mul, self.keys[:n], self.sizes[:n]))
+
+    def levels(self, n=None):
+        s = self.sign
+        return [(s * k, q) for k, q in zip(self.keys[:n], self.sizes[:n])]
+
+class L2Book:
+    """Book L2 di una venue da snapshot + diff; seq = ultimo update id applicato (None = da sincronizzare)."""
+    __slots__ = ("bids", "asks", "seq", "ts", "stats")
+
+    def __init__(self, max_levels=100):
+        self.bids = BookSide(True, max_levels)
+        self.asks = BookSide(False, max_levels)
+        self.seq = None
+        self.ts = 0.0
+        self.stats = {"snapshots": 0, "updates": 0, "levels": 0, "resyncs": 0}
+
+    def snapshot(self, bids, asks, seq=None, ts=None):
+        self.bids.load(bids)
+        self.asks.load(asks)
+        self.seq = seq
+        self.ts = ts or time.time()
+        self.stats["snapshots"] += 1
+
+    def update(self, bids, asks, seq=None, ts=None):
+        """Applica un diff [(prezzo, size)] per lato; True se cambia il top of book."""
+        top = False
+        for p, q in bids:
+            top |= self.bids.set(p, q)
+        for p, q in asks:
+            top |= self.asks.set(p, q)
+        self.seq = seq
+        self.ts = ts or time.time()
+        st = self.stats
+        st["updates"] += 1
+        st["levels"] += len(bids) + len(asks)
+        return top
+
+    def reset(self, gap=False):
+        self.bids.clear()
+        self.asks.clear()
+        self.seq = None
+        if gap:
+            self.stats["resyncs"] += 1
+
+    def best(self):
+        return self.bids.best(), self.asks.best()
+
+    def microprice(self, weights):
+        """
+        Microprice pesato sulla profondità: bid + spread * Qb / (Qb + Qa) con Q
+        le size dei primi livelli pesate da weights. None se vuoto o incrociato.
+        """
+        bid, ask = self.best()
+        if bid is None or ask is None or bid >= ask:
+            return None
+        qb = self.bids.weighted_size(weights)
+        qa = self.asks.weighted_size(weights)
+        if qb + qa <= 0:
+            return (bid + ask) / 2.0
+        return bid + (ask - bid) * qb / (qb + qa)
+
+    def depth_notional(self, band_bps):
+        """Controvalore dei due lati entro band_bps dal mid."""
+        bid, ask = self.best()
+        if bid is None or ask is None:
+            return 0.0
+        mid, b = (bid + ask) / 2.0, band_bps / 1e4
+        return self.bids.notional_within(mid * (1.0 - b)) + self.asks.notional_within(mid * (1.0 + b))
+
+def micro_weights(levels=10, decay=0.7):
+    """Pesi per livello del microprice: decay**i sui primi levels livelli."""
+    return [float(decay) ** i for i in range(max(1, int(levels)))]
+
+def _sides(books, side):
+    """Lati dei book consumati da un ordine side ("BUY" prende gli ask) o lato per nome ("bids"/"asks")."""
+    name = {"BUY": "asks", "SELL": "bids"}.get(side, side)
+    return [getattr(b, name) for b in books]
+
+def consolidated(books, side, n=10):
+    """Primi n livelli del book consolidato: [(prezzo, size)] sommando le venue allo stesso prezzo."""
+    sides = _sides(books, side)
+    if not sides:
+        return []
+    s = sides[0].sign
+    out = []
+    for k, q in heapq.merge(*(zip(x.keys, x.sizes) for x in sides)):
+        if out and out[-1][0] == s * k:
+            out[-1] = (out[-1][0], out[-1][1] + q)
+            continue
+        if len(out) == n:
+            break
+        out.append((s * k, q))
+    return out
+
+def walk(books, side, qty):
+    """Ordine market di qty sul book consolidato: (prezzo medio, quantità eseguita, livelli toccati)."""
+    sides = _sides(books, side)
+    if not sides or qty <= 0:
+        return None, 0.0, 0
+    s = sides[0].sign
+    left, cost, n = float(qty), 0.0, 0
+    for k, q in heapq.merge(*(zip(x.keys, x.sizes) for x in sides)):
+        take = q if q < left else left
+        cost += take * s * k
+        left -= take
+        n += 1
+        if left <= 0:
+            break
+    filled = float(qty) - left
+    return (cost / filled if filled > 0 else None), filled, n
+
+def estimate_slippage(books, side, qty, ref=None):
+    """
+    Slippage stimato in bps (positivo = costo) di un market di qty sui book
+    dati, rispetto a ref (default: mid consolidato, miglior bid e miglior ask
+    tra le venue). complete=False se la profondità tenuta non basta.
+    """
+    avg, filled, n = walk(books, side, qty)
+    if avg is None:
+        return None
+    if ref is None:
+        bids = [b for b in (x.bids.best() for x in books) if b is not None]
+        asks = [a for a in (x.asks.best() for x in books) if a is not None]
+        if not bids or not asks:
+            return None
+        ref = (max(bids) + min(asks)) / 2.0
+    bps = (avg / ref - 1.0) * 1e4 if side == "BUY" else (1.0 - avg / ref) * 1e4
+    return {"bps": bps, "avg": avg, "filled": filled, "levels": n, "complete": filled >= qty * (1.0 - 1e-9)}
+
+# --- messaggi delle venue ---
+
+def _levels(rows):
+    return [(float(r[0]), float(r[1])) for r in rows or ()]
+
+def parse_binance_depth(data):
+    # <symbol>@depth@100ms: {"e": "depthUpdate", "s", "U", "u", "pu", "b": [[px, qty]], "a": [...]}
+    d = data.get("data", data)
+    if d.get("e") != "depthUpdate":
+        return None
+    return d["s"], int(d["U"]), int(d["u"]), int(d["pu"]), _levels(d.get("b")), _levels(d.get("a"))
+
+def parse_bybit_depth(data):
+    # orderbook.50.<symbol>: {"type": "snapshot"|"delta", "data": {"s", "b", "a", "u", "seq"}}
+    d = data.get("data")
+    if not isinstance(d, dict) or not str(data.get("topic", "")).startswith("orderbook."):
+        return None
+    return d["s"], data.get("type") == "snapshot", int(d["u"]), _levels(d.get("b")), _levels(d.get("a"))
+
+def parse_okx_depth(data):
+    # books: {"arg": {"channel": "books", "instId"}, "action": "snapshot"|"update", "data": [{"bids", "asks", "seqId", "prevSeqId"}]}
+    arr = data.get("data")
+    arg = data.get("arg") or {}
+    if not arr or arg.get("channel") != "books":
+        return None
+    i = arr[0]
+    return (arg["instId"], data.get("action") == "snapshot", int(i["seqId"]), int(i.get("prevSeqId", -1)),
+            _levels(i.get("bids")), _levels(i.get("asks")))
+
+class DepthStream(QuoteStream):
+    """
+    Book L2 per (venue, strumento) da snapshot + diff: Binance diff stream
+    con snapshot REST (/fapi/v1/depth), Bybit orderbook.50, OKX books. Un buco
+    di sequenza azzera il book della venue e lo risincronizza (nuovo snapshot
+    REST su Binance, nuova subscribe su Bybit e OKX). aggregate_quote() fa il consensus
+    sui microprice delle venue pesati per profondità entro weight_band_bps;
+    slippage() stima il costo di un market sul book consolidato. Gli stessi
+    listener di QuoteStream scattano solo quando cambia un top of book.
+    """
+    src = "depth"
+
+    def __init__(self, urls=None, max_age_s=5.0, venues=VENUES, vol=None, instruments=None,
+                 max_levels=100, micro_levels=10, micro_decay=0.7, weight_band_bps=10.0):
+        super().__init__(urls=urls, max_age_s=max_age_s, venues=venues, vol=vol, instruments=instruments)
+        if not (urls or {}).get("binance"):
+            streams = "/".join(f"{i['binance'].lower()}@depth@100ms" for i in self.instruments)
+            self.urls["binance"] = f"{BINANCE_WS.rsplit('/', 1)[0]}/stream?streams={streams}"
+        self.max_levels = int(max_levels)
+        self.snapshot_limit = next((n for n in _BINANCE_LIMITS if n >= self.max_levels), _BINANCE_LIMITS[-1])
+        self.weights = micro_weights(micro_levels, micro_decay)
+        self.band_bps = float(weight_band_bps)
+        self._insts = {i["pionex"]: i for i in self.instruments}
+        self.books = {(v, k): L2Book(self.max_levels) for v in VENUES for k in self._insts}
+        # Binance: diff accodati durante lo snapshot REST, book in attesa del primo diff, retry
+        self._pending = {}
+        self._first = set()
+        self._retry_at = {}
+        self._tasks = set()
+
+    def _subscribe_msg(self, venue, insts=None, op="subscribe"):
+        insts = insts or self.instruments
+        if venue == "bybit":
+            return {"op": op, "args": [f"orderbook.{BYBIT_DEPTH}.{i['bybit']}" for i in insts]}
+        if venue == "okx":
+            return {"op": op, "args": [{"channel": "books", "instId": i["okx"]} for i in insts]}
+        return None
+
+    def _apply(self, venue, key, bids, asks, seq, snapshot=False):
+        book = self.books[(venue, key)]
+        with self._lock:
+            if snapshot:
+                book.snapshot(bids, asks, seq)
+                top = True
+            else:
+                top = book.update(bids, asks, seq)
+            bid, ask = book.best()
+        if top and bid is not None and ask is not None:
+            self._on_quote(venue, bid, ask, key=key)
+
+    def _reset(self, venue, key, gap=False):
+        with self._lock:
+            self.books[(venue, key)].reset(gap)
+        if venue == "binance":
+            self._pending.pop(key, None)
+            self._first.discard(key)
+
+    # --- Binance: diff stream + snapshot REST ---
+
+    def _binance_diff(self, key, ev):
+        """Applica un diff al book sincronizzato; False = buco di sequenza."""
+        _, first, last, prev, bids, asks = ev
+        book = self.books[("binance", key)]
+        if key in self._first:
+            # primo diff dopo lo snapshot: U <= lastUpdateId <= u
+            if last < book.seq:
+                return True
+            if first > book.seq:
+                return False
+            self._first.discard(key)
+        elif prev != book.seq:
+            return False
+        self._apply("binance", key, bids, asks, last)
+        return True
+
+    async def _binance(self, data, ws, session):
+        ev = parse_binance_depth(data)
+        if ev is None:
+            return
+        key = self._keys["binance"].get(ev[0])
+        if key is None:
+            return
+        pend = self._pending.get(key)
+        if pend is not None:
+            pend.append(ev)
+            return
+        book = self.books[("binance", key)]
+        if book.seq is not None and self._binance_diff(key, ev):
+            return
+        if book.seq is not None:
+            self._reset("binance", key, gap=True)
+        if time.monotonic() < self._retry_at.get(key, 0.0):
+            return
+        self._pending[key] = [ev]
+        t = asyncio.create_task(self._binance_snapshot(session, ev[0], key))
+        self._tasks.add(t)
+        t.add_done_callback(self._tasks.discard)
+
+    async def _binance_snapshot(self, session, sym, key):
+        j = await datafeeds.fetch_json(session, f"{datafeeds.BINANCE_F}/fapi/v1/depth",
+                                       {"symbol": sym, "limit": self.snapshot_limit})
+        try:
+            seq, bids, asks = int(j["lastUpdateId"]), _levels(j["bids"]), _levels(j["asks"])
+        except (TypeError, KeyError, ValueError):
+            self._pending.pop(key, None)
+            self._retry_at[key] = time.monotonic() + 1.0
+            return
+        pend = self._pending.pop(key, [])
+        self._apply("binance", key, bids, asks, seq, snapshot=True)
+        self._first.add(key)
+        for ev in pend:
+            if not self._binance_diff(key, ev):
+                # snapshot più vecchio dei diff accodati: si riparte dal prossimo diff
+                self._reset("binance", key, gap=True)
+                return
+
+    # --- Bybit / OKX: snapshot e delta sullo stesso stream ---
+
+    async def _bybit(self, data, ws, session):
+        ev = parse_bybit_depth(data)
+        if ev is None:
+            return
+        sym, snap, u, bids, asks = ev
+        key = self._keys["bybit"].get(sym)
+        if key is None:
+            return
+        book = self.books[("bybit", key)]
+        # u == 1: servizio Bybit riavviato, il messaggio vale come snapshot
+        if snap or u == 1:
+            self._apply("bybit", key, bids, asks, u, snapshot=True)
+        elif book.seq is None or u <= book.seq:
+            return
+        elif u == book.seq + 1:
+            self._apply("bybit", key, bids, asks, u)
+        else:
+            await self._resubscribe(ws, "bybit", key)
+
+    async def _resubscribe(self, ws, venue, key):
+        """Buco di sequenza su Bybit/OKX: book azzerato e nuova subscribe, la venue rimanda lo snapshot."""
+        self._reset(venue, key, gap=True)
+        inst = [self._insts[key]]
+        await ws.send(json.dumps(self._subscribe_msg(venue, inst, "unsubscribe")))
+        await ws.send(json.dumps(self._subscribe_msg(venue, inst)))
+
+    async def _okx(self, data, ws, session):
+        ev = parse_okx_depth(data)
+        if ev is None:
+            return
+        sym, snap, seq, prev, bids, asks = ev
+        key = self._keys["okx"].get(sym)
+        if key is None:
+            return
+        book = self.books[("okx", key)]
+        if snap:
+            self._apply("okx", key, bids, asks, seq, snapshot=True)
+        elif book.seq is None:
+            return
+        elif prev == book.seq:
+            self._apply("okx", key, bids, asks, seq)
+        else:
+            await self._resubscribe(ws, "okx", key)
+
+    async def _venue(self, venue):
+        handle = {"binance": self._binance, "bybit": self._bybit, "okx": self._okx}[venue]
+        async with aiohttp.ClientSession() as session:
+            while not self._stop.is_set():
+                try:
+                    async with websockets.connect(self.urls[venue], ping_interval=20, max_size=None) as ws:
+                        for key in self._insts:
+                            self._reset(venue, key)
+                        sub = self._subscribe_msg(venue)
+                        if sub:
+                            await ws.send(json.dumps(sub))
+                        async for msg in ws:
+                            if self._stop.is_set():
+                                return
+                            try:
+                                await handle(json.loads(msg), ws, session)
+                            except (ValueError, KeyError, TypeError, IndexError, AttributeError):
+                                continue
+                except Exception:
+                    await asyncio.sleep(1.0)
+
+    # --- letture ---
+
+    def _fresh(self, key, now):
+        """[(venue, book)] sincronizzati e non più vecchi di max_age_s; da chiamare con il lock."""
+        out = []
+        for v in self.venues:
+            book = self.books.get((v, key))
+            if book is not None and book.seq is not None and now - book.ts <= self.max_age_s:
+                out.append((v, book))
+        return out
+
+    def quotes(self, now=None, key=None):
+        """Come QuoteStream.quotes() dai book sincronizzati, con il microprice della venue."""
+        now = now or time.time()
+        key = key or self.default_key
+        out = {}
+        with self._lock:
+            for v, book in ((v, self.books.get((v, key))) for v in self.venues):
+                if book is None or book.seq is None:
+                    continue
+                b, a = book.best()
+                if b is not None and a is not None:
+                    out[v] = {"bid": b, "ask": a, "mid": (a + b) / 2.0, "micro": book.microprice(self.weights),
+                              "age_s": now - book.ts}
+        return out
+
+    def aggregate_quote(self, sample=True, key=None, vol=None):
+        """Consensus sui microprice delle venue pesati per profondità; stessa tupla di QuoteStream."""
+        now = time.time()
+        key = key or self.default_key
+        micros, weights = [], []
+        with self._lock:
+            for _, book in self._fresh(key, now):
+                m = book.microprice(self.weights)
+                if m is not None:
+                    micros.append(m)
+                    weights.append(book.depth_notional(self.band_bps))
+        return consensus(micros, ts=now, vol=vol or self.vol, sample=sample, weights=weights)
+
+    def slippage(self, side, qty, key=None, ref=None):
+        """estimate_slippage() sul book consolidato delle venue fresche di `key` (None senza book)."""
+        now = time.time()
+        with self._lock:
+            books = [b for _, b in self._fresh(key or self.default_key, now)]
+            return estimate_slippage(books, side, qty, ref) if books else None
+
+    def depth_stats(self, key=None, n=5):
+        """Per il report: microprice, profondità e contatori per venue, primi n livelli consolidati."""
+        now = time.time()
+        key = key or self.default_key
+        with self._lock:
+            fresh = self._fresh(key, now)
+            venues = {v: {"micro": b.microprice(self.weights), "best": list(b.best()), "levels": [len(b.bids), len(b.asks)],
+                          "notional": b.depth_notional(self.band_bps), "age_s": now - b.ts, **b.stats}
+                      for v, b in fresh}
+            books = [b for _, b in fresh]
+            return {"venues": venues, "bids": consolidated(books, "bids", n), "asks": consolidated(books, "asks", n),
+                    "stale": [v for v in self.venues if v not in venues]}
@@ -0,0 +1,261 @@
+import json, sqlite3, time
+from persist import write_json
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS positions (
+    id      INTEGER PRIMARY KEY,
+    side    TEXT NOT NULL,
+    qty     REAL NOT NULL,
+    entry   REAL NOT NULL,
+    sl      REAL,
+    tp      REAL,
+    ts      INTEGER NOT NULL,
+    status  TEXT NOT NULL DEFAULT 'open',
+    exit    REAL,
+    result  TEXT,
+    pl      REAL,
+    exit_ts INTEGER,
+    tp_oid  TEXT,
+    sl_oid  TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_pos_open ON positions(side) WHERE status = 'open';
+CREATE INDEX IF NOT EXISTS ix_pos_closed ON positions(exit_ts) WHERE status = 'closed';
+CREATE TABLE IF NOT EXISTS daily (
+    day    TEXT PRIMARY KEY,
+    trades INTEGER NOT NULL DEFAULT 0,
+    wins   INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    pnl    REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS fills (
+    id       TEXT PRIMARY KEY,
+    order_id TEXT,
+    side     TEXT,
+    price    REAL,
+    qty      REAL,
+    ts       INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_fills_order ON fills(order_id);
+CREATE TABLE IF NOT EXISTS stats (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def streak_mult(last, streak, cfg):
+    r = cfg.get("risk_ladder", {})
+    if not r.get("enabled", True):
+        return 1.0
+    if last == "win" and streak > 0:
+        return min(1.0 + r.get("win_step_mult",0.25)*streak, r.get("max_mult",2.0))
+    if last == "loss" and streak >= r.get("penalty_after_losses",2):
+        return r.get("loss_penalty_mult",0.7)
+    return 1.0
+
+def fill_fields(f):
+    """(order id, prezzo, qty, ts) grezzi di un fill, con i nomi alternativi dei vari payload."""
+    oid = f.get("orderId", f.get("order_id"))
+    qty = f.get("size", f.get("quantity", f.get("qty")))
+    ts = f.get("timestamp", f.get("ts", f.get("time")))
+    return oid, f.get("price"), qty, ts
+
+def _ms(ts):
+    ts = ts if ts is not None else time.time()
+    return int(ts * 1000) if ts < 1e12 else int(ts)
+
+def _day(ts_ms):
+    return time.strftime("%Y-%m-%d", time.gmtime(ts_ms / 1000.0))
+
+class Ledger:
+    """
+    Ledger delle posizioni breakout su SQLite (WAL). Streak, trade e PnL per
+    giorno sono aggiornati incrementalmente nella stessa transazione dell'evento;
+    orders.json per la dashboard è solo una vista esportata.
+    """
+    def __init__(self, path="ledger.db", legacy_json="orders.json"):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        cols = {r[1] for r in self.db.execute("PRAGMA table_info(positions)")}
+        for c in ("tp_oid", "sl_oid"):
+            if cols and c not in cols:
+                self.db.execute(f"ALTER TABLE positions ADD COLUMN {c} TEXT")
+        self.db.executescript(SCHEMA)
+        self._stats = {r["key"]: json.loads(r["value"]) for r in self.db.execute("SELECT key, value FROM stats")}
+        if legacy_json and not self._stats.get("migrated"):
+            self._import_legacy(legacy_json)
+
+    def _import_legacy(self, path):
+        """Importa una volta le posizioni del vecchio StreakBook da orders.json."""
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except Exception:
+            data = {}
+        with self.db:
+            for o in data.get("open", []):
+                if "entry" in o and "side" in o:
+                    self.db.execute("INSERT OR IGNORE INTO positions(id, side, qty, entry, sl, tp, ts) VALUES (?,?,?,?,?,?,?)",
+                                    (o.get("id"), o["side"], o.get("qty", 0.0), o["entry"], o.get("sl"), o.get("tp"), _ms(o.get("ts"))))
+            for o in data.get("closed", []):
+                if "entry" in o and "result" in o:
+                    self.db.execute("INSERT OR IGNORE INTO positions(id, side, qty, entry, sl, tp, ts, status, exit, result, pl, exit_ts) "
+                                    "VALUES (?,?,?,?,?,?,?,'closed',?,?,?,?)",
+                                    (o.get("id"), o["side"], o.get("qty", 0.0), o["entry"], o.get("sl"), o.get("tp"), _ms(o.get("ts")),
+                                     o.get("exit"), o["result"], o.get("pl", 0.0), _ms(o.get("exit_ts"))))
+            st = data.get("stats", {}) or {}
+            if st.get("last_result"):
+                self._set("last_result", st["last_result"])
+                self._set("streak", int(st.get("streak", 0) or 0))
+            self._set("migrated", True)
+
+    def _set(self, key, value):
+        self._stats[key] = value
+        self.db.execute("INSERT INTO stats(key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                        (key, json.dumps(value)))
+
+    def record_entry(self, side, qty, entry_price, sl=None, tp=None, ts=None, tp_oid=None, sl_oid=None):
+        with self.db:
+            cur = self.db.execute("INSERT INTO positions(side, qty, entry, sl, tp, ts, tp_oid, sl_oid) VALUES (?,?,?,?,?,?,?,?)",
+                                  (side, qty, entry_price, sl, tp, _ms(ts),
+                                   None if tp_oid is None else str(tp_oid), None if sl_oid is None else str(sl_oid)))
+        return cur.lastrowid
+
+    def update_stop(self, pos_id, sl, sl_oid=None):
+        """Sposta lo SL di una posizione aperta (trailing); sl_oid è il nuovo ordine stop, se c'è."""
+        with self.db:
+            self.db.execute("UPDATE positions SET sl = ?, sl_oid = COALESCE(?, sl_oid) WHERE id = ? AND status = 'open'",
+                            (sl, None if sl_oid is None else str(sl_oid), pos_id))
+
+    def apply_fill(self, fill, key, ts=None):
+        """
+        Registra un fill (idempotente per key). Se è del TP o dello SL di una
+        posizione aperta somma la qty eseguita dagli ordini d'uscita della
+        posizione e la chiude, al prezzo medio di quei fill, solo quando copre la
+        qty della posizione (un fill senza size vale come uscita completa).
+        True se ha chiuso qualcosa.
+        """
+        oid, price, qty, f_ts = fill_fields(fill)
+        oid = None if oid is None else str(oid)
+        try: price = float(price)
+        except Exception: price = None
+        with self.db:
+            cur = self.db.execute("INSERT OR IGNORE INTO fills(id, order_id, side, price, qty, ts) VALUES (?,?,?,?,?,?)",
+                                  (key, oid, fill.get("side"), price, None if qty is None else float(qty),
+                                   _ms(float(f_ts)) if f_ts is not None else _ms(ts)))
+        if not cur.rowcount or oid is None or price is None:
+            return False
+        rows = self.db.execute("SELECT * FROM positions WHERE status = 'open' AND (tp_oid = ? OR sl_oid = ?)", (oid, oid)).fetchall()
+        hits = []
+        for o in rows:
+            filled, notional, unsized = self.db.execute(
+                "SELECT SUM(qty), SUM(qty * price), SUM(qty IS NULL) FROM fills WHERE price IS NOT NULL AND order_id IN (?, ?)",
+                (o["tp_oid"], o["sl_oid"])).fetchone()
+            if unsized:
+                hits.append((o, price))
+            elif filled and filled >= o["qty"] * (1.0 - 1e-9):
+                hits.append((o, notional / filled))
+        if not hits:
+            return False
+        self._close(hits, _ms(ts))
+        return True
+
+    def mark_exit_if_crossed(self, mid, ts=None):
+        """Chiude le posizioni aperte il cui TP/SL è stato attraversato da mid; True se qualcosa è cambiato."""
+        rows = self.db.execute(
+            "SELECT * FROM positions WHERE status = 'open' AND ("
+            " (side = 'BUY'  AND ((tp IS NOT NULL AND tp <= :m) OR (sl IS NOT NULL AND sl >= :m))) OR"
+            " (side = 'SELL' AND ((tp IS NOT NULL AND tp >= :m) OR (sl IS NOT NULL AND sl <= :m))))"
+            " ORDER BY id", {"m": mid}).fetchall()
+        if not rows:
+            return False
+        hits = []
+        for o in rows:
+            buy = o["side"] == "BUY"
+            tp_hit = o["tp"] and ((buy and mid >= o["tp"]) or (not buy and mid <= o["tp"]))
+            hits.append((o, o["tp"] if tp_hit else o["sl"]))
+        self._close(hits, _ms(ts))
+        return True
+
+    def _close(self, hits, now):
+        """
+        hits: [(riga posizione, prezzo di uscita)]; aggiorna streak e aggregati nella
+        stessa transazione. L'esito viene dal segno di pl, non dall'ordine che ha
+        chiuso: uno SL spostato oltre l'entry dal trailing chiude in utile ed è "win".
+        """
+        pnl_total = float(self._stats.get("pnl_total", 0.0))
+        last = self._stats.get("last_result")
+        streak = int(self._stats.get("streak", 0) or 0)
+        with self.db:
+            for o, exit_price in hits:
+                buy = o["side"] == "BUY"
+                pl = (exit_price - o["entry"]) * (o["qty"] if buy else -o["qty"])
+                res = "win" if pl > 0 else "loss"
+                self.db.execute("UPDATE positions SET status = 'closed', exit = ?, result = ?, pl = ?, exit_ts = ? WHERE id = ?",
+                                (exit_price, res, pl, now, o["id"]))
+                self.db.execute("INSERT INTO daily(day, wins, losses, pnl) VALUES (?, ?, ?, ?) ON CONFLICT(day) DO UPDATE SET "
+                                "wins = wins + excluded.wins, losses = losses + excluded.losses, pnl = pnl + excluded.pnl",
+                                (_day(now), int(res == "win"), int(res == "loss"), pl))
+                streak = streak + 1 if res == last else 1
+                last = res
+                pnl_total += pl
+            self._set("last_result", last)
+            self._set("streak", streak)
+            self._set("pnl_total", pnl_total)
+
+    def streak_mult(self, cfg):
+        return streak_mult(self._stats.get("last_result"), int(self._stats.get("streak", 0) or 0), cfg)
+
+    def bump_trades_today(self, n=1, ts=None):
+        with self.db:
+            self.db.execute("INSERT INTO daily(day, trades) VALUES (?, ?) ON CONFLICT(day) DO UPDATE SET trades = trades + excluded.trades",
+                            (_day(_ms(ts)), int(n)))
+
+    def day_stats(self, ts=None):
+        r = self.db.execute("SELECT trades, wins, losses, pnl FROM daily WHERE day = ?", (_day(_ms(ts)),)).fetchone()
+        return dict(r) if r else {"trades": 0, "wins": 0, "losses": 0, "pnl": 0.0}
+
+    def trades_today(self, ts=None):
+        return int(self.day_stats(ts)["trades"])
+
+    def win_rate(self, days=7, ts=None):
+        since = _day(_ms(ts) - days * 86_400_000)
+        r = self.db.execute("SELECT SUM(wins), SUM(losses) FROM daily WHERE day > ?", (since,)).fetchone()
+        w, l = r[0] or 0, r[1] or 0
+        return (w / (w + l)) if (w + l) else None
+
+    def open_positions(self, side=None):
+        if side:
+            rows = self.db.execute("SELECT * FROM positions WHERE status = 'open' AND side = ? ORDER BY id", (side,))
+        else:
+            rows = self.db.execute("SELECT * FROM positions WHERE status = 'open' ORDER BY id")
+        return [dict(r) for r in rows]
+
+    def closed_positions(self, limit=100):
+        rows = self.db.execute("SELECT * FROM positions WHERE status = 'closed' ORDER BY exit_ts DESC LIMIT ?", (int(limit),))
+        return [dict(r) for r in rows]
+
+    def stats(self, ts=None):
+        d = self.day_stats(ts)
+        return {
+            "pnl_day": d["pnl"], "trades_day": d["trades"], "win_7d": self.win_rate(7, ts), "sharpe_30d": None,
+            "last_result": self._stats.get("last_result"), "streak": int(self._stats.get("streak", 0) or 0),
+            "pnl_total": float(self._stats.get("pnl_total", 0.0)),
+        }
+
+    def export_json(self, path="orders.json", open_orders=None, fills=None, ts=None, closed_limit=100, writer=None):
+        """Vista per la dashboard: ordini/fill dell'exchange + posizioni e statistiche del ledger (scrittura atomica)."""
+        payload = {
+            "open": open_orders or [], "closed": fills or [],
+            "positions": {"open": self.open_positions(), "closed": self.closed_positions(closed_limit)},
+            "stats": self.stats(ts),
+        }
+        write_json(path, payload, writer)
+
+    def close(self):
+        try:
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            self.db.close()
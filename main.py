@@ -1,103 +1,35 @@
-import os, time, signal, json
-from util import load_cfg
-from datafeeds import aggregate_quote_sync, get_candles_sync
+import os, copy, time, signal, asyncio
+from util import load_cfg, deep_merge
+from datafeeds import MarketData, CandleCache, instrument_of, set_base_urls
 from filters import assess, DFStatus
 from grid import compute_grid
 from pid import PID, leverage_from_pid
 from pionex_api import Pionex
-from report import write_state_report, write_orders, mirror_config_to_json, bump_trades_today
+from report import write_state_report, mirror_config_to_json
 from alpha import AlphaDetector
-from ws_fills import FillsWS
+from ws_fills import FillsWS, FillBus, FillRouter, fill_key
+from ws_quotes import QuoteStream
+from l2book import DepthStream
+from rolling import RollingVol, RollingATR
+from stops import DynamicStops
+from snapshot import save_snapshot, load_snapshot
+from ledger import Ledger
+from timeseries import TimeSeriesStore
+from persist import WriteBehind, write_text
+from metrics import Metrics
 
 from collections import deque
 
 def calc_atr(candles, n=14):
-    trs = []
-    prev_c = None
-    for c in candles:
-        h, l = float(c["h"]), float(c["l"])
-        if prev_c is None:
-            tr = h - l
+    """ATR in blocco (media degli ultimi n true range) su candele tuple (t,o,h,l,c,v) o dict; nel loop si usa RollingATR."""
+    atr = RollingATR(n)
+    # servono solo gli ultimi n true range: n + 1 barre (la prima fa da chiusura precedente)
+    for c in candles[-(atr.n + 1):]:
+        if isinstance(c, dict):
+            atr.update(c["h"], c["l"], c["c"])
         else:
-            prev_close = float(prev_c["c"])
-            tr = max(h - l, abs(h - prev_close), abs(l - prev_close))
-        trs.append(tr)
-        prev_c = c
-    if not trs:
-        return 0.0
-    n = max(1, int(n))
-    vals = trs[-n:] if len(trs) >= n else trs
-    return sum(vals)/len(vals)
-
-class StreakBook:
-    def __init__(self, path="orders.json"):
-        self.path = path
-        self.data = {"open":[], "closed":[], "stats":{}}
-        try:
-            with open(self.path,"r") as f:
-                import json
-                self.data = json.load(f)
-        except Exception:
-            pass
-
-    def save(self):
-        import json
-        with open(self.path,"w") as f:
-            json.dump(self.data, f, indent=2)
-
-    def record_entry(self, side, qty, entry_price, sl=None, tp=None, ts=None):
-        import time
-        o = {"id": int(time.time()*1000), "side": side, "qty": qty,
-             "entry": entry_price, "sl": sl, "tp": tp, "ts": ts or int(time.time()*1000)}
-        self.data["open"].append(o); self.save(); return o["id"]
-
-    def mark_exit_if_crossed(self, mid):
-        import time
-        updated = False
-        new_open = []
-        closed = self.data.get("closed", [])
-        for o in self.data.get("open", []):
-            hit = None
-            if o.get("tp") and ((o["side"]=="BUY" and mid>=o["tp"]) or (o["side"]=="SELL" and mid<=o["tp"])):
-                hit = "win"; exit_price = o["tp"]
-            elif o.get("sl") and ((o["side"]=="BUY" and mid<=o["sl"]) or (o["side"]=="SELL" and mid>=o["sl"])):
-                hit = "loss"; exit_price = o["sl"]
-            if hit:
-                pl = (exit_price - o["entry"]) * (o["qty"] if o["side"]=="BUY" else -o["qty"])
-                closed.append({**o, "exit": exit_price, "result": hit, "pl": pl, "exit_ts": int(time.time()*1000)})
-                updated = True
-            else:
-                new_open.append(o)
-        if updated:
-            self.data["open"] = new_open
-            self.data["closed"] = closed
-            last_res = closed[-1]["result"] if closed else None
-            streak = 0
-            if last_res:
-                for c in reversed(closed):
-                    if c.get("result") == last_res:
-                        streak += 1
-                    else:
-                        break
-            s = self.data.setdefault("stats", {})
-            s["last_result"] = last_res
-            s["streak"] = streak if last_res else 0
-            self.save()
-        return updated
-
-    def streak_mult(self, cfg):
-        s = self.data.get("stats", {})
-        last = s.get("last_result")
-        st = int(s.get("streak", 0) or 0)
-        r = cfg.get("risk_ladder", {})
-        if not r.get("enabled", True):
-            return 1.0
-        if last == "win" and st > 0:
-            return min(1.0 + r.get("win_step_mult",0.25)*st, r.get("max_mult",2.0))
-        if last == "loss" and st >= r.get("penalty_after_losses",2):
-            return r.get("loss_penalty_mult",0.7)
-        return 1.0
-
+            atr.update(c[2], c[3], c[4])
+    return atr.value()
 
 def choose_timeframe(status, vol_pct, trades_today, target_trades, last_tf, tf_cfg, stick_counter):
     vol_hi = float(tf_cfg.get("vol_hi_pct",1.5))
@@ -117,197 +49,764 @@ def choose_timeframe(status, vol_pct, trades_today, target_trades, last_tf, tf_c
         return last_tf or desired, stick_counter+1
     return desired, 0
 
-def run():
-    cfg = load_cfg()
-    pnx = Pionex(key=os.environ.get("PIONEX_API_KEY",""), secret=os.environ.get("PIONEX_API_SECRET",""), cfg=cfg)
-    pid = PID(cfg["pid"]["kp"], cfg["pid"]["ki"], cfg["pid"]["kd"], cfg["pid"]["out_min"], cfg["pid"]["out_max"])
-    start = time.time()
-    backoff = 0
-    stopping = False
-
-    def _sigterm(*_):
-        nonlocal stopping
-        stopping = True
-    signal.signal(signal.SIGTERM, _sigterm)
-
-    last_mid = None
-    last_status = DFStatus.OK
-
-    a_cfg = cfg.get("alpha", {})
-    alpha_on = bool(a_cfg.get("enabled", True))
-    alpha = AlphaDetector(
-        norm_len=a_cfg.get("norm_len", 100),
-        box_len=a_cfg.get("box_len", 14),
-        strong_close=a_cfg.get("strong_close", True),
-        min_box_range_pct=a_cfg.get("min_box_range_pct", 0.15),
-        max_box_range_pct=a_cfg.get("max_box_range_pct", 2.0),
-        signal_hysteresis_bars=a_cfg.get("signal_hysteresis_bars", 2),
-    )
-    last_long_ts = 0.0
-    last_short_ts = 0.0
-    last_tf = None
-    tf_stick = 0
-
-    ws_cfg = cfg.get("websocket",{})
-    ws = None
-    if ws_cfg.get("fills_enabled", False) and ws_cfg.get("url"):
+class _Wakeup:
+    """asyncio.Event segnalabile anche da altri thread; segnali ravvicinati si fondono in uno."""
+    def __init__(self, loop):
+        self.loop = loop
+        self.evt = asyncio.Event()
+        self._pending = False
+
+    def set(self):
+        if not self._pending:
+            self._pending = True
+            self.loop.call_soon_threadsafe(self._fire)
+
+    def _fire(self):
+        self._pending = False
+        self.evt.set()
+
+    async def wait(self, timeout):
         try:
-            ws = FillsWS(ws_cfg["url"], headers=ws_cfg.get("headers",{}))
-            ws.start()
+            await asyncio.wait_for(self.evt.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.evt.clear()
+
+class Shared:
+    """
+    Risorse di processo condivise dagli Engine dei simboli: sessioni HTTP dei
+    datafeed (e ticker in batch per venue), client Pionex con un solo rate
+    budget e cache, write-behind, metriche, stream delle quote e WS dei fill
+    (smistati per simbolo da FillRouter). quotes: fabbrica quotes(insts) dello
+    stream delle quote al posto dei WS delle venue (es. worker del supervisor).
+    """
+    def __init__(self, cfg, insts=None, quotes=None):
+        self.cfg = cfg
+        self.insts = insts
+        self.primary = insts[0]["pionex"] if insts else cfg["pionex"]["symbol"]
+        symbols = [i["pionex"] for i in insts] if insts else [cfg["pionex"]["symbol"]]
+        m_cfg = cfg.get("metrics", {}) or {}
+        self.metrics = Metrics(enabled=m_cfg.get("enabled", True))
+        self.prom_path = m_cfg.get("prometheus_path", "metrics.prom")
+
+        self.pnx = Pionex(key=os.environ.get("PIONEX_API_KEY",""), secret=os.environ.get("PIONEX_API_SECRET",""), cfg=cfg)
+        self.pnx.metrics = self.metrics
+        self.pnx.instruments = {i["pionex"]: i for i in insts or []}
+        df_cfg = cfg.get("datafeed",{}) or {}
+        set_base_urls(**(df_cfg.get("base_urls") or {}))
+        k_cfg = df_cfg.get("klines",{}) or {}
+        self.md = MarketData(hedge_delay_s=k_cfg.get("hedge_delay_s") if k_cfg.get("hedged", False) else None,
+                             deadline_s=k_cfg.get("deadline_s"), metrics=self.metrics)
+        self.md.instruments = list(insts or [])
+        self.md.batch_max_age_s = float(df_cfg.get("batch_max_age_s", 1.0))
+        self.wb = WriteBehind().start() if cfg["daemon"].get("write_behind", True) else None
+        self.writer = self.wb.submit if self.wb is not None else None
+        mirror_config_to_json(cfg, self.writer)
+
+        ws_cfg = cfg.get("websocket",{})
+        self.fill_buses = {s: FillBus(maxlen=ws_cfg.get("fills_buffer", 1000), track_seq=False) for s in symbols}
+        self.fill_router = FillRouter(self.fill_buses, default=self.primary)
+        self.ws = None
+        if ws_cfg.get("fills_enabled", False) and ws_cfg.get("url"):
+            try:
+                self.ws = FillsWS(ws_cfg["url"], headers=ws_cfg.get("headers",{}), on_fills=lambda _f: self.pnx.invalidate_account(),
+                                  bus=self.fill_router, out_path=ws_cfg.get("fills_export_path"),
+                                  export_every_s=ws_cfg.get("fills_export_every_s", 30))
+                self.ws.start()
+            except Exception:
+                self.ws = None
+
+        st_cfg = df_cfg.get("stream",{}) or {}
+        self.qs = None
+        if quotes is not None:
+            self.qs = quotes(insts)
+            self.qs.start()
+        elif st_cfg.get("enabled", False):
+            dp_cfg = df_cfg.get("depth", {}) or {}
+            try:
+                if dp_cfg.get("enabled", False):
+                    self.qs = DepthStream(urls=dp_cfg.get("urls"), max_age_s=st_cfg.get("max_age_s", 5.0), instruments=insts,
+                                          max_levels=dp_cfg.get("max_levels", 100), micro_levels=dp_cfg.get("micro_levels", 10),
+                                          micro_decay=dp_cfg.get("micro_decay", 0.7),
+                                          weight_band_bps=dp_cfg.get("weight_band_bps", 10.0))
+                else:
+                    self.qs = QuoteStream(urls=st_cfg.get("urls"), max_age_s=st_cfg.get("max_age_s", 5.0), instruments=insts)
+                self.qs.start()
+            except Exception:
+                self.qs = None
+
+    def close(self):
+        if self.qs is not None: self.qs.stop()
+        if self.ws is not None: self.ws.stop()
+        self.md.close()
+        self.pnx.close()
+        if self.wb is not None:
+            self.wb.stop()
+
+class Engine:
+    """
+    Loop di trading a eventi su asyncio (gira sul loop di MarketData). Stadi:
+      quote   - quote WS a ogni update (REST ogni loop_seconds se lo stream tace),
+                assess, backoff DFStatus; vol e PID campionati ogni loop_seconds
+      candles - candele del timeframe attivo + AlphaDetector ogni loop_seconds;
+                un segnale o una barra nuova svegliano decide
+      fills   - drena il FillBus nel ledger; un TP/SL eseguito sveglia decide
+      decide  - uscite, sizing, ordini; su quote nuova (al più ogni min_decide_s),
+                segnale, fill, cambio di stato o heartbeat
+      report  - state.json, report, orders.json, snapshot: mai sul percorso degli ordini
+    Deadline per stadio in daemon.engine.deadlines_s: letture e report vengono
+    interrotte alla scadenza, decide no (un ordine inviato non si annulla a metà)
+    e lo sforamento viene solo contato.
+    """
+    STAGES = ("quote", "candles", "fills", "decide", "report")
+
+    def __init__(self, cfg, shared=None, inst=None, home=None, warm=True):
+        """
+        shared: risorse di MultiEngine (None = le crea e le possiede questo engine).
+        inst: simboli per venue (None = strumento di default dei datafeed, modalità singola).
+        home: directory dei file di stato del simbolo (None = radice, come in modalità singola).
+        """
+        self.cfg = cfg
+        self.symbol = cfg["pionex"]["symbol"]
+        self.inst = inst
+        self.key = inst["pionex"] if inst is not None else None
+        self.home = home
+        self.peers = None
+        e_cfg = cfg["daemon"].get("engine", {}) or {}
+        self.min_decide_s = float(e_cfg.get("min_decide_s", 1.0))
+        self.deadlines = {n: None for n in self.STAGES}
+        self.deadlines.update(e_cfg.get("deadlines_s") or {})
+        self.stages = {n: {"n": 0, "timeouts": 0, "errors": 0, "overruns": 0, "last_ms": 0.0, "max_ms": 0.0, "last_error": None}
+                       for n in self.STAGES}
+        self.triggers = {}
+        self._owns_shared = shared is None
+        self.shared = shared or Shared(cfg)
+        self.primary = self._owns_shared or self.shared.primary == self.symbol
+        sh = self.shared
+        self.metrics, self.pnx, self.md, self.wb, self.writer = sh.metrics, sh.pnx, sh.md, sh.wb, sh.writer
+        self.qs, self.ws = sh.qs, sh.ws
+        self.prom_path = self._path(sh.prom_path) if self.primary else None
+
+        self.pid = PID(cfg["pid"]["kp"], cfg["pid"]["ki"], cfg["pid"]["kd"], cfg["pid"]["out_min"], cfg["pid"]["out_max"])
+        self.vol = RollingVol(maxlen=None, window_s=float(cfg["safe_mode"].get("lookback_minutes", 30)) * 60.0)
+        if inst is None:
+            self.md.vol = self.vol
+            self.candle_cache = self.md.candle_cache
+        else:
+            k_cfg = cfg.get("datafeed",{}).get("klines",{}) or {}
+            self.candle_cache = CandleCache(hedge_delay_s=k_cfg.get("hedge_delay_s") if k_cfg.get("hedged", False) else None,
+                                            deadline_s=k_cfg.get("deadline_s"), inst=inst)
+        l_cfg = cfg.get("ledger", {}) or {}
+        self.lad = Ledger(self._path(l_cfg.get("path", "ledger.db")),
+                          legacy_json=l_cfg.get("import_json", "orders.json") if home is None else None)
+        self.orders_export = self._path(l_cfg.get("export_path", "orders.json"))
+        self.state_path = self._path("state.json")
+        self.report_path = self._path("report.json")
+        ts_cfg = cfg.get("report", {}).get("series", {}) or {}
+        self.series = None
+        if ts_cfg.get("enabled", False):
+            self.series = TimeSeriesStore(self._path(ts_cfg.get("dir", "series")), last_path=self._path(ts_cfg.get("last_path", "report.json")),
+                                          last_n=ts_cfg.get("last_n", 500), rollup_last_n=ts_cfg.get("rollup_last_n", 288),
+                                          resolutions=tuple(ts_cfg.get("resolutions", ("1m", "5m", "1h"))),
+                                          max_bytes=ts_cfg.get("segment_max_bytes", 1_000_000),
+                                          max_age_s=ts_cfg.get("segment_max_age_s", 86_400),
+                                          keep=ts_cfg.get("keep_segments", 14), write_every_s=ts_cfg.get("write_every_s", 15),
+                                          writer=self.writer)
+        self.start = time.time()
+        self.backoff = 0
+        self.suspended = False
+
+        self.last_mid = None
+        self.last_status = DFStatus.OK
+
+        a_cfg = cfg.get("alpha", {})
+        self.alpha_on = bool(a_cfg.get("enabled", True))
+        self.alpha = AlphaDetector(
+            norm_len=a_cfg.get("norm_len", 100),
+            box_len=a_cfg.get("box_len", 14),
+            strong_close=a_cfg.get("strong_close", True),
+            min_box_range_pct=a_cfg.get("min_box_range_pct", 0.15),
+            max_box_range_pct=a_cfg.get("max_box_range_pct", 2.0),
+            signal_hysteresis_bars=a_cfg.get("signal_hysteresis_bars", 2),
+        )
+        self.alpha_out = (None, None, None)
+        self.alpha_seq = 0
+        self._alpha_used = 0
+        self._last_bar_t = None
+        self.last_long_ts = 0.0
+        self.last_short_ts = 0.0
+        self.last_tf = None
+        self.tf_stick = 0
+        self.stops = DynamicStops(cfg)
+        self.atrs = {}
+        self.trails = 0
+        self.slip_max = float(cfg.get("trading", {}).get("slip_bps", 0.0) or 0.0)
+        self.slip_blocked = 0
+
+        self.q = None
+        self.lev = self.u = None
+        self.view = {}
+        self._last_sample = 0.0
+        self._last_decide = 0.0
+        self._decided_status = None
+
+        snap_cfg = cfg["daemon"].get("snapshot", {}) or {}
+        self.snap_on = bool(snap_cfg.get("enabled", False))
+        self.snap_path = self._path(snap_cfg.get("path", "snapshot.json"))
+        self.snap_every = float(snap_cfg.get("every_s", 60))
+        self.last_snap = time.time()
+        if self.snap_on:
+            self._restore(snap_cfg)
+
+        if warm:
+            self.md.loop.run_until_complete(self.warm())
+
+        self.fill_bus = sh.fill_buses[self.symbol]
+        self._fills_resync = True
+
+    def _path(self, path):
+        if self.home is None or not path:
+            return path
+        os.makedirs(self.home, exist_ok=True)
+        return os.path.join(self.home, path)
+
+    async def warm(self):
+        if self.alpha_on:
+            try:
+                await self.candle_cache.warm(await self.md.session())
+            except Exception:
+                pass
+
+    # --- snapshot ---
+
+    def _snapshot(self, market_info=None):
+        return {
+            "alpha": self.alpha.get_state(), "pid": self.pid.get_state(), "vol": self.vol.get_state(),
+            "candles": self.candle_cache.get_state(), "market_info": market_info,
+            "last_long_ts": self.last_long_ts, "last_short_ts": self.last_short_ts,
+            "last_tf": self.last_tf, "tf_stick": self.tf_stick,
+            "last_mid": self.last_mid, "last_status": self.last_status.name,
+            "atr": {tf: a.get_state() for tf, a in self.atrs.items()},
+        }
+
+    def _save_snapshot(self, market_info=None):
+        try:
+            save_snapshot(self.snap_path, self._snapshot(market_info), symbol=self.symbol, writer=self.writer)
         except Exception:
-            ws = None
-
-    while not stopping and time.time() - start < cfg["daemon"]["max_runtime_seconds"]:
-      loop_s = cfg["daemon"]["loop_seconds"]
-      mid, vol_pct, div_bps, ts, alive = aggregate_quote_sync()
-      status, reason = assess(mid, vol_pct, div_bps, alive, cfg)
-
-      if mid is None or status in (DFStatus.SUSPEND, DFStatus.PANIC):
-          write_state_report(ts, status.value, reason, mid, vol_pct, div_bps)
-          backoff = min(cfg["daemon"]["exponential_backoff_max_s"], max(1, (backoff*2) or loop_s))
-          time.sleep(backoff); continue
-
-      lower, upper, levels = compute_grid(mid, std_pct=vol_pct, cfg=cfg, status=status.name)
-
-      error = cfg["pid"]["target_vol_pct"] - (vol_pct or 0.0)
-      u = pid.step(error, dt=max(loop_s, 1.0))
-      lev = leverage_from_pid(u, cfg["leverage"]["min"], cfg["leverage"]["max"])
-
-      risk_cfg = cfg.get("risk", {})
-      eq = pnx.get_portfolio_equity_usdt() or float(risk_cfg.get("portfolio_usdt_fallback", 10_000))
-      cap_usdt = max(0.0, min(eq * (risk_cfg.get("max_portfolio_pct", 3.0)/100.0), eq))
-      base_notional = min(cap_usdt, cfg["grid"]["notional_per_side_usdt"])
-
-      trades_today = 0
-      if os.path.exists("orders.json"):
-          try:
-              with open("orders.json","r") as f:
-                  trades_today = int((json.load(f).get("stats",{}) or {}).get("trades_day", 0))
-          except Exception:
-              trades_today = 0
-      t_cfg = cfg.get("timeframe_auto",{})
-      target_trades = int(cfg.get("alpha",{}).get("daily_trade_target", 6))
-      cooloff = int(cfg.get("alpha",{}).get("cooloff_seconds", 900))
-
-      tf, tf_stick = choose_timeframe(status, vol_pct, trades_today, target_trades, last_tf, t_cfg, tf_stick)
-      last_tf = tf
-
-      alpha_signal = None; box_top = box_bot = None
-      if alpha_on:
-          try:
-              candles = get_candles_sync(tf, limit=200)
-              if candles:
-                  t,o,h,l,c,v = candles[-1]
-                  alpha_signal, box_top, box_bot, vol_norm = alpha.update(o,h,l,c,v)
-              else:
-                  o=h=l=c=mid
-                  alpha_signal, box_top, box_bot, vol_norm = alpha.update(o,h,l,c,None)
-          except Exception:
-              o=h=l=c=mid
-              alpha_signal, box_top, box_bot, vol_norm = alpha.update(o,h,l,c,None)
-
-      can_trade_more = trades_today < target_trades
-      elapsed_long  = ts - last_long_ts
-      elapsed_short = ts - last_short_ts
-      can_long  = elapsed_long  >= cooloff
-      can_short = elapsed_short >= cooloff
-
-      place_grid = (last_mid is None or abs(mid - last_mid)/mid > 0.003 or status != last_status)
-
-      trading_mode = cfg.get("trading",{}).get("mode","grid")
-      sltp_on = bool(cfg.get("trading",{}).get("sltp_enabled", True))
-      sl_buf = float(cfg.get("trading",{}).get("sl_buffer_pct", 0.35))/100.0
-      dyn = cfg.get("dynamic_sl",{})
-      use_atr = dyn.get("use_atr", True)
-      atr_len = int(dyn.get("atr_len",14))
-      atr_mult = float(dyn.get("atr_mult",1.2))
-      use_box = dyn.get("use_box", True)
-      box_share = float(dyn.get("box_sl_share",0.5))
-      rr = float(cfg.get("trading",{}).get("tp_rr", 1.5))
-      entry_kind = cfg.get("trading",{}).get("entry_kind","MARKET")
-
-      lad = StreakBook()
-      lad.mark_exit_if_crossed(mid)
-      size_mult = lad.streak_mult(cfg)
-      adj_notional = base_notional * size_mult
-      qty_per_level = adj_notional / max(1,levels) / mid * max(lev, 0.01)
-      qty_breakout = (adj_notional / mid) * max(lev, 0.01)
-
-      if alpha_on and alpha_signal in ("long","short") and can_trade_more:
-          if trading_mode == "breakout" and sltp_on and ( (alpha_signal=="long" and can_long) or (alpha_signal=="short" and can_short) ):
-              ref = box_top if alpha_signal=="long" else box_bot
-              ref = ref or mid
-              if alpha_signal=="long":
-                  sl = ref * (1.0 - sl_buf)
-                  tp = ref + (ref - sl) * rr
-                  side = "BUY"
-              else:
-                  sl = ref * (1.0 + sl_buf)
-                  tp = ref - (sl - ref) * rr
-                  side = "SELL"
-              pnx.place_breakout_bracket(
-                  symbol=cfg["pionex"]["symbol"], side=side, price_ref=mid,
-                  qty=qty_breakout, sl_price=sl, tp_price=tp,
-                  entry_kind=entry_kind, reduce_only=cfg.get("trading",{}).get("reduce_only", True)
-              )
-              bump_trades_today(1)
-              try:
-                  lad.record_entry(side=side, qty=qty_breakout, entry_price=ref, sl=sl, tp=tp, ts=ts)
-              except Exception:
-                  pass
-              if alpha_signal=="long": last_long_ts = ts
-              else: last_short_ts = ts
-              place_grid = False
-          else:
-              micro_levels = max(3, min(6, levels//2))
-              band_center = (box_top if alpha_signal=="long" else box_bot) if (box_top and box_bot) else mid
-              lower, upper, _ = compute_grid(mid, std_pct=vol_pct, cfg=cfg, status=status.name)
-              micro_span = max(0.002*mid, 0.5 * (upper - lower))
-              mg_lower = band_center - micro_span
-              mg_upper = band_center + micro_span
-              if alpha_signal=="long" and can_long:
-                  pnx.sync_replace_grid(cfg["pionex"]["symbol"], mg_lower, mg_upper, micro_levels, qty_per_level, mid)
-                  last_long_ts = ts
-                  bump_trades_today(1)
-                  place_grid = False
-              elif alpha_signal=="short" and can_short:
-                  pnx.sync_replace_grid(cfg["pionex"]["symbol"], mg_lower, mg_upper, micro_levels, qty_per_level, mid)
-                  last_short_ts = ts
-                  bump_trades_today(1)
-                  place_grid = False
-
-      if place_grid and trading_mode == "grid":
-          pnx.sync_replace_grid(symbol=cfg["pionex"]["symbol"],
-                                lower=lower, upper=upper, levels=levels,
-                                qty=qty_per_level, price_ref=mid)
-          last_mid = mid
-          last_status = status
-
-      indicators = {"alpha_signal": alpha_signal, "box": [box_bot, box_top], "tf": tf, "mode": trading_mode}
-      write_state_report(ts, status.value, reason, mid, vol_pct, div_bps,
-                         extra={"lev": lev, "u": u, "grid":[lower, upper, levels], "indicators": indicators})
-
-      ws_fills = None
-      try:
-          with open("ws_fills.json","r") as f:
-              ws_fills = json.load(f).get("fills",[])
-      except Exception:
-          ws_fills = None
-
-      opens = pnx.list_open_orders(symbol=cfg["pionex"]["symbol"]) or []
-      fills = ws_fills if (ws_fills is not None) else (pnx.list_recent_fills(symbol=cfg["pionex"]["symbol"], limit=50) or [])
-
-      write_orders(opens, fills, stats={
-          "pnl_day": None,
-          "trades_day": trades_today,
-          "win_7d": None,
-          "sharpe_30d": None
-      })
-      mirror_config_to_json(cfg)
-
-      backoff = 0
-      time.sleep(loop_s)
+            pass
+
+    def _restore(self, snap_cfg):
+        snap, info = load_snapshot(self.snap_path, float(snap_cfg.get("max_age_s", 1800)), symbol=self.symbol)
+        if snap is None:
+            print(f"cold start ({info})")
+            return
+        try:
+            self.alpha.set_state(snap["alpha"])
+            self.pid.set_state(snap["pid"])
+            self.vol.set_state(snap["vol"])
+            self.candle_cache.set_state(snap.get("candles"))
+            if snap.get("market_info"):
+                self.pnx.cache.put(("market_info", self.symbol), snap["market_info"])
+            self.last_long_ts = float(snap.get("last_long_ts", 0.0))
+            self.last_short_ts = float(snap.get("last_short_ts", 0.0))
+            self.last_tf, self.tf_stick = snap.get("last_tf"), int(snap.get("tf_stick", 0))
+            self.last_mid = snap.get("last_mid")
+            self.last_status = DFStatus[snap.get("last_status", "OK")]
+            for tf, st in (snap.get("atr") or {}).items():
+                a = RollingATR(self.stops.atr_len)
+                if a.set_state(st):
+                    self.atrs[tf] = a
+            print(f"warm start from {self.snap_path} (age {info:.0f}s)")
+        except Exception as e:
+            print(f"snapshot restore failed: {e}")
+
+    # --- infrastruttura ---
+
+    async def _sleep(self, s):
+        try:
+            await asyncio.wait_for(self.stop.wait(), s)
+        except asyncio.TimeoutError:
+            pass
 
+    async def _stage(self, name, coro):
+        st = self.stages[name]
+        deadline = self.deadlines.get(name)
+        t0 = time.perf_counter()
+        try:
+            if deadline and name != "decide":
+                return await asyncio.wait_for(coro, deadline)
+            return await coro
+        except asyncio.TimeoutError:
+            st["timeouts"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            st["errors"] += 1
+            st["last_error"] = f"{type(e).__name__}: {e}"
+        finally:
+            ms = (time.perf_counter() - t0) * 1000.0
+            self.metrics.observe(name, ms)
+            st["n"] += 1; st["last_ms"] = ms; st["max_ms"] = max(st["max_ms"], ms)
+            if deadline and ms > deadline * 1000.0:
+                st["overruns"] += 1
+
+    def _trigger(self, reason):
+        self.triggers[reason] = self.triggers.get(reason, 0) + 1
+        self.decide_evt.set()
+
+    def summary(self):
+        """Riga per simbolo nello state.json del simbolo primario (modalità multi-simbolo)."""
+        q = self.q or {}
+        return {"status": q["status"].value if q.get("status") else None, "reason": q.get("reason"), "mid": q.get("mid"),
+                "vol_pct": q.get("vol_pct"), "lev": self.lev, "grid": self.view.get("grid"), "quote_src": q.get("src"),
+                "trades_today": self.lad.trades_today(q["ts"]) if q.get("ts") else None,
+                "state_path": self.state_path}
+
+    def _peer_summary(self):
+        if not self.peers or not self.primary:
+            return None
+        out = {}
+        for e in self.peers:
+            try: out[e.symbol] = e.summary()
+            except Exception as ex: out[e.symbol] = {"error": f"{type(ex).__name__}: {ex}"}
+        return out
+
+    def engine_stats(self):
+        return {"stages": {n: dict(s) for n, s in self.stages.items()}, "triggers": dict(self.triggers),
+                "backoff_s": self.backoff}
+
+    # --- stadi ---
+
+    async def _quote_loop(self):
+        while not self.stop.is_set():
+            loop_s = self.cfg["daemon"]["loop_seconds"]
+            if self.qs is not None:
+                await self.quote_evt.wait(loop_s)
+            else:
+                await self._sleep(max(0.0, self._last_sample + loop_s - time.monotonic()))
+            if self.stop.is_set():
+                return
+            await self._stage("quote", self._quote(loop_s))
+            if self.suspended:
+                await self._sleep(self.backoff)
+
+    async def _quote(self, loop_s):
+        cfg = self.cfg
+        now = time.monotonic()
+        sample = now - self._last_sample >= loop_s
+        alive = 0
+        if self.qs is not None:
+            with self.metrics.time("quote.stream"):
+                mid, vol_pct, div_bps, ts, alive = self.qs.aggregate_quote(sample=sample, key=self.key, vol=self.vol)
+            src = self.qs.src
+        if not alive:
+            if not sample:
+                return
+            with self.metrics.time("quote.rest"):
+                mid, vol_pct, div_bps, ts, alive = await self.md.aggregate_quote(self.inst, vol=self.vol)
+            src = "rest"
+        if sample:
+            self._last_sample = now
+        status, reason = assess(mid, vol_pct, div_bps, alive, cfg)
+        self.q = {"mid": mid, "vol_pct": vol_pct, "div_bps": div_bps, "ts": ts, "alive": alive,
+                  "status": status, "reason": reason, "src": src}
+
+        if mid is None or status in (DFStatus.SUSPEND, DFStatus.PANIC):
+            self.suspended = True
+            write_state_report(ts, status.value, reason, mid, vol_pct, div_bps, series=self.series, writer=self.writer,
+                               path=self.state_path, report_path=self.report_path)
+            self.backoff = min(cfg["daemon"]["exponential_backoff_max_s"], max(1, (self.backoff*2) or loop_s))
+            return
+        self.suspended = False
+        self.backoff = 0
+
+        if sample or self.lev is None:
+            error = cfg["pid"]["target_vol_pct"] - (vol_pct or 0.0)
+            self.u = self.pid.step(error, dt=max(loop_s, 1.0))
+            self.lev = leverage_from_pid(self.u, cfg["leverage"]["min"], cfg["leverage"]["max"])
+
+        if status != self._decided_status:
+            self._trigger("status")
+        elif now - self._last_decide >= self.min_decide_s:
+            self._trigger("quote")
+
+    async def _candle_loop(self):
+        while not self.stop.is_set():
+            await self._stage("candles", self._candles())
+            await self._sleep(self.cfg["daemon"]["loop_seconds"])
+
+    async def _candles(self):
+        q = self.q
+        if not self.alpha_on or q is None or self.suspended:
+            return
+        cfg = self.cfg
+        trades_today = self.lad.trades_today(q["ts"])
+        target_trades = int(cfg.get("alpha",{}).get("daily_trade_target", 6))
+        tf, self.tf_stick = choose_timeframe(q["status"], q["vol_pct"], trades_today, target_trades,
+                                             self.last_tf, cfg.get("timeframe_auto",{}), self.tf_stick)
+        self.last_tf = tf
+
+        mid = q["mid"]
+        candles = None
+        try:
+            with self.metrics.time("candles.fetch"):
+                candles = await asyncio.wait_for(self.candle_cache.get(await self.md.session(), tf), self.deadlines.get("candles"))
+        except Exception:
+            candles = None
+        with self.metrics.time("alpha.update"):
+            if candles:
+                t,o,h,l,c,v = candles[-1]
+                out = self.alpha.update(o,h,l,c,v)
+            else:
+                out = self.alpha.update(mid,mid,mid,mid,None)
+        if candles:
+            with self.metrics.time("atr.update"):
+                self._update_atr(tf, candles)
+        self.alpha_out = out[:3]
+        self.alpha_seq += 1
+        new_bar = bool(candles) and candles[-1][0] != self._last_bar_t
+        if candles:
+            self._last_bar_t = candles[-1][0]
+        if out[0] in ("long","short"):
+            self._trigger("signal")
+        elif new_bar:
+            self._trigger("bar")
+
+    def _update_atr(self, tf, candles):
+        """Solo le barre chiuse non ancora viste (l'ultima è quella in corso): O(1) per barra dopo il primo giro."""
+        a = self.atrs.get(tf)
+        if a is None:
+            a = self.atrs[tf] = RollingATR(self.stops.atr_len)
+        i = len(candles) - 1
+        lo = max(0, i - a.n - 1)
+        while i > lo and (a.last_t is None or candles[i - 1][0] > a.last_t):
+            i -= 1
+        for t, o, h, l, c, v in candles[i:-1]:
+            a.update(h, l, c, t=t)
+
+    def atr(self):
+        a = self.atrs.get(self.last_tf)
+        return a.value() if a is not None and len(a) else None
+
+    async def _trail(self, mid, atr):
+        """Trailing degli SL delle posizioni aperte nel ledger (e dello stop sull'exchange, se registrato)."""
+        for p in self.lad.open_positions():
+            sl = self.stops.trail_stop(p["side"], p["entry"], p["sl"], mid, atr)
+            if sl is None:
+                continue
+            oid = p["sl_oid"]
+            if oid is not None:
+                res = await asyncio.to_thread(self.pnx.replace_stop, self.symbol, p["side"], p["qty"], sl, oid)
+                if not res["ok"]:
+                    continue
+                oid = self.pnx.order_id(res)
+            self.lad.update_stop(p["id"], sl, oid)
+            self.trails += 1
+
+    def _slippage(self, qty):
+        """Slippage stimato sul book consolidato per un market di qty, per lato (None senza book L2)."""
+        if not isinstance(self.qs, DepthStream):
+            return None
+        return {s: self.qs.slippage(s, qty, key=self.key) for s in ("BUY", "SELL")}
+
+    def _slip_ok(self, est, entry_kind):
+        """Ingresso market ammesso se lo slippage stimato resta entro trading.slip_bps (senza stima: sempre)."""
+        if entry_kind != "MARKET" or est is None or self.slip_max <= 0:
+            return True
+        if est["complete"] and est["bps"] <= self.slip_max:
+            return True
+        self.slip_blocked += 1
+        return False
+
+    async def _fills_loop(self):
+        while not self.stop.is_set():
+            await self._stage("fills", self._fills())
+            await self.fill_evt.wait(self.cfg["daemon"]["loop_seconds"])
+
+    async def _fills(self):
+        # via REST all'avvio, senza WS o dopo un buco di sequenza
+        if self.ws is None or self.fill_bus.take_resync() or self._fills_resync:
+            with self.metrics.time("fills.fetch"):
+                rest = await asyncio.to_thread(self.pnx.list_recent_fills, symbol=self.symbol, limit=50)
+            self.fill_bus.publish(rest, source="rest")
+            self._fills_resync = False
+        closed = False
+        ts = self.q["ts"] if self.q else None
+        with self.metrics.time("fills.apply"):
+            for f in self.fill_bus.drain():
+                try:
+                    closed = self.lad.apply_fill(f, fill_key(f), ts) or closed
+                except Exception:
+                    pass
+        if closed:
+            self._trigger("fill")
+
+    async def _decide_loop(self):
+        while not self.stop.is_set():
+            if not await self.decide_evt.wait(self.cfg["daemon"]["loop_seconds"]):
+                self.triggers["heartbeat"] = self.triggers.get("heartbeat", 0) + 1
+            if self.stop.is_set():
+                return
+            await self._stage("decide", self._decide())
+            self._last_decide = time.monotonic()
+
+    async def _decide(self):
+        q = self.q
+        if q is None or self.suspended or self.lev is None:
+            return
+        cfg = self.cfg
+        pnx, lad = self.pnx, self.lad
+        symbol = self.symbol
+        mid, vol_pct, status, ts = q["mid"], q["vol_pct"], q["status"], q["ts"]
+        lev = self.lev
+        self._decided_status = status
+
+        with self.metrics.time("decide.compute_grid"):
+            lower, upper, levels = compute_grid(mid, std_pct=vol_pct, cfg=cfg, status=status.name)
+
+        risk_cfg = cfg.get("risk", {})
+        with self.metrics.time("decide.equity"):
+            eq = await asyncio.to_thread(pnx.get_portfolio_equity_usdt) or float(risk_cfg.get("portfolio_usdt_fallback", 10_000))
+        cap_usdt = max(0.0, min(eq * (risk_cfg.get("max_portfolio_pct", 3.0)/100.0), eq))
+        base_notional = min(cap_usdt, cfg["grid"]["notional_per_side_usdt"])
+
+        trades_today = lad.trades_today(ts)
+        target_trades = int(cfg.get("alpha",{}).get("daily_trade_target", 6))
+        cooloff = int(cfg.get("alpha",{}).get("cooloff_seconds", 900))
+
+        # il segnale vale per un solo giro di decide dopo l'update che lo ha prodotto
+        alpha_signal, box_top, box_bot = self.alpha_out
+        if self.alpha_seq == self._alpha_used:
+            alpha_signal = None
+        self._alpha_used = self.alpha_seq
+
+        can_trade_more = trades_today < target_trades
+        can_long  = ts - self.last_long_ts  >= cooloff
+        can_short = ts - self.last_short_ts >= cooloff
+
+        place_grid = (self.last_mid is None or abs(mid - self.last_mid)/mid > 0.003 or status != self.last_status)
+
+        trading_mode = cfg.get("trading",{}).get("mode","grid")
+        sltp_on = bool(cfg.get("trading",{}).get("sltp_enabled", True))
+        atr = self.atr()
+        entry_kind = cfg.get("trading",{}).get("entry_kind","MARKET")
+
+        if atr:
+            with self.metrics.time("decide.trail"):
+                await self._trail(mid, atr)
+        with self.metrics.time("decide.sizing"):
+            lad.mark_exit_if_crossed(mid, ts)
+            size_mult = lad.streak_mult(cfg)
+            adj_notional = base_notional * size_mult
+            qty_per_level = adj_notional / max(1,levels) / mid * max(lev, 0.01)
+            qty_breakout = (adj_notional / mid) * max(lev, 0.01)
+        with self.metrics.time("decide.slippage"):
+            slip = self._slippage(qty_breakout)
+
+        if self.alpha_on and alpha_signal in ("long","short") and can_trade_more:
+            side = "BUY" if alpha_signal=="long" else "SELL"
+            can_side = can_long if alpha_signal=="long" else can_short
+            # book troppo sottile per il market: si ripiega sulla micro-griglia di limit
+            if trading_mode == "breakout" and sltp_on and can_side and self._slip_ok((slip or {}).get(side), entry_kind):
+                ref = box_top if alpha_signal=="long" else box_bot
+                ref = ref or mid
+                sl, tp = self.stops.levels(side, ref, atr, box_top, box_bot)
+                with self.metrics.time("decide.bracket"):
+                    br = await asyncio.to_thread(
+                        pnx.place_breakout_bracket,
+                        symbol=symbol, side=side, price_ref=mid,
+                        qty=qty_breakout, sl_price=sl, tp_price=tp,
+                        entry_kind=entry_kind, reduce_only=cfg.get("trading",{}).get("reduce_only", True)
+                    )
+                lad.bump_trades_today(1, ts)
+                try:
+                    # qty normalizzata al passo dell'exchange: i fill d'uscita la coprono esattamente
+                    q_entry = ((br.get("entry") or {}).get("body") or {}).get("quantity", qty_breakout)
+                    lad.record_entry(side=side, qty=q_entry, entry_price=ref, sl=sl, tp=tp, ts=ts,
+                                     tp_oid=pnx.order_id(br.get("tp")), sl_oid=pnx.order_id(br.get("sl")))
+                except Exception:
+                    pass
+                if alpha_signal=="long": self.last_long_ts = ts
+                else: self.last_short_ts = ts
+                place_grid = False
+            else:
+                micro_levels = max(3, min(6, levels//2))
+                band_center = (box_top if alpha_signal=="long" else box_bot) if (box_top and box_bot) else mid
+                micro_span = max(0.002*mid, 0.5 * (upper - lower))
+                mg_lower = band_center - micro_span
+                mg_upper = band_center + micro_span
+                if alpha_signal=="long" and can_long:
+                    with self.metrics.time("decide.grid"):
+                        await asyncio.to_thread(pnx.sync_replace_grid, symbol, mg_lower, mg_upper, micro_levels, qty_per_level, mid)
+                    self.last_long_ts = ts
+                    lad.bump_trades_today(1, ts)
+                    place_grid = False
+                elif alpha_signal=="short" and can_short:
+                    with self.metrics.time("decide.grid"):
+                        await asyncio.to_thread(pnx.sync_replace_grid, symbol, mg_lower, mg_upper, micro_levels, qty_per_level, mid)
+                    self.last_short_ts = ts
+                    lad.bump_trades_today(1, ts)
+                    place_grid = False
+
+        if place_grid and trading_mode == "grid":
+            with self.metrics.time("decide.grid"):
+                res = await asyncio.to_thread(pnx.sync_replace_grid, symbol=symbol,
+                                              lower=lower, upper=upper, levels=levels,
+                                              qty=qty_per_level, price_ref=mid)
+            # griglia non aggiornata (lettura ordini fallita): si riprova al giro successivo
+            if res.get("ok", True):
+                self.last_mid = mid
+                self.last_status = status
+
+        self.view = {"grid": [lower, upper, levels],
+                     "indicators": {"alpha_signal": alpha_signal, "box": [box_bot, box_top], "tf": self.last_tf, "mode": trading_mode,
+                                    "atr": atr, "trails": self.trails,
+                                    "slip_bps": {s: e["bps"] for s, e in slip.items() if e} if slip else None,
+                                    "slip_blocked": self.slip_blocked}}
+
+    async def _report_loop(self):
+        while not self.stop.is_set():
+            await self._stage("report", self._report())
+            await self._sleep(self.cfg["daemon"]["loop_seconds"])
+
+    async def _report(self):
+        q = self.q
+        if q is None or self.suspended or self.lev is None:
+            return
+        pnx, qs, wb = self.pnx, self.qs, self.wb
+        t0 = time.perf_counter()
+        fills = self.fill_bus.stats()
+        if len(self.shared.fill_buses) > 1:
+            fills["router"] = self.shared.fill_router.stats()
+        write_state_report(q["ts"], q["status"].value, q["reason"], q["mid"], q["vol_pct"], q["div_bps"],
+                           extra={"lev": self.lev, "u": self.u, "grid": self.view.get("grid"),
+                                  "indicators": self.view.get("indicators"),
+                                  "feeds": self.md.stats(self.candle_cache), "quote_src": q["src"],
+                                  "quote_age_s": qs.ages(key=self.key) if qs is not None else None,
+                                  "depth": qs.depth_stats(key=self.key) if isinstance(qs, DepthStream) else None,
+                                  "rate_limit": pnx.scheduler.stats() if pnx.scheduler is not None else None,
+                                  "pionex_cache": pnx.cache.stats(),
+                                  "persist": wb.stats() if wb is not None else None,
+                                  "fills": fills,
+                                  "engine": self.engine_stats(),
+                                  "metrics": self.metrics.snapshot() if self.metrics.enabled and self.primary else None,
+                                  "symbols": self._peer_summary()},
+                           series=self.series, writer=self.writer, path=self.state_path, report_path=self.report_path)
+        if self.metrics.enabled and self.prom_path:
+            write_text(self.prom_path, self.metrics.prometheus(), self.writer)
+        self.metrics.observe("report.state", (time.perf_counter() - t0) * 1000.0)
+
+        with self.metrics.time("report.orders"):
+            opens = await asyncio.to_thread(pnx.list_open_orders, symbol=self.symbol) or []
+            try:
+                self.lad.export_json(self.orders_export, opens, self.fill_bus.recent(50), ts=q["ts"], writer=self.writer)
+            except Exception:
+                pass
+
+        if self.snap_on and time.time() - self.last_snap >= self.snap_every:
+            self._save_snapshot(await asyncio.to_thread(pnx.market_info, self.symbol))
+            self.last_snap = time.time()
+
+    # --- ciclo di vita ---
+
+    async def main(self, stop=None):
+        """stop: evento condiviso di MultiEngine (segnali e durata massima gestiti dal chiamante)."""
+        loop = asyncio.get_running_loop()
+        self.stop = stop or asyncio.Event()
+        self.quote_evt = _Wakeup(loop)
+        self.fill_evt = _Wakeup(loop)
+        self.decide_evt = _Wakeup(loop)
+        if self.qs is not None:
+            self.qs.add_listener(self.quote_evt.set, key=self.key)
+        self.fill_bus.add_listener(self.fill_evt.set)
+        if stop is None:
+            signal.signal(signal.SIGTERM, lambda *_: loop.call_soon_threadsafe(self.stop.set))
+
+        readers = [asyncio.create_task(f()) for f in (self._quote_loop, self._candle_loop, self._fills_loop, self._report_loop)]
+        decider = asyncio.create_task(self._decide_loop())
+        if stop is None:
+            await self._sleep(max(0.0, self.cfg["daemon"]["max_runtime_seconds"] - (time.time() - self.start)))
+            self.stop.set()
+        else:
+            await stop.wait()
+        for t in readers:
+            t.cancel()
+        # decide finisce il giro in corso: ordini inviati vanno comunque registrati nel ledger
+        self.decide_evt.set()
+        await asyncio.gather(*readers, return_exceptions=True)
+        try:
+            await asyncio.wait_for(decider, self.deadlines.get("decide") or 30.0)
+        except Exception:
+            pass
+
+    def close(self):
+        if self.snap_on:
+            try: self._save_snapshot(self.pnx.market_info(self.symbol))
+            except Exception: pass
+        self.lad.close()
+        if self.series is not None:
+            try: self.series.close()
+            except Exception: pass
+        if self._owns_shared:
+            self.shared.close()
+
+class MultiEngine:
+    """
+    Più simboli in un processo: un Engine per simbolo sullo stesso loop, con
+    sessioni HTTP, client Pionex (rate budget e cache), write-behind, stream
+    delle quote e WS dei fill condivisi (Shared). Il primo simbolo di
+    cfg["symbols"] tiene i file alla radice, gli altri in symbols/<SIMBOLO>/
+    (tutti, con root=False: la radice è del supervisor).
+    """
+    def __init__(self, cfg, quotes=None, root=True):
+        self.cfg = cfg
+        self.insts, cfgs = [], []
+        for entry in cfg["symbols"]:
+            inst = instrument_of(entry)
+            c = deep_merge(copy.deepcopy(cfg), (entry.get("overrides") if isinstance(entry, dict) else None) or {})
+            c["pionex"]["symbol"] = inst["pionex"]
+            self.insts.append(inst)
+            cfgs.append(c)
+        self.shared = Shared(cfg, self.insts, quotes)
+        self.md = self.shared.md
+        self.engines = [Engine(c, shared=self.shared, inst=i, home=None if n == 0 and root else os.path.join("symbols", i["pionex"]),
+                               warm=False)
+                        for n, (c, i) in enumerate(zip(cfgs, self.insts))]
+        if root:
+            self.engines[0].peers = self.engines
+        self.md.loop.run_until_complete(self._warm())
+        self.start = time.time()
+
+    async def _warm(self):
+        await asyncio.gather(*(e.warm() for e in self.engines))
+
+    async def main(self):
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        signal.signal(signal.SIGTERM, lambda *_: loop.call_soon_threadsafe(stop.set))
+        tasks = [asyncio.create_task(e.main(stop)) for e in self.engines]
+        try:
+            await asyncio.wait_for(stop.wait(), max(0.0, self.cfg["daemon"]["max_runtime_seconds"] - (time.time() - self.start)))
+        except asyncio.TimeoutError:
+            pass
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        for e in self.engines:
+            try: e.close()
+            except Exception: pass
+        self.shared.close()
+
+def run():
+    cfg = load_cfg()
+    eng = MultiEngine(cfg) if cfg.get("symbols") else Engine(cfg)
+    try:
+        eng.md.loop.run_until_complete(eng.main())
+    finally:
+        eng.close()
     time.sleep(cfg["daemon"]["sigterm_grace_seconds"])
 
 if __name__ == "__main__":
@@ -0,0 +1,117 @@
+import time, threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# bucket in ms: 0.05 .. ~105 s, fattore 1.5 (stile Prometheus, estremi inclusi a destra)
+BUCKETS_MS = tuple(round(0.05 * 1.5 ** i, 4) for i in range(37))
+
+class Histogram:
+    """Istogramma a bucket fissi: record O(log B), quantili stimati per interpolazione nel bucket."""
+    __slots__ = ("counts", "n", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.n = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, ms):
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.n += 1
+        self.sum += ms
+        if ms > self.max:
+            self.max = ms
+
+    def quantile(self, q):
+        if not self.n:
+            return None
+        rank = q * self.n
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lo = BUCKETS_MS[i - 1] if i > 0 else 0.0
+                hi = BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max
+                return min(lo + (hi - lo) * (rank - seen) / c, self.max)
+            seen += c
+        return self.max
+
+    def summary(self):
+        return {"n": self.n, "mean_ms": (self.sum / self.n) if self.n else None,
+                "p50_ms": self.quantile(0.50), "p95_ms": self.quantile(0.95), "p99_ms": self.quantile(0.99),
+                "max_ms": self.max}
+
+class Metrics:
+    """
+    Latenze per stadio del loop e chiamate per venue / endpoint (conteggi, errori,
+    latenza). Export in testo Prometheus e come blocco "metrics" di state.json.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = bool(enabled)
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.calls = {"venue": {}, "endpoint": {}}
+
+    def observe(self, stage, ms):
+        if not self.enabled:
+            return
+        with self._lock:
+            h = self.stages.get(stage)
+            if h is None:
+                h = self.stages[stage] = Histogram()
+            h.record(ms)
+
+    @contextmanager
+    def time(self, stage):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - t0) * 1000.0)
+
+    def call(self, kind, name, ms, error=False):
+        """kind: "venue" (host dei datafeed) o "endpoint" (path REST Pionex)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            c = self.calls[kind].get(name)
+            if c is None:
+                c = self.calls[kind][name] = [0, 0, Histogram()]
+            c[0] += 1
+            if error:
+                c[1] += 1
+            c[2].record(ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "stages": {s: h.summary() for s, h in self.stages.items()},
+                **{f"{k}s": {n: {"calls": c[0], "errors": c[1], **c[2].summary()} for n, c in v.items()}
+                   for k, v in self.calls.items()},
+            }
+
+    def prometheus(self, prefix="solusdbot"):
+        out = []
+        with self._lock:
+            out.append(f"# TYPE {prefix}_stage_latency_ms histogram")
+            for s, h in sorted(self.stages.items()):
+                out += _hist_lines(f"{prefix}_stage_latency_ms", f'stage="{s}"', h)
+            for kind, calls in self.calls.items():
+                # una famiglia alla volta: TYPE e poi tutti i suoi campioni
+                for i, fam in ((0, "calls"), (1, "errors")):
+                    out.append(f"# TYPE {prefix}_{kind}_{fam}_total counter")
+                    for n, c in sorted(calls.items()):
+                        out.append(f'{prefix}_{kind}_{fam}_total{{{kind}="{n}"}} {c[i]}')
+                out.append(f"# TYPE {prefix}_{kind}_latency_ms histogram")
+                for n, (_, _, h) in sorted(calls.items()):
+                    out += _hist_lines(f"{prefix}_{kind}_latency_ms", f'{kind}="{n}"', h)
+        return "\n".join(out) + "\n"
+
+def _hist_lines(name, labels, h):
+    lines, cum = [], 0
+    for b, c in zip(BUCKETS_MS, h.counts):
+        cum += c
+        lines.append(f'{name}_bucket{{{labels},le="{b}"}} {cum}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {h.n}')
+    lines.append(f"{name}_sum{{{labels}}} {h.sum:.3f}")
+    lines.append(f"{name}_count{{{labels}}} {h.n}")
+    return lines
@@ -0,0 +1,113 @@
+import os, json, time, hashlib, threading
+
+def atomic_write(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def write_json(path, obj, writer=None, indent=None):
+    """Scrive obj come JSON in modo atomico, oppure lo passa al writer (es. WriteBehind.submit)."""
+    if writer is not None:
+        writer(path, obj, indent=indent)
+        return
+    atomic_write(path, json.dumps(obj, indent=indent, separators=None if indent else (",", ":"), default=str))
+
+def write_text(path, text, writer=None):
+    """Come write_json per contenuto già testuale (es. metriche Prometheus)."""
+    if writer is not None:
+        writer(path, text)
+        return
+    atomic_write(path, text)
+
+class WriteBehind:
+    """
+    Scritture su disco fuori dal loop: submit() registra l'ultimo oggetto per
+    percorso (le scritture in coda sullo stesso file si fondono), il thread lo
+    serializza, salta il file se l'hash del contenuto non è cambiato e scrive
+    con tmp + rename. Gli oggetti passati a submit() non vanno più modificati.
+    """
+    def __init__(self):
+        self._pending = {}
+        self._hash = {}
+        self._cond = threading.Condition()
+        self._busy = False
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._stats = {"submitted": 0, "coalesced": 0, "written": 0, "unchanged": 0, "errors": 0,
+                       "bytes": 0, "last_lag_ms": 0.0, "max_lag_ms": 0.0, "last_error": None}
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit(self, path, obj, indent=None):
+        with self._cond:
+            self._stats["submitted"] += 1
+            prev = self._pending.get(path)
+            if prev is not None:
+                self._stats["coalesced"] += 1
+            # la latenza si misura dalla prima richiesta non ancora scritta
+            self._pending[path] = (obj, indent, prev[2] if prev is not None else time.monotonic())
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if not self._pending and self._stopping:
+                    return
+                batch, self._pending = self._pending, {}
+                self._busy = True
+            for path, (obj, indent, t0) in batch.items():
+                self._write(path, obj, indent, t0)
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def _write(self, path, obj, indent, t0):
+        try:
+            if isinstance(obj, str):
+                data = obj
+            else:
+                data = json.dumps(obj, indent=indent, separators=None if indent else (",", ":"), default=str)
+            h = hashlib.blake2b(data.encode(), digest_size=16).digest()
+            if self._hash.get(path) == h and os.path.exists(path):
+                self._stats["unchanged"] += 1
+            else:
+                atomic_write(path, data)
+                self._hash[path] = h
+                self._stats["written"] += 1
+                self._stats["bytes"] += len(data)
+        except Exception as e:
+            self._stats["errors"] += 1
+            self._stats["last_error"] = f"{path}: {e}"
+        lag = (time.monotonic() - t0) * 1000.0
+        self._stats["last_lag_ms"] = lag
+        self._stats["max_lag_ms"] = max(self._stats["max_lag_ms"], lag)
+
+    def flush(self, timeout=None):
+        """Attende che tutto ciò che è in coda sia su disco."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._busy:
+                left = None if deadline is None else deadline - time.monotonic()
+                if left is not None and left <= 0:
+                    return False
+                self._cond.wait(left)
+        return True
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            oldest = min((p[2] for p in self._pending.values()), default=None)
+            return {**self._stats, "pending": len(self._pending),
+                    "lag_s": (now - oldest) if oldest is not None else 0.0}
+
+    def stop(self, timeout=10.0):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
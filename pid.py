@@ -5,6 +5,13 @@ class PID:
         self.i = 0.0
         self.prev_e = None
 
+    def get_state(self):
+        return {"i": self.i, "prev_e": self.prev_e}
+
+    def set_state(self, st):
+        self.i = float(st.get("i", 0.0))
+        self.prev_e = st.get("prev_e")
+
     def step(self, error, dt):
         p = self.kp * error
         self.i += self.ki * error * dt
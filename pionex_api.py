@@ -1,10 +1,16 @@
-import time, json, requests, hmac, hashlib
+import time, json, requests, hmac, hashlib, asyncio, aiohttp
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from ratelimit import RequestScheduler, PROTECT, ENTRY, GRID, READ
+from cache import TTLCache
 
 class Pionex:
     def __init__(self, key, secret, cfg):
         self.key, self.secret = key, secret
         self.cfg = cfg
-        self._mktinfo = None
+        ttl = {"market_info": 3600, "equity": 30, "open_orders": 10, "fills": 5}
+        ttl.update(cfg["pionex"].get("cache_ttl_s") or {})
+        self.cache = TTLCache(ttls=ttl)
         self.base = cfg["pionex"].get("base_url","https://api.pionex.com")
         ep = cfg["pionex"].get("endpoints",{})
         self.paths = {
@@ -19,6 +25,18 @@ class Pionex:
         self.h_key  = cfg["pionex"].get("key_header","X-API-KEY")
         self.h_sign = cfg["pionex"].get("sign_header","X-API-SIGN")
         self.h_ts   = cfg["pionex"].get("ts_header","X-API-TS")
+        self.max_concurrency = max(1, int(cfg["pionex"].get("max_concurrency", 4)))
+        self.pool_size = max(self.max_concurrency, int(cfg["pionex"].get("pool_size", 8)))
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+        self._executor = None
+        rl = cfg["pionex"].get("rate_limit") or {}
+        self.scheduler = RequestScheduler.from_cfg(rl) if rl.get("enabled", False) else None
+        self.metrics = None
+        # modalità multi-simbolo: tick/step di fallback per simbolo (voci di cfg["symbols"])
+        self.instruments = {}
 
     def _sign(self, ts, method, path, body_str=""):
         prehash = f"{ts}{method.upper()}{path}{body_str}".encode()
@@ -27,109 +45,267 @@ class Pionex:
     def _headers(self, ts, sig):
         return { self.h_key: self.key, self.h_sign: sig, self.h_ts: str(ts), "Content-Type":"application/json" }
 
-    def _request(self, method, path, params=None, body=None):
-        url = self.base + path
+    def _signed(self, method, path, body):
         ts = int(time.time()*1000)
         body_str = json.dumps(body, separators=(",",":")) if (body and method.upper()!="GET") else ""
-        sig = self._sign(ts, method, path, body_str)
-        headers = self._headers(ts, sig)
-        if method.upper()=="GET":
-            r = requests.get(url, headers=headers, params=params, timeout=10)
-        else:
-            r = requests.post(url, headers=headers, params=params, data=body_str, timeout=10)
-        r.raise_for_status()
+        return body_str, self._headers(ts, self._sign(ts, method, path, body_str))
+
+    def _priority(self, method, path, body):
+        """
+        Cancel e ordini protettivi (stop, uscite reduceOnly GTC) prima, poi entry
+        (MARKET/IOC, anche reduceOnly), poi griglia, letture per ultime.
+        """
+        if method.upper() == "GET":
+            return READ
+        if path in (self.paths["cancel_all"], self.paths["cancel_order"]):
+            return PROTECT
+        if path == self.paths["place_order"] and isinstance(body, dict):
+            kind = str(body.get("type", ""))
+            if "STOP" in kind:
+                return PROTECT
+            if kind == "MARKET" or body.get("timeInForce") == "IOC":
+                return ENTRY
+            if body.get("reduceOnly"):
+                return PROTECT
+            return GRID
+        return ENTRY
+
+    def _request(self, method, path, params=None, body=None):
+        if self.scheduler is not None:
+            self.scheduler.acquire(path, self._priority(method, path, body))
+        url = self.base + path
+        body_str, headers = self._signed(method, path, body)
+        t0, ok = time.perf_counter(), False
+        try:
+            if method.upper()=="GET":
+                r = self.http.get(url, headers=headers, params=params, timeout=10)
+            else:
+                try:
+                    r = self.http.post(url, headers=headers, params=params, data=body_str, timeout=10)
+                finally:
+                    self.invalidate_account()
+            r.raise_for_status()
+            ok = True
+        finally:
+            if self.metrics is not None:
+                self.metrics.call("endpoint", f"{method.upper()} {path}", (time.perf_counter() - t0) * 1000.0, error=not ok)
         try: return r.json()
         except Exception: return {"raw": r.text}
 
-    def market_info(self):
-        if self._mktinfo: return self._mktinfo
+    @staticmethod
+    def _result(body, fn):
+        try:
+            return {"ok": True, "body": body, "response": fn()}
+        except Exception as e:
+            return {"ok": False, "body": body, "error": str(e)}
+
+    @staticmethod
+    def order_id(res):
+        """orderId dalla risposta di un ordine piazzato (risultato di place_orders), None se assente."""
+        r = (res or {}).get("response") if (res or {}).get("ok") else None
+        if isinstance(r, dict):
+            d = r.get("data") if isinstance(r.get("data"), dict) else r
+            return d.get("orderId", d.get("id"))
+        return None
+
+    def _run_all(self, calls):
+        """Esegue chiamate indipendenti con al più max_concurrency in volo; risultati nello stesso ordine."""
+        if self.max_concurrency <= 1 or len(calls) <= 1:
+            return [c() for c in calls]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="pionex")
+        return list(self._executor.map(lambda c: c(), calls))
+
+    def place_orders(self, bodies):
+        """Piazza ordini indipendenti in parallelo. Ritorna un {"ok", "body", "response"|"error"} per ordine."""
+        path = self.paths["place_order"]
+        return self._run_all([lambda b=b: self._result(b, lambda: self._request("POST", path, body=b)) for b in bodies])
+
+    def cancel_orders(self, symbol, order_ids):
+        path = self.paths["cancel_order"]
+        bodies = [{"symbol": symbol, "orderId": oid} for oid in order_ids]
+        return self._run_all([lambda b=b: self._result(b, lambda: self._request("POST", path, body=b)) for b in bodies])
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self.http.close()
+
+    def invalidate_account(self):
+        """Da chiamare su ogni fill: equity, ordini aperti e fill in cache non valgono più."""
+        self.cache.invalidate("equity", "open_orders", "fills")
+
+    def market_info(self, symbol=None):
+        symbol = symbol or self.cfg["pionex"]["symbol"]
+        return self.cache.get(("market_info", symbol), lambda: self._fetch_market_info(symbol))
+
+    def _fetch_market_info(self, symbol=None):
+        symbol = symbol or self.cfg["pionex"]["symbol"]
         try:
-            info = self._request("GET", self.paths["market_info"], params={"symbol": self.cfg["pionex"]["symbol"]})
+            info = self._request("GET", self.paths["market_info"], params={"symbol": symbol})
             tick = float(info.get("tickSize")) if isinstance(info, dict) else None
             step = float(info.get("stepSize")) if isinstance(info, dict) else None
         except Exception:
             tick = None; step = None
-        tick = tick or self.cfg["pionex"].get("tick_size") or 0.001
-        step = step or self.cfg["pionex"].get("step_size") or 0.001
-        self._mktinfo = {"tick_size": tick, "step_size": step}
-        return self._mktinfo
+        fb = self.instruments.get(symbol) or self.cfg["pionex"]
+        tick = tick or fb.get("tick_size") or 0.001
+        step = step or fb.get("step_size") or 0.001
+        return {"tick_size": tick, "step_size": step}
 
-    def _norm_price(self, p):
-        tick = self.market_info()["tick_size"]
+    def _norm_price(self, p, symbol=None):
+        tick = self.market_info(symbol)["tick_size"]
         return round(p / tick) * tick
 
-    def _norm_qty(self, q):
-        step = self.market_info()["step_size"]
+    def _norm_qty(self, q, symbol=None):
+        step = self.market_info(symbol)["step_size"]
         return round(q / step) * step
 
+    def grid_ladder(self, lower, upper, levels, qty, price_ref, symbol=None):
+        """Ladder target normalizzata: lista di (side, price, qty)."""
+        step = (upper - lower)/max(1,levels-1)
+        q = self._norm_qty(qty, symbol)
+        out = []
+        for i in range(levels):
+            price = self._norm_price(lower + i*step, symbol)
+            out.append(("BUY" if price <= price_ref else "SELL", price, q))
+        return out
+
     def sync_replace_grid(self, symbol, lower, upper, levels, qty, price_ref):
+        g = self.cfg.get("grid", {})
+        if g.get("reconcile", False):
+            return self.reconcile_grid(symbol, lower, upper, levels, qty, price_ref,
+                                       tol_ticks=g.get("reconcile_tol_ticks", 1))
+        return self._replace_grid_full(symbol, lower, upper, levels, qty, price_ref)
+
+    def _replace_grid_full(self, symbol, lower, upper, levels, qty, price_ref):
         try:
             self._request("POST", self.paths["cancel_all"], body={"symbol": symbol})
         except Exception:
             pass
-        placed = 0
-        step = (upper - lower)/max(1,levels-1)
-        for i in range(levels):
-            price = self._norm_price(lower + i*step)
-            q = self._norm_qty(qty)
-            side = "BUY" if price <= price_ref else "SELL"
+        results = self.place_orders([self._grid_order(symbol, side, price, q)
+                                     for side, price, q in self.grid_ladder(lower, upper, levels, qty, price_ref, symbol)])
+        placed = sum(1 for r in results if r["ok"])
+        return {"ok": True, "placed": placed, "mode": "full", "results": results}
+
+    @staticmethod
+    def _grid_order(symbol, side, price, q):
+        return {"symbol": symbol, "side": side, "type":"LIMIT", "price": price, "quantity": q, "timeInForce":"GTC"}
+
+    @staticmethod
+    def _order_fields(o):
+        oid = o.get("orderId", o.get("id"))
+        price = o.get("price")
+        qty = o.get("size", o.get("quantity", o.get("origQty", o.get("qty"))))
+        return oid, str(o.get("side","")).upper(), price, qty
+
+    def reconcile_grid(self, symbol, lower, upper, levels, qty, price_ref, tol_ticks=1):
+        """
+        Diff tra ladder target e ordini LIMIT di griglia a riposo: cancella solo i
+        livelli cambiati e piazza solo quelli mancanti. I livelli entro tol_ticks
+        (stesso side e qty) restano sul book e mantengono la priorità in coda.
+        Ordini non-LIMIT o reduceOnly (TP/SL dei bracket) non vengono toccati.
+        Se la lettura degli ordini aperti fallisce (anche scartata dal rate
+        limit) la griglia resta com'è per questo giro: un cancel_all toglierebbe
+        anche TP/SL dei bracket.
+        """
+        try:
+            resting = self._open_orders(symbol)
+            self.cache.put(("open_orders", symbol), resting)
+        except Exception as e:
+            return {"ok": False, "placed": 0, "cancelled": 0, "kept": 0, "mode": "skipped", "error": str(e), "results": []}
+        mi = self.market_info(symbol)
+        tick, step = mi["tick_size"], mi["step_size"]
+        book = []
+        for o in resting:
+            if str(o.get("type","LIMIT")).upper() != "LIMIT" or o.get("reduceOnly"):
+                continue
+            oid, side, price, q = self._order_fields(o)
             try:
-                self._request("POST", self.paths["place_order"], body={
-                    "symbol": symbol, "side": side, "type":"LIMIT",
-                    "price": price, "quantity": q, "timeInForce":"GTC"
-                })
-                placed += 1
-            except Exception:
+                book.append([oid, side, round(float(price)/tick), round(float(q)/step), False])
+            except (TypeError, ValueError):
                 continue
-        return {"ok": True, "placed": placed}
+        # abbinamento per distanza crescente su tutta la ladder: un ordine esatto
+        # non viene preso da un livello vicino che lo tollererebbe soltanto
+        ladder = self.grid_ladder(lower, upper, levels, qty, price_ref, symbol)
+        pairs = []
+        for i, (side, price, q) in enumerate(ladder):
+            pt, qs = round(price/tick), round(q/step)
+            for j, b in enumerate(book):
+                if b[1] == side and b[3] == qs and abs(b[2] - pt) <= tol_ticks:
+                    pairs.append((abs(b[2] - pt), i, j))
+        matched = set()
+        for _, i, j in sorted(pairs):
+            if i not in matched and not book[j][4]:
+                matched.add(i)
+                book[j][4] = True
+        missing = [lvl for i, lvl in enumerate(ladder) if i not in matched]
+        c_res = self.cancel_orders(symbol, [b[0] for b in book if not b[4] and b[0] is not None])
+        p_res = self.place_orders([self._grid_order(symbol, side, price, q) for side, price, q in missing])
+        kept = sum(1 for b in book if b[4])
+        return {"ok": True, "placed": sum(1 for r in p_res if r["ok"]),
+                "cancelled": sum(1 for r in c_res if r["ok"]), "kept": kept, "mode": "diff",
+                "results": c_res + p_res}
+
+    def bracket_orders(self, symbol, side, price_ref, qty, sl_price, tp_price, entry_kind="MARKET", reduce_only=True):
+        """Ritorna (entry, tp, sl) come body d'ordine normalizzati."""
+        q = self._norm_qty(qty, symbol)
+        if entry_kind == "MARKET":
+            entry = {"symbol": symbol, "side": side, "type":"MARKET", "quantity": q, "reduceOnly": bool(reduce_only)}
+        else:
+            entry = {"symbol": symbol, "side": side, "type":"LIMIT", "price": self._norm_price(price_ref, symbol),
+                     "quantity": q, "timeInForce":"IOC", "reduceOnly": bool(reduce_only)}
+        exit_side = "SELL" if side == "BUY" else "BUY"
+        tp = {"symbol": symbol, "side": exit_side, "type":"LIMIT",
+              "price": self._norm_price(tp_price, symbol), "quantity": q, "timeInForce":"GTC", "reduceOnly": True}
+        sl = {"symbol": symbol, "side": exit_side, "type":"STOP_MARKET",
+              "stopPrice": self._norm_price(sl_price, symbol), "quantity": q, "timeInForce":"GTC", "reduceOnly": True}
+        return entry, tp, sl
 
     def place_breakout_bracket(self, symbol, side, price_ref, qty, sl_price, tp_price, entry_kind="MARKET", reduce_only=True):
-        q = self._norm_qty(qty)
-        try:
-            if entry_kind == "MARKET":
-                self._request("POST", self.paths["place_order"], body={
-                    "symbol": symbol, "side": side, "type":"MARKET",
-                    "quantity": q, "reduceOnly": bool(reduce_only)
-                })
-            else:
-                p = self._norm_price(price_ref)
-                self._request("POST", self.paths["place_order"], body={
-                    "symbol": symbol, "side": side, "type":"LIMIT",
-                    "price": p, "quantity": q, "timeInForce":"IOC", "reduceOnly": bool(reduce_only)
-                })
-        except Exception as e:
-            return {"ok": False, "error": f"entry_failed: {e}"}
-        try:
-            exit_side = "SELL" if side == "BUY" else "BUY"
-            self._request("POST", self.paths["place_order"], body={
-                "symbol": symbol, "side": exit_side, "type":"LIMIT",
-                "price": self._norm_price(tp_price), "quantity": q, "timeInForce":"GTC", "reduceOnly": True
-            })
-        except Exception:
-            pass
-        try:
-            exit_side = "SELL" if side == "BUY" else "BUY"
-            self._request("POST", self.paths["place_order"], body={
-                "symbol": symbol, "side": exit_side, "type":"STOP_MARKET",
-                "stopPrice": self._norm_price(sl_price), "quantity": q, "timeInForce":"GTC", "reduceOnly": True
-            })
-        except Exception:
-            pass
-        return {"ok": True}
+        entry, tp, sl = self.bracket_orders(symbol, side, price_ref, qty, sl_price, tp_price, entry_kind, reduce_only)
+        e_res = self.place_orders([entry])[0]
+        if not e_res["ok"]:
+            return {"ok": False, "error": f"entry_failed: {e_res['error']}", "entry": e_res}
+        tp_res, sl_res = self.place_orders([tp, sl])
+        return {"ok": True, "entry": e_res, "tp": tp_res, "sl": sl_res}
+
+    def replace_stop(self, symbol, side, qty, stop_price, old_oid=None):
+        """
+        Trailing: nuovo STOP_MARKET reduceOnly per la posizione `side` e poi
+        cancellazione del vecchio (mai una finestra senza stop). Ritorna il
+        risultato del nuovo ordine come place_orders().
+        """
+        exit_side = "SELL" if side == "BUY" else "BUY"
+        res = self.place_orders([{"symbol": symbol, "side": exit_side, "type": "STOP_MARKET",
+                                  "stopPrice": self._norm_price(stop_price, symbol), "quantity": self._norm_qty(qty, symbol),
+                                  "timeInForce": "GTC", "reduceOnly": True}])[0]
+        if res["ok"] and old_oid is not None:
+            self.cancel_order(symbol, old_oid)
+            self.cache.invalidate("open_orders")
+        return res
+
+    def _open_orders(self, symbol):
+        j = self._request("GET", self.paths["open_orders"], params={"symbol": symbol})
+        if isinstance(j, dict) and "orders" in j: return j["orders"]
+        if isinstance(j, list): return j
+        return []
 
     def list_open_orders(self, symbol):
         try:
-            j = self._request("GET", self.paths["open_orders"], params={"symbol": symbol})
-            if isinstance(j, dict) and "orders" in j: return j["orders"]
-            if isinstance(j, list): return j
+            return self.cache.get(("open_orders", symbol), lambda: self._open_orders(symbol))
         except Exception: pass
         return []
 
+    def _recent_fills(self, symbol, limit):
+        j = self._request("GET", self.paths["fills"], params={"symbol": symbol, "limit": limit})
+        if isinstance(j, dict) and "fills" in j: return j["fills"]
+        if isinstance(j, list): return j
+        return []
+
     def list_recent_fills(self, symbol, limit=50):
         try:
-            j = self._request("GET", self.paths["fills"], params={"symbol": symbol, "limit": limit})
-            if isinstance(j, dict) and "fills" in j: return j["fills"]
-            if isinstance(j, list): return j
+            return self.cache.get(("fills", symbol, limit), lambda: self._recent_fills(symbol, limit))
         except Exception: pass
         return []
 
@@ -139,6 +315,9 @@ class Pionex:
         except Exception: return {"ok": False}
 
     def get_portfolio_equity_usdt(self):
+        return self.cache.get("equity", self._fetch_equity)
+
+    def _fetch_equity(self):
         try:
             j = self._request("GET", self.paths["balance"], params={})
             if isinstance(j, dict):
@@ -151,3 +330,74 @@ class Pionex:
                             return float(a.get("equity", a.get("balance")))
         except Exception: pass
         return None
+
+class AsyncPionex(Pionex):
+    """
+    Variante asyncio: stessa firma e normalizzazione, una ClientSession keep-alive
+    e un semaforo che limita a max_concurrency le richieste in volo.
+    """
+    def __init__(self, key, secret, cfg):
+        super().__init__(key, secret, cfg)
+        self._session = None
+        self._sem = asyncio.Semaphore(self.max_concurrency)
+
+    async def session(self):
+        if self._session is None or self._session.closed:
+            conn = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=75)
+            self._session = aiohttp.ClientSession(connector=conn, timeout=aiohttp.ClientTimeout(total=10))
+        return self._session
+
+    async def arequest(self, method, path, params=None, body=None):
+        if self.scheduler is not None:
+            await asyncio.to_thread(self.scheduler.acquire, path, self._priority(method, path, body))
+        url = self.base + path
+        s = await self.session()
+        async with self._sem:
+            body_str, headers = self._signed(method, path, body)
+            t0, ok = time.perf_counter(), False
+            try:
+                async with s.request(method.upper(), url, headers=headers, params=params,
+                                     data=body_str if method.upper()!="GET" else None) as r:
+                    r.raise_for_status()
+                    text = await r.text()
+                ok = True
+            finally:
+                if method.upper() != "GET":
+                    self.invalidate_account()
+                if self.metrics is not None:
+                    self.metrics.call("endpoint", f"{method.upper()} {path}", (time.perf_counter() - t0) * 1000.0, error=not ok)
+        try: return json.loads(text)
+        except Exception: return {"raw": text}
+
+    async def _aresult(self, body, coro):
+        try:
+            return {"ok": True, "body": body, "response": await coro}
+        except Exception as e:
+            return {"ok": False, "body": body, "error": str(e)}
+
+    async def aplace_orders(self, bodies):
+        path = self.paths["place_order"]
+        return list(await asyncio.gather(*(self._aresult(b, self.arequest("POST", path, body=b)) for b in bodies)))
+
+    async def acancel_orders(self, symbol, order_ids):
+        path = self.paths["cancel_order"]
+        bodies = [{"symbol": symbol, "orderId": oid} for oid in order_ids]
+        return list(await asyncio.gather(*(self._aresult(b, self.arequest("POST", path, body=b)) for b in bodies)))
+
+    async def aplace_grid(self, symbol, lower, upper, levels, qty, price_ref):
+        results = await self.aplace_orders([self._grid_order(symbol, side, price, q)
+                                            for side, price, q in self.grid_ladder(lower, upper, levels, qty, price_ref, symbol)])
+        return {"ok": True, "placed": sum(1 for r in results if r["ok"]), "results": results}
+
+    async def aplace_breakout_bracket(self, symbol, side, price_ref, qty, sl_price, tp_price, entry_kind="MARKET", reduce_only=True):
+        entry, tp, sl = self.bracket_orders(symbol, side, price_ref, qty, sl_price, tp_price, entry_kind, reduce_only)
+        e_res = (await self.aplace_orders([entry]))[0]
+        if not e_res["ok"]:
+            return {"ok": False, "error": f"entry_failed: {e_res['error']}", "entry": e_res}
+        tp_res, sl_res = await self.aplace_orders([tp, sl])
+        return {"ok": True, "entry": e_res, "tp": tp_res, "sl": sl_res}
+
+    async def aclose(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self.close()
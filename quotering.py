@@ -0,0 +1,111 @@
+import time, struct, asyncio, threading
+from multiprocessing import shared_memory
+from ws_quotes import QuoteStream, VENUES
+
+# header: seq dell'ultimo record scritto, numero di slot (64 byte, una cache line)
+_HDR = struct.Struct("<QQ48x")
+# record a layout fisso: seq, indice simbolo, indice venue, bid, ask, mid, ts (48 byte)
+_REC = struct.Struct("<QHH4xdddd")
+_SEQ = struct.Struct("<Q")
+
+class QuoteRing:
+    """
+    Ring buffer di quote in memoria condivisa, un solo scrittore (il supervisor)
+    e N lettori (i worker). Ogni slot porta il proprio seq: lo scrittore lo
+    azzera, scrive il record e poi lo reimposta, così un lettore che trova un
+    seq diverso da quello atteso sa che lo slot è stato sovrascritto (o è in
+    scrittura) e lo salta invece di leggere un record a metà.
+    """
+    def __init__(self, slots=4096, name=None):
+        self.slots = int(slots)
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=_HDR.size + self.slots * _REC.size)
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        self.seq = 0
+        self._lock = threading.Lock()
+        _HDR.pack_into(self.buf, 0, 0, self.slots)
+
+    def publish(self, sym, venue, bid, ask, ts=None):
+        ts = ts or time.time()
+        with self._lock:
+            self.seq += 1
+            off = _HDR.size + ((self.seq - 1) % self.slots) * _REC.size
+            _SEQ.pack_into(self.buf, off, 0)
+            _REC.pack_into(self.buf, off, 0, sym, venue, bid, ask, (bid + ask) / 2.0, ts)
+            _SEQ.pack_into(self.buf, off, self.seq)
+            _SEQ.pack_into(self.buf, 0, self.seq)
+
+    def stats(self):
+        return {"name": self.name, "slots": self.slots, "published": self.seq}
+
+    def close(self, unlink=True):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            try: self.shm.unlink()
+            except FileNotFoundError: pass
+
+class QuoteRingReader:
+    """Lettore con cursore proprio: poll() ritorna i record nuovi, quelli persi per ritardo finiscono in overruns."""
+    def __init__(self, name):
+        self.shm = shared_memory.SharedMemory(name=name)
+        self.buf = self.shm.buf
+        self.slots = _HDR.unpack_from(self.buf, 0)[1]
+        # si parte dai record ancora nel ring: quote recenti subito disponibili
+        self.cursor = max(0, _SEQ.unpack_from(self.buf, 0)[0] - self.slots)
+        self.stats = {"read": 0, "overruns": 0}
+
+    def poll(self, max_n=None):
+        """[(simbolo, venue, bid, ask, mid, ts)] dal cursore fino all'ultimo seq scritto."""
+        head = _SEQ.unpack_from(self.buf, 0)[0]
+        if head - self.cursor > self.slots:
+            self.stats["overruns"] += head - self.cursor - self.slots
+            self.cursor = head - self.slots
+        if max_n is not None:
+            head = min(head, self.cursor + max_n)
+        out = []
+        for seq in range(self.cursor + 1, head + 1):
+            off = _HDR.size + ((seq - 1) % self.slots) * _REC.size
+            rec = _REC.unpack_from(self.buf, off)
+            if rec[0] != seq or _SEQ.unpack_from(self.buf, off)[0] != seq:
+                self.stats["overruns"] += 1
+                continue
+            out.append(rec[1:])
+        self.cursor = head
+        self.stats["read"] += len(out)
+        return out
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+class RingQuoteStream(QuoteStream):
+    """
+    QuoteStream dei worker del supervisor: stesse letture (aggregate_quote,
+    ages, listener) ma il book si aggiorna dal QuoteRing invece che dai WS
+    delle venue. symbols: simboli Pionex nell'ordine degli indici del ring.
+    """
+    src = "ring"
+
+    def __init__(self, ring_name, symbols, instruments=None, max_age_s=5.0, poll_s=0.005):
+        super().__init__(max_age_s=max_age_s, instruments=instruments)
+        self.ring_name = ring_name
+        self.symbols = list(symbols)
+        self.poll_s = float(poll_s)
+        self._wanted = {i["pionex"] for i in self.instruments}
+        self.ring_stats = {}
+
+    async def _run(self):
+        reader = QuoteRingReader(self.ring_name)
+        self.ring_stats = reader.stats
+        try:
+            while not self._stop.is_set():
+                recs = reader.poll()
+                for sym, venue, bid, ask, _mid, ts in recs:
+                    key = self.symbols[sym]
+                    if key in self._wanted:
+                        self._on_quote(VENUES[venue], bid, ask, key=key, ts=ts)
+                if not recs:
+                    await asyncio.sleep(self.poll_s)
+        finally:
+            reader.close()
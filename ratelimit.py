@@ -0,0 +1,136 @@
+import time, threading, heapq, itertools
+
+PROTECT, ENTRY, GRID, READ = 0, 1, 2, 3
+CLASS_NAMES = ("protect", "entry", "grid", "read")
+
+class RateLimitDropped(Exception):
+    """Richiesta scartata dallo scheduler (coda piena o attesa oltre max_wait)."""
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.tokens = self.burst
+        self.t = time.monotonic()
+
+    def _refill(self, now):
+        if now > self.t:
+            self.tokens = min(self.burst, self.tokens + (now - self.t) * self.rate)
+            self.t = now
+
+    def wait_time(self, now):
+        """Secondi prima che sia disponibile un token (0 se già disponibile)."""
+        self._refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1.0
+
+class RequestScheduler:
+    """
+    Rate limit lato client per endpoint (+ bucket globale opzionale) con classi di
+    priorità: tra le richieste in attesa passa sempre quella di classe più alta il
+    cui endpoint ha un token. Coda limitata: se piena si scarta la richiesta meno
+    prioritaria. Entry/grid/read oltre max_wait_s vengono scartate come stale.
+    """
+    def __init__(self, buckets=None, global_bucket=None, max_queue=64, max_wait_s=None):
+        buckets = dict(buckets or {})
+        self._default = buckets.pop("default", {"rate": 10, "burst": 10})
+        self._bucket_cfg = buckets
+        self._buckets = {}
+        self._global = TokenBucket(**global_bucket) if global_bucket else None
+        self.max_queue = int(max_queue)
+        mw = {"entry": 2.0, "grid": 3.0, "read": 2.0}
+        mw.update(max_wait_s or {})
+        self.max_wait = [None] + [mw.get(n) for n in CLASS_NAMES[1:]]
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._stats = {n: {"n": 0, "wait_sum": 0.0, "wait_max": 0.0, "dropped": 0} for n in CLASS_NAMES}
+
+    @classmethod
+    def from_cfg(cls, rl):
+        return cls(buckets=rl.get("buckets"), global_bucket=rl.get("global"),
+                   max_queue=rl.get("max_queue", 64), max_wait_s=rl.get("max_wait_s"))
+
+    def _bucket(self, path):
+        b = self._buckets.get(path)
+        if b is None:
+            b = self._buckets[path] = TokenBucket(**self._bucket_cfg.get(path, self._default))
+        return b
+
+    def _ready_in(self, path, now):
+        w = self._bucket(path).wait_time(now)
+        if self._global is not None:
+            w = max(w, self._global.wait_time(now))
+        return w
+
+    def _pick(self, now):
+        for item in sorted(self._heap):
+            if self._ready_in(item[2], now) <= 0.0:
+                return item
+        return None
+
+    def _remove(self, item):
+        self._heap.remove(item)
+        heapq.heapify(self._heap)
+
+    def _drop(self, item, why):
+        item[4] = why
+        self._stats[CLASS_NAMES[item[0]]]["dropped"] += 1
+
+    def acquire(self, path, prio=READ):
+        now = time.monotonic()
+        mw = self.max_wait[prio]
+        # [prio, seq, path, enqueued, dropped_reason]
+        item = [prio, next(self._seq), path, now, None]
+        deadline = now + mw if mw is not None else None
+        with self._cond:
+            if len(self._heap) >= self.max_queue:
+                worst = max(self._heap)
+                if worst[0] <= prio:
+                    self._stats[CLASS_NAMES[prio]]["dropped"] += 1
+                    raise RateLimitDropped(f"queue full ({self.max_queue})")
+                self._remove(worst)
+                self._drop(worst, "evicted")
+                self._cond.notify_all()
+            heapq.heappush(self._heap, item)
+            while True:
+                if item[4]:
+                    raise RateLimitDropped(item[4])
+                now = time.monotonic()
+                if deadline is not None and now > deadline:
+                    self._remove(item)
+                    self._drop(item, "stale")
+                    self._cond.notify_all()
+                    raise RateLimitDropped(f"stale after {mw:.1f}s")
+                if self._pick(now) is item:
+                    self._remove(item)
+                    self._bucket(path).take(now)
+                    if self._global is not None:
+                        self._global.take(now)
+                    s = self._stats[CLASS_NAMES[prio]]
+                    w = now - item[3]
+                    s["n"] += 1; s["wait_sum"] += w; s["wait_max"] = max(s["wait_max"], w)
+                    self._cond.notify_all()
+                    return w
+                timeout = min(0.05, max(0.001, self._ready_in(path, now)))
+                if deadline is not None:
+                    timeout = min(timeout, max(0.001, deadline - now))
+                self._cond.wait(timeout)
+
+    def stats(self):
+        with self._cond:
+            depth = {n: 0 for n in CLASS_NAMES}
+            for item in self._heap:
+                depth[CLASS_NAMES[item[0]]] += 1
+            return {
+                "depth": depth,
+                "classes": {n: {"n": s["n"], "dropped": s["dropped"],
+                                "wait_avg_ms": (s["wait_sum"] / s["n"] * 1000.0) if s["n"] else 0.0,
+                                "wait_max_ms": s["wait_max"] * 1000.0}
+                            for n, s in self._stats.items()},
+            }
@@ -1,6 +1,8 @@
 import json, time, os
+from persist import write_json
 
-def write_state_report(ts, status, reason, mid, vol_pct, div_bps, extra=None):
+def write_state_report(ts, status, reason, mid, vol_pct, div_bps, extra=None, series=None, writer=None,
+                       path="state.json", report_path="report.json"):
     payload = {
         "ts": ts,
         "ts_iso": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts)),
@@ -11,31 +13,16 @@ def write_state_report(ts, status, reason, mid, vol_pct, div_bps, extra=None):
         "div_bps": div_bps,
         **(extra or {})
     }
-    with open("state.json","w") as f:
-        json.dump(payload, f, indent=2)
-    with open("report.json","a") as f:
+    if writer is not None:
+        write_json(path, payload, writer)
+    else:
+        with open(path,"w") as f:
+            json.dump(payload, f, indent=2)
+    if series is not None:
+        series.append(ts, mid, vol_pct, div_bps, payload.get("lev"))
+        return
+    with open(report_path,"a") as f:
         f.write(json.dumps(payload) + "\n")
 
-def write_orders(open_orders, closed_orders, stats=None):
-    payload = {"open": open_orders or [], "closed": closed_orders or [], "stats": stats or {}}
-    with open("orders.json","w") as f:
-        json.dump(payload, f, indent=2)
-
-def mirror_config_to_json(cfg):
-    with open("config.json","w") as f:
-        json.dump(cfg, f, indent=2)
-
-def bump_trades_today(n=1):
-    path = "orders.json"
-    data = {"open":[], "closed":[], "stats":{}}
-    if os.path.exists(path):
-        try:
-            with open(path,"r") as f:
-                data = json.load(f)
-        except Exception:
-            pass
-    stats = data.get("stats", {})
-    stats["trades_day"] = int(stats.get("trades_day", 0)) + n
-    data["stats"] = stats
-    with open(path,"w") as f:
-        json.dump(data, f, indent=2)
+def mirror_config_to_json(cfg, writer=None):
+    write_json("config.json", cfg, writer, indent=2)
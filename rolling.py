@@ -0,0 +1,172 @@
+import math
+from collections import deque
+
+class RollingVar:
+    """
+    Varianza di popolazione su finestra scorrevole in O(1) per update
+    (Welford con rimozione). Ogni `resync` rimozioni ricalcola esattamente
+    media e M2 per non accumulare errore numerico.
+    """
+    def __init__(self, maxlen=None, resync=None):
+        self.maxlen = int(maxlen) if maxlen else None
+        self.resync = int(resync or self.maxlen or 1000)
+        self.buf = deque()
+        self.mean = 0.0
+        self.m2 = 0.0
+        self._removed = 0
+
+    def __len__(self):
+        return len(self.buf)
+
+    def push(self, x):
+        buf = self.buf
+        buf.append(x)
+        n = len(buf)
+        d = x - self.mean
+        self.mean += d / n
+        self.m2 += d * (x - self.mean)
+        if self.maxlen is not None and n > self.maxlen:
+            self.pop()
+
+    def pop(self):
+        x = self.buf.popleft()
+        n = len(self.buf)
+        if n == 0:
+            self.mean = 0.0; self.m2 = 0.0
+            return x
+        d = x - self.mean
+        self.mean -= d / n
+        self.m2 -= d * (x - self.mean)
+        self._removed += 1
+        if self._removed >= self.resync:
+            self._recompute()
+        return x
+
+    def _recompute(self):
+        self._removed = 0
+        n = len(self.buf)
+        if n == 0:
+            self.mean = 0.0; self.m2 = 0.0
+            return
+        m = math.fsum(self.buf) / n
+        self.mean = m
+        self.m2 = math.fsum((x - m) * (x - m) for x in self.buf)
+
+    def pvariance(self):
+        n = len(self.buf)
+        return max(0.0, self.m2 / n) if n else 0.0
+
+    def pstdev(self):
+        return math.sqrt(self.pvariance())
+
+    def get_state(self):
+        return list(self.buf)
+
+    def set_state(self, values):
+        self.buf = deque(float(x) for x in values)
+        if self.maxlen is not None:
+            while len(self.buf) > self.maxlen:
+                self.buf.popleft()
+        self._recompute()
+
+    def clear(self):
+        self.buf.clear()
+        self.mean = 0.0; self.m2 = 0.0; self._removed = 0
+
+class RollingVol:
+    """
+    Volatilità (pstdev dei rendimenti semplici, in %) del mid consensus.
+    Finestra a conteggio (maxlen = numero di mid, come la vecchia deque(maxlen=300))
+    e/o a tempo (window_s, es. safe_mode.lookback_minutes * 60).
+    """
+    def __init__(self, maxlen=300, window_s=None):
+        self.maxlen = int(maxlen) if maxlen else None
+        self.window_s = float(window_s) if window_s else None
+        self._rets = RollingVar(maxlen=(self.maxlen - 1) if self.maxlen else None)
+        self._ts = deque()
+        self._last = None
+
+    def update(self, mid, ts):
+        if self._last is not None and self._last != 0:
+            self._rets.push(mid / self._last - 1.0)
+            self._ts.append(ts)
+            if len(self._ts) > len(self._rets):
+                self._ts.popleft()
+        self._last = mid
+        if self.window_s is not None:
+            cutoff = ts - self.window_s
+            while self._ts and self._ts[0] < cutoff:
+                self._ts.popleft()
+                self._rets.pop()
+        return self.vol_pct()
+
+    def vol_pct(self):
+        if len(self._rets) < 2:
+            return 0.0
+        return self._rets.pstdev() * 100.0
+
+    def get_state(self):
+        return {"rets": self._rets.get_state(), "ts": list(self._ts), "last": self._last}
+
+    def set_state(self, st):
+        self._rets.set_state(st.get("rets", []))
+        self._ts = deque(float(t) for t in st.get("ts", []))
+        while len(self._ts) > len(self._rets):
+            self._ts.popleft()
+        self._last = st.get("last")
+
+    def reset(self):
+        self._rets.clear(); self._ts.clear(); self._last = None
+
+class RollingATR:
+    """
+    ATR incrementale: true range della barra chiusa e media semplice degli
+    ultimi n (come il vecchio calc_atr), O(1) per barra. La somma si ricalcola
+    esattamente ogni n*50 barre per non accumulare errore numerico.
+    """
+    def __init__(self, n=14):
+        self.n = max(1, int(n))
+        self._trs = deque()
+        self._sum = 0.0
+        self._since = 0
+        self.prev_c = None
+        self.last_t = None
+
+    def __len__(self):
+        return len(self._trs)
+
+    def update(self, h, l, c, t=None):
+        """Una barra chiusa; t (open time) opzionale: barre già viste (t <= last_t) vengono ignorate."""
+        if t is not None:
+            if self.last_t is not None and t <= self.last_t:
+                return self.value()
+            self.last_t = t
+        h, l, c = float(h), float(l), float(c)
+        pc = self.prev_c
+        tr = h - l if pc is None else max(h - l, abs(h - pc), abs(l - pc))
+        self.prev_c = c
+        self._trs.append(tr)
+        self._sum += tr
+        if len(self._trs) > self.n:
+            self._sum -= self._trs.popleft()
+        self._since += 1
+        if self._since >= self.n * 50:
+            self._since = 0
+            self._sum = math.fsum(self._trs)
+        return self.value()
+
+    def value(self):
+        return (self._sum / len(self._trs)) if self._trs else 0.0
+
+    def get_state(self):
+        return {"n": self.n, "trs": list(self._trs), "prev_c": self.prev_c, "last_t": self.last_t}
+
+    def set_state(self, st):
+        """Ignorato (False) se atr_len è cambiato."""
+        if int(st.get("n", -1)) != self.n:
+            return False
+        self._trs = deque(float(x) for x in st.get("trs", [])[-self.n:])
+        self._sum = math.fsum(self._trs)
+        self._since = 0
+        self.prev_c, self.last_t = st.get("prev_c"), st.get("last_t")
+        return True
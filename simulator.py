@@ -0,0 +1,808 @@
+# simulator.py — spaces only, LF
+"""
+Simulatore locale di Pionex (REST di pionex.endpoints + WS dei fill) e dei
+datafeed Binance/Bybit/OKX (ticker, kline, stream top-of-book e book L2 con
+snapshot + diff), per test di carico e benchmark del bot completo offline.
+
+  python simulator.py [--config config.yaml] [--csv candles_1m.csv] [--port 8765]
+                      [--write-config config.sim.yaml]
+  SOLUSDBOT_CONFIG=config.sim.yaml python main.py
+
+Il prezzo segue un percorso ripetuto: barre 1m da CSV (t,o,h,l,c,v come in
+backtest.py, ripartendo dall'inizio a fine file) oppure un random walk con
+seed; dentro la barra il percorso è o -> l/h -> h/l -> c. Gli ordini LIMIT e
+STOP_MARKET a riposo vengono eseguiti quando il percorso li attraversa, MARKET
+e IOC subito. Latenza, jitter, errori e rate limit (429) si configurano nel
+blocco `simulator:` di config.yaml. Con `symbols:` in config ogni simbolo ha
+il suo percorso (seed + indice, prezzo iniziale da simulator.start_prices) e
+il suo book; conto, id ordine e seq dei fill sono condivisi come su Pionex.
+"""
+import json, time, math, random, asyncio, argparse
+from collections import deque
+from aiohttp import web
+import yaml
+from util import load_cfg
+from ratelimit import TokenBucket
+from datafeeds import instrument_of, default_instrument
+
+BAR_MS = 60_000
+VENUES = ("binance", "bybit", "okx")
+TICKER_KEY = web.AppKey("ticker", asyncio.Task)
+DEPTH_KEY = web.AppKey("depth", asyncio.Task)
+
+def _group(path):
+    """Profilo di latenza/errori per path: venue dei datafeed o pionex."""
+    if path.startswith("/fapi/"): return "binance"
+    if path.startswith("/v5/"): return "bybit"
+    if path.startswith("/api/v5/"): return "okx"
+    return "pionex"
+
+class PricePath:
+    """
+    Orologio simulato + barre 1m. L'ora simulata parte allineata al minuto
+    corrente e avanza di `speed` volte il tempo reale; le prime history_bars
+    barre stanno nel passato così le kline hanno subito uno storico.
+    """
+    def __init__(self, bars=None, start_price=150.0, vol_bps=8.0, speed=1.0, history_bars=1000, seed=42):
+        self.speed = float(speed)
+        self.vol_bps = float(vol_bps)
+        self.rng = random.Random(seed)
+        self.replay = bars is not None
+        self.bars = [tuple(b) for b in bars] if bars is not None else []
+        self.history_bars = int(history_bars)
+        now_ms = int(time.time() * 1000)
+        self.t_start = now_ms - now_ms % BAR_MS
+        self.t_origin = self.t_start - self.history_bars * BAR_MS
+        self._wall0 = time.monotonic()
+        if not self.replay:
+            self._last = float(start_price)
+            self._extend(self.history_bars + 1)
+
+    def _extend(self, n):
+        """Random walk: log-rendimenti gaussiani per barra, estremi con rumore intrabar."""
+        s = self.vol_bps / 1e4
+        for _ in range(n):
+            o = self._last
+            c = o * math.exp(self.rng.gauss(0.0, s))
+            h = max(o, c) * (1.0 + abs(self.rng.gauss(0.0, s / 2)))
+            l = min(o, c) * (1.0 - abs(self.rng.gauss(0.0, s / 2)))
+            self.bars.append((o, h, l, c, round(self.rng.uniform(100.0, 1000.0), 3)))
+            self._last = c
+
+    def now_ms(self):
+        return self.t_start + int((time.monotonic() - self._wall0) * 1000.0 * self.speed)
+
+    def bar(self, i):
+        """(o, h, l, c, v) della barra i (dall'origine)."""
+        if self.replay:
+            return self.bars[i % len(self.bars)]
+        if i >= len(self.bars):
+            self._extend(i - len(self.bars) + 1)
+        return self.bars[i]
+
+    @staticmethod
+    def _points(o, h, l, c):
+        return (o, l, h, c) if c >= o else (o, h, l, c)
+
+    def mid(self, t_ms=None):
+        t_ms = self.now_ms() if t_ms is None else t_ms
+        i, frac = divmod(t_ms - self.t_origin, BAR_MS)
+        pts = self._points(*self.bar(int(i))[:4])
+        x = frac / BAR_MS * 3.0
+        k = min(int(x), 2)
+        return pts[k] + (pts[k + 1] - pts[k]) * (x - k)
+
+    def _partial(self, i, t_ms):
+        """Barra i troncata a t_ms (barra in corso): h/l solo sui punti già percorsi."""
+        o, h, l, c, v = self.bar(i)
+        frac = (t_ms - self.t_origin - i * BAR_MS) / BAR_MS
+        pts = self._points(o, h, l, c)
+        seen = [p for j, p in enumerate(pts) if j / 3.0 <= frac] + [self.mid(t_ms)]
+        return (o, max(seen), min(seen), seen[-1], v * frac)
+
+    def klines(self, minutes=1, limit=200, start=None):
+        """Barre chiuse + barra in corso come (t, o, h, l, c, v), dalla più vecchia; start = t minimo incluso."""
+        now = self.now_ms()
+        cur = int((now - self.t_origin) // BAR_MS)
+        span = minutes * BAR_MS
+        t_last = (self.t_origin + cur * BAR_MS) // span * span
+        t_first = max(self.t_origin + (-self.t_origin) % span, t_last - (limit - 1) * span)
+        if start is not None:
+            t_first = max(t_first, int(start) + (-int(start)) % span)
+        out = []
+        t = t_first
+        while t <= t_last and len(out) < limit:
+            rows = []
+            for m in range(minutes):
+                i = (t - self.t_origin) // BAR_MS + m
+                if i > cur: break
+                rows.append(self._partial(i, now) if i == cur else self.bar(i))
+            out.append((t, rows[0][0], max(r[1] for r in rows), min(r[2] for r in rows), rows[-1][3], sum(r[4] for r in rows)))
+            t += span
+        return out
+
+class SimError(Exception):
+    def __init__(self, status, code, msg=""):
+        super().__init__(msg or code)
+        self.status, self.code = status, code
+
+class Exchange:
+    """Motore di matching di un solo simbolo: ordini, posizione netta, PnL, fill con seq."""
+    def __init__(self, symbol, tick=0.001, step=0.001, equity=10_000.0, fee_bps=5.0, slip_bps=2.0, max_fills=1000, ids=None):
+        """ids: contatori {"oid", "seq"} condivisi tra i simboli dello stesso conto."""
+        self.symbol = symbol
+        self.tick_size, self.step_size = float(tick), float(step)
+        self.equity0 = float(equity)
+        self.fee = float(fee_bps) / 1e4
+        self.slip = float(slip_bps) / 1e4
+        self.orders = {}
+        self.fills = deque(maxlen=int(max_fills))
+        self.pos = 0.0
+        self.entry = 0.0
+        self.realized = 0.0
+        self.fees = 0.0
+        self.ids = ids if ids is not None else {"oid": 100_000, "seq": 0}
+        self.last = None
+        self._listeners = []
+        self.stats = {"placed": 0, "cancelled": 0, "rejected": 0, "filled": 0}
+
+    def add_listener(self, fn):
+        """fn(fills) a ogni gruppo di fill nuovi (nel loop del server)."""
+        self._listeners.append(fn)
+
+    def _emit(self, fills):
+        for fn in self._listeners:
+            try: fn(fills)
+            except Exception: pass
+
+    def place(self, body, bid, ask):
+        side = str(body.get("side", "")).upper()
+        typ = str(body.get("type", "LIMIT")).upper()
+        tif = str(body.get("timeInForce", "GTC")).upper()
+        try:
+            qty = round(round(float(body.get("quantity", body.get("size"))) / self.step_size) * self.step_size, 12)
+        except (TypeError, ValueError):
+            qty = 0.0
+        if side not in ("BUY", "SELL") or qty <= 0 or typ not in ("LIMIT", "MARKET", "STOP_MARKET"):
+            self.stats["rejected"] += 1
+            raise SimError(400, "INVALID_PARAMETER", f"bad order {side} {typ} {qty}")
+        o = {"orderId": self.ids["oid"], "symbol": self.symbol, "side": side, "type": typ, "size": qty,
+             "filledSize": 0.0, "price": None, "stopPrice": None, "timeInForce": tif,
+             "reduceOnly": bool(body.get("reduceOnly", False)), "status": "OPEN", "createTime": int(time.time() * 1000)}
+        try:
+            if typ == "LIMIT": o["price"] = float(body["price"])
+            if typ == "STOP_MARKET": o["stopPrice"] = float(body["stopPrice"])
+        except (KeyError, TypeError, ValueError):
+            self.stats["rejected"] += 1
+            raise SimError(400, "INVALID_PARAMETER", "missing price/stopPrice")
+        self.ids["oid"] += 1
+        self.stats["placed"] += 1
+        fills = []
+        if typ == "MARKET":
+            self._fill(o, (ask if side == "BUY" else bid) * (1.0 + (self.slip if side == "BUY" else -self.slip)), "taker", fills)
+        elif typ == "LIMIT" and ((side == "BUY" and o["price"] >= ask) or (side == "SELL" and o["price"] <= bid)):
+            self._fill(o, ask if side == "BUY" else bid, "taker", fills)
+        elif tif == "IOC":
+            o["status"] = "CANCELED"
+        else:
+            self.orders[o["orderId"]] = o
+        if fills:
+            self._emit(fills)
+        return o
+
+    def cancel(self, oid):
+        try:
+            o = self.orders.pop(int(oid))
+        except (KeyError, TypeError, ValueError):
+            raise SimError(400, "ORDER_NOT_FOUND", f"order {oid} not found")
+        o["status"] = "CANCELED"
+        self.stats["cancelled"] += 1
+        return o
+
+    def cancel_all(self):
+        n = len(self.orders)
+        self.orders.clear()
+        self.stats["cancelled"] += n
+        return n
+
+    def _fill(self, o, price, role, fills):
+        qty = o["size"]
+        if o["reduceOnly"]:
+            # reduceOnly: mai oltre la posizione aperta nel verso opposto
+            reducible = self.pos if o["side"] == "SELL" else -self.pos
+            qty = min(qty, max(0.0, round(reducible, 12)))
+            if qty <= 0:
+                o["status"] = "CANCELED"
+                return
+        price = round(round(price / self.tick_size) * self.tick_size, 10)
+        d = qty if o["side"] == "BUY" else -qty
+        if self.pos == 0 or (self.pos > 0) == (d > 0):
+            self.entry = (self.entry * abs(self.pos) + price * qty) / (abs(self.pos) + qty)
+        else:
+            closed = min(qty, abs(self.pos))
+            self.realized += closed * (price - self.entry) * (1.0 if self.pos > 0 else -1.0)
+            if qty > abs(self.pos):
+                self.entry = price
+        self.pos = round(self.pos + d, 12)
+        if self.pos == 0:
+            self.entry = 0.0
+        fee = price * qty * self.fee
+        self.fees += fee
+        self.ids["seq"] += 1
+        seq = self.ids["seq"]
+        o["filledSize"] = qty
+        o["status"] = "FILLED"
+        f = {"id": f"sim-{seq}", "seq": seq, "orderId": o["orderId"], "symbol": self.symbol,
+             "side": o["side"], "price": price, "size": qty, "fee": round(fee, 8), "role": role,
+             "timestamp": int(time.time() * 1000)}
+        self.fills.append(f)
+        self.stats["filled"] += 1
+        fills.append(f)
+
+    def step(self, price):
+        """Esegue gli ordini a riposo attraversati dal percorso tra l'ultimo prezzo e `price`."""
+        prev, self.last = (self.last if self.last is not None else price), price
+        lo, hi = min(prev, price), max(prev, price)
+        fills = []
+        for oid, o in sorted(self.orders.items()):
+            buy = o["side"] == "BUY"
+            if o["type"] == "LIMIT" and ((buy and lo <= o["price"]) or (not buy and hi >= o["price"])):
+                self._fill(o, o["price"], "maker", fills)
+            elif o["type"] == "STOP_MARKET" and ((buy and hi >= o["stopPrice"]) or (not buy and lo <= o["stopPrice"])):
+                self._fill(o, o["stopPrice"] * (1.0 + (self.slip if buy else -self.slip)), "taker", fills)
+            else:
+                continue
+            del self.orders[oid]
+        if fills:
+            self._emit(fills)
+        return fills
+
+    def position(self):
+        upl = self.pos * ((self.last or self.entry) - self.entry) if self.pos else 0.0
+        return {"symbol": self.symbol, "size": self.pos, "entryPrice": self.entry,
+                "unrealizedPnl": round(upl, 6), "realizedPnl": round(self.realized, 6), "fees": round(self.fees, 6)}
+
+    def account(self, others=()):
+        """Conto unico: equity0 + PnL di questo simbolo e di `others`."""
+        pos = [self.position()] + [x.position() for x in others]
+        bal = self.equity0 + sum(p["realizedPnl"] - p["fees"] for p in pos)
+        eq = bal + sum(p["unrealizedPnl"] for p in pos)
+        return {"equityUSDT": round(eq, 6), "balances": [{"asset": "USDT", "equity": round(eq, 6), "balance": round(bal, 6)}],
+                "position": pos[0], "positions": pos}
+
+class DepthSim:
+    """
+    Book L2 sintetico di una venue attorno a bid/ask: `levels` livelli per
+    lato a passo tick, con size che a ogni passo cambiano solo su una quota
+    `churn` dei livelli, così i diff restano piccoli come quelli veri. I
+    livelli sono indicizzati in tick interi (niente chiavi float).
+    """
+    def __init__(self, levels=50, tick=0.01, base_qty=20.0, churn=0.1, rng=None):
+        self.levels = int(levels)
+        self.tick = float(tick)
+        self.base_qty = float(base_qty)
+        self.churn = float(churn)
+        self.rng = rng or random.Random(0)
+        self.dec = max(0, -int(math.floor(math.log10(self.tick))))
+        self.u = 1000
+        self.bids, self.asks = {}, {}
+
+    def _side(self, book, start, step):
+        new = {}
+        for i in range(self.levels):
+            t = start + step * i
+            q = book.get(t)
+            if q is None or self.rng.random() < self.churn:
+                q = round(self.base_qty * (1.0 + 0.1 * i) * self.rng.uniform(0.3, 1.7), 3)
+            new[t] = q
+        diff = [(t, 0.0) for t in book if t not in new] + [(t, q) for t, q in new.items() if book.get(t) != q]
+        return new, diff
+
+    def _fmt(self, levels):
+        return [[f"{t * self.tick:.{self.dec}f}", f"{q:g}"] for t, q in levels]
+
+    def step(self, bid, ask):
+        """Nuovo stato attorno a bid/ask: (u precedente, u, diff bid, diff ask) con prezzi e size in stringa."""
+        tb = math.floor(bid / self.tick)
+        ta = max(math.ceil(ask / self.tick), tb + 1)
+        self.bids, db = self._side(self.bids, tb, -1)
+        self.asks, da = self._side(self.asks, ta, 1)
+        prev = self.u
+        self.u += 1
+        return prev, self.u, self._fmt(db), self._fmt(da)
+
+    def snapshot(self, limit=None):
+        """(u, bids, asks) dal livello migliore."""
+        return (self.u, self._fmt(sorted(self.bids.items(), reverse=True)[:limit]),
+                self._fmt(sorted(self.asks.items())[:limit]))
+
+class Faults:
+    """Latenza + jitter, errori 5xx casuali e rate limit a token bucket per path (429)."""
+    def __init__(self, profiles=None, rate_limit=None, seed=42):
+        profiles = dict(profiles or {})
+        self._default = {"latency_ms": 0.0, "jitter_ms": 0.0, "error_rate": 0.0}
+        self._default.update(profiles.pop("default", None) or {})
+        self._profiles = {g: {**self._default, **(p or {})} for g, p in profiles.items()}
+        rl = dict(rate_limit or {})
+        self._rl_default = rl.pop("default", None)
+        self._rl_cfg = rl
+        self._buckets = {}
+        self.rng = random.Random(seed)
+        self.stats = {"requests": 0, "rate_limited": 0, "errors": 0}
+
+    def profile(self, group):
+        return self._profiles.get(group, self._default)
+
+    def delay_s(self, group):
+        p = self.profile(group)
+        return max(0.0, float(p["latency_ms"]) + self.rng.uniform(0.0, float(p["jitter_ms"]))) / 1000.0
+
+    def allow(self, path):
+        cfg = self._rl_cfg.get(path, self._rl_default)
+        if not cfg:
+            return True
+        b = self._buckets.get(path)
+        if b is None:
+            b = self._buckets[path] = TokenBucket(**cfg)
+        now = time.monotonic()
+        if b.wait_time(now) > 0.0:
+            return False
+        b.take(now)
+        return True
+
+    def fail(self, group):
+        return self.rng.random() < float(self.profile(group)["error_rate"])
+
+class Simulator:
+    def __init__(self, cfg, bars=None):
+        s = cfg.get("simulator", {}) or {}
+        p = cfg["pionex"]
+        self.cfg = cfg
+        self.paths = {"market_info": "/api/v1/marketInfo", "balance": "/api/v1/account", "open_orders": "/api/v1/orders/open",
+                      "place_order": "/api/v1/order", "cancel_all": "/api/v1/orders/cancelAll",
+                      "cancel_order": "/api/v1/order/cancel", "fills": "/api/v1/fills"}
+        self.paths.update(p.get("endpoints") or {})
+        insts = [instrument_of(e) for e in cfg.get("symbols") or []]
+        if not insts:
+            insts = [{**default_instrument(), "pionex": p["symbol"]}]
+        ids = {"oid": 100_000, "seq": 0}
+        seed = int(s.get("seed", 42))
+        starts = s.get("start_prices") or {}
+        # per simbolo: (strumento, percorso, book); il primo è anche self.path / self.ex
+        self.markets = {}
+        for n, inst in enumerate(insts):
+            path = PricePath(bars if n == 0 else None, start_price=starts.get(inst["pionex"], s.get("start_price", 150.0)),
+                             vol_bps=s.get("vol_bps", 8.0), speed=s.get("speed", 1.0),
+                             history_bars=s.get("history_bars", 1000), seed=seed + n)
+            ex = Exchange(inst["pionex"], tick=inst.get("tick_size") or p.get("tick_size") or 0.001,
+                          step=inst.get("step_size") or p.get("step_size") or 0.001, equity=s.get("equity_usdt", 10_000.0),
+                          fee_bps=s.get("fee_bps", 5.0), slip_bps=s.get("slip_bps", 2.0), ids=ids)
+            self.markets[inst["pionex"]] = (inst, path, ex)
+        self._by_venue = {v: {i[v]: sym for sym, (i, _, _) in self.markets.items()} for v in VENUES}
+        _, self.path, self.ex = next(iter(self.markets.values()))
+        self.ids = ids
+        self.faults = Faults(s.get("faults"), s.get("rate_limit"), seed=s.get("seed", 42))
+        self.spread = float(s.get("spread_bps", 2.0)) / 1e4
+        self.venue_noise = float(s.get("venue_noise_bps", 1.5)) / 1e4
+        self.tick_s = float(s.get("tick_ms", 100)) / 1000.0
+        self.quote_interval_s = float(s.get("quote_interval_ms", 250)) / 1000.0
+        self.ws_drop_rate = float(s.get("ws_drop_rate", 0.0))
+        self.rng = random.Random(s.get("seed", 42))
+        self._fill_clients = set()
+        d = s.get("depth") or {}
+        self.depth_interval_s = float(d.get("interval_ms", 100)) / 1000.0
+        qty = d.get("base_qty") or {}
+        self.depth = {(v, sym): DepthSim(levels=d.get("levels", 50), tick=d.get("tick", 0.01),
+                                         base_qty=qty.get(v, 20.0) if isinstance(qty, dict) else qty,
+                                         churn=d.get("churn", 0.1), rng=random.Random(seed + 100 * (k + 1) + j))
+                      for k, v in enumerate(VENUES) for j, sym in enumerate(self.markets)}
+        # per venue: coda del client WS depth -> simboli iscritti (None = tutti)
+        self._depth_clients = {v: {} for v in VENUES}
+        for _, _, ex in self.markets.values():
+            ex.add_listener(self._broadcast_fills)
+
+    # --- prezzi ---
+
+    def market(self, symbol=None, venue="pionex"):
+        """(strumento, percorso, book) per simbolo della venue; None/mancante = primo simbolo (404 se sconosciuto)."""
+        if not symbol:
+            return self.markets[self.ex.symbol]
+        sym = symbol if venue == "pionex" else self._by_venue[venue].get(symbol)
+        if sym not in self.markets:
+            raise SimError(404, "SYMBOL_NOT_FOUND", f"unknown symbol {symbol}")
+        return self.markets[sym]
+
+    def book(self, venue=None, path=None):
+        """(bid, ask) della venue: mid del percorso + rumore per venue, spread fisso."""
+        m = (path or self.path).mid()
+        if venue is not None and self.venue_noise > 0:
+            m *= 1.0 + self.rng.gauss(0.0, self.venue_noise)
+        return m * (1.0 - self.spread / 2), m * (1.0 + self.spread / 2)
+
+    async def _ticker(self):
+        while True:
+            for _, path, ex in self.markets.values():
+                try: ex.step(path.mid())
+                except Exception: pass
+            await asyncio.sleep(self.tick_s)
+
+    async def _depth_ticker(self):
+        """Un passo dei book L2 di ogni venue e simbolo; i diff vanno ai client WS depth iscritti."""
+        while True:
+            for (venue, sym), ds in self.depth.items():
+                inst, path, _ = self.markets[sym]
+                prev, u, db, da = ds.step(*self.book(venue, path))
+                if not self._depth_clients[venue]:
+                    continue
+                msg = json.dumps(self._depth_msg(venue, inst[venue], prev, u, db, da, path.now_ms()))
+                for q, subs in list(self._depth_clients[venue].items()):
+                    if subs is not None and inst[venue] not in subs:
+                        continue
+                    if self.rng.random() < self.ws_drop_rate:
+                        continue
+                    try: q.put_nowait(msg)
+                    except asyncio.QueueFull: pass
+            await asyncio.sleep(self.depth_interval_s)
+
+    # --- middleware: latenza, rate limit, errori ---
+
+    @web.middleware
+    async def _inject(self, request, handler):
+        if request.path.startswith("/ws/") or request.path.startswith("/sim/"):
+            return await handler(request)
+        f, group = self.faults, _group(request.path)
+        f.stats["requests"] += 1
+        await asyncio.sleep(f.delay_s(group))
+        if not f.allow(request.path):
+            f.stats["rate_limited"] += 1
+            return web.json_response({"result": False, "code": "TOO_MANY_REQUESTS", "message": "rate limited"}, status=429)
+        if f.fail(group):
+            f.stats["errors"] += 1
+            return web.json_response({"result": False, "code": "INTERNAL_ERROR", "message": "injected"}, status=503)
+        try:
+            return await handler(request)
+        except SimError as e:
+            return web.json_response({"result": False, "code": e.code, "message": str(e)}, status=e.status)
+
+    # --- Pionex REST ---
+
+    async def _body(self, request):
+        try:
+            b = await request.json()
+            return b if isinstance(b, dict) else {}
+        except Exception:
+            return {}
+
+    def _ex(self, request, body=None):
+        return self.market((body or {}).get("symbol") or request.query.get("symbol"))[2]
+
+    async def market_info(self, request):
+        ex = self._ex(request)
+        return web.json_response({"symbol": ex.symbol, "tickSize": ex.tick_size, "stepSize": ex.step_size})
+
+    def account(self):
+        exs = [ex for _, _, ex in self.markets.values()]
+        return exs[0].account(exs[1:])
+
+    async def balance(self, request):
+        return web.json_response(self.account())
+
+    async def open_orders(self, request):
+        return web.json_response({"orders": list(self._ex(request).orders.values())})
+
+    async def place_order(self, request):
+        body = await self._body(request)
+        _, path, ex = self.market(body.get("symbol"))
+        bid, ask = self.book(path=path)
+        o = ex.place(body, bid, ask)
+        return web.json_response({"result": True, "data": {"orderId": o["orderId"], "status": o["status"]}})
+
+    async def cancel_order(self, request):
+        body = await self._body(request)
+        o = self._ex(request, body).cancel(body.get("orderId"))
+        return web.json_response({"result": True, "data": {"orderId": o["orderId"]}})
+
+    async def cancel_all(self, request):
+        return web.json_response({"result": True, "data": {"cancelled": self._ex(request, await self._body(request)).cancel_all()}})
+
+    async def fills(self, request):
+        try: limit = max(1, int(request.query.get("limit", 50)))
+        except ValueError: limit = 50
+        return web.json_response({"fills": list(self._ex(request).fills)[-limit:]})
+
+    # --- WS fill ---
+
+    def _broadcast_fills(self, fills):
+        msg = json.dumps({"seq": fills[-1]["seq"], "fills": fills})
+        for q in self._fill_clients:
+            q.put_nowait(msg)
+
+    async def ws_fills(self, request):
+        ws = web.WebSocketResponse(heartbeat=20)
+        await ws.prepare(request)
+        q = asyncio.Queue()
+        self._fill_clients.add(q)
+
+        async def _drain():
+            async for _ in ws:
+                pass
+
+        # senza fill in coda la chiusura del client si vede solo leggendo dal socket
+        reader = asyncio.create_task(_drain())
+        try:
+            while not ws.closed:
+                get = asyncio.ensure_future(q.get())
+                await asyncio.wait((get, reader), return_when=asyncio.FIRST_COMPLETED)
+                if not get.done():
+                    get.cancel()
+                    break
+                msg = get.result()
+                await asyncio.sleep(self.faults.delay_s("pionex"))
+                if self.rng.random() < self.ws_drop_rate:
+                    continue
+                await ws.send_str(msg)
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            reader.cancel()
+            self._fill_clients.discard(q)
+        return ws
+
+    # --- datafeed REST ---
+
+    @staticmethod
+    def _limit(request, default, cap):
+        try: return max(1, min(cap, int(request.query.get("limit", default))))
+        except ValueError: return default
+
+    def _tickers(self, request, venue, key):
+        """[(simbolo della venue, bid, ask, percorso)]: il simbolo richiesto o, senza, tutti (endpoint batch)."""
+        sym = request.query.get(key)
+        ms = [self.market(sym, venue)] if sym else list(self.markets.values())
+        return [(inst[venue], *self.book(venue, path), path) for inst, path, _ in ms]
+
+    async def binance_ticker(self, request):
+        rows = [{"symbol": s, "bidPrice": f"{b:.4f}", "bidQty": "10", "askPrice": f"{a:.4f}", "askQty": "10", "time": path.now_ms()}
+                for s, b, a, path in self._tickers(request, "binance", "symbol")]
+        return web.json_response(rows[0] if request.query.get("symbol") else rows)
+
+    async def binance_klines(self, request):
+        m = 5 if request.query.get("interval") == "5m" else 1
+        path = self.market(request.query.get("symbol"), "binance")[1]
+        rows = path.klines(m, self._limit(request, 500, 1500), request.query.get("startTime"))
+        return web.json_response([[t, str(o), str(h), str(l), str(c), str(v), t + m * BAR_MS - 1] for t, o, h, l, c, v in rows])
+
+    async def binance_depth(self, request):
+        inst, path, _ = self.market(request.query.get("symbol"), "binance")
+        u, bids, asks = self.depth[("binance", inst["pionex"])].snapshot(self._limit(request, 500, 1000))
+        now = path.now_ms()
+        return web.json_response({"lastUpdateId": u, "E": now, "T": now, "bids": bids, "asks": asks})
+
+    async def bybit_ticker(self, request):
+        return web.json_response({"retCode": 0, "result": {"category": "linear", "list": [
+            {"symbol": s, "bid1Price": f"{b:.4f}", "ask1Price": f"{a:.4f}", "lastPrice": f"{(a + b) / 2:.4f}"}
+            for s, b, a, _ in self._tickers(request, "bybit", "symbol")]}})
+
+    async def bybit_klines(self, request):
+        m = 5 if request.query.get("interval") == "5" else 1
+        inst, path, _ = self.market(request.query.get("symbol"), "bybit")
+        rows = path.klines(m, self._limit(request, 200, 1000), request.query.get("start"))
+        return web.json_response({"retCode": 0, "result": {"symbol": inst["bybit"], "list": [
+            [str(t), str(o), str(h), str(l), str(c), str(v), "0"] for t, o, h, l, c, v in reversed(rows)]}})
+
+    async def okx_ticker(self, request):
+        return web.json_response({"code": "0", "data": [{"instId": s, "bidPx": f"{b:.4f}", "askPx": f"{a:.4f}",
+                                                         "last": f"{(a + b) / 2:.4f}", "ts": str(path.now_ms())}
+                                                        for s, b, a, path in self._tickers(request, "okx", "instId")]})
+
+    async def okx_klines(self, request):
+        m = 5 if request.query.get("bar") == "5m" else 1
+        before = request.query.get("before")
+        path = self.market(request.query.get("instId"), "okx")[1]
+        rows = path.klines(m, self._limit(request, 100, 300), int(before) + 1 if before is not None else None)
+        return web.json_response({"code": "0", "data": [
+            [str(t), str(o), str(h), str(l), str(c), str(v), "0", "0", "1"] for t, o, h, l, c, v in reversed(rows)]})
+
+    # --- stream top-of-book ---
+
+    def _quote_msg(self, venue, inst=None, path=None):
+        inst, path = inst or self.markets[self.ex.symbol][0], path or self.path
+        b, a = self.book(venue, path)
+        now = path.now_ms()
+        sym = inst[venue]
+        if venue == "binance":
+            return {"e": "bookTicker", "s": sym, "b": f"{b:.4f}", "B": "10", "a": f"{a:.4f}", "A": "10", "T": now}
+        if venue == "bybit":
+            return {"topic": f"orderbook.1.{sym}", "type": "snapshot", "ts": now,
+                    "data": {"s": sym, "b": [[f"{b:.4f}", "10"]], "a": [[f"{a:.4f}", "10"]]}}
+        return {"arg": {"channel": "bbo-tbt", "instId": sym},
+                "data": [{"bids": [[f"{b:.4f}", "10", "0", "1"]], "asks": [[f"{a:.4f}", "10", "0", "1"]], "ts": str(now)}]}
+
+    async def ws_quotes(self, request):
+        venue = request.match_info["venue"]
+        if venue not in VENUES:
+            raise web.HTTPNotFound()
+        if request.match_info.get("stream") == "depth":
+            return await self._ws_depth(request, venue)
+        ws = web.WebSocketResponse(heartbeat=20)
+        await ws.prepare(request)
+
+        async def _acks():
+            # risponde alle subscribe di Bybit/OKX, il resto si ignora
+            async for msg in ws:
+                try: sub = json.loads(msg.data)
+                except Exception: continue
+                if isinstance(sub, dict) and sub.get("op") == "subscribe":
+                    if venue == "bybit":
+                        await ws.send_str(json.dumps({"success": True, "op": "subscribe"}))
+                    else:
+                        for arg in sub.get("args") or [None]:
+                            await ws.send_str(json.dumps({"event": "subscribe", "arg": arg}))
+
+        reader = asyncio.create_task(_acks())
+        try:
+            while not ws.closed:
+                for inst, path, _ in self.markets.values():
+                    await ws.send_str(json.dumps(self._quote_msg(venue, inst, path)))
+                await asyncio.sleep(self.quote_interval_s)
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            reader.cancel()
+        return ws
+
+    # --- stream L2 (snapshot + diff) ---
+
+    def _depth_msg(self, venue, sym, prev, u, bids, asks, now, snapshot=False):
+        if venue == "binance":
+            return {"e": "depthUpdate", "E": now, "T": now, "s": sym, "U": prev + 1, "u": u, "pu": prev, "b": bids, "a": asks}
+        if venue == "bybit":
+            return {"topic": f"orderbook.50.{sym}", "type": "snapshot" if snapshot else "delta", "ts": now,
+                    "data": {"s": sym, "b": bids, "a": asks, "u": u, "seq": u}}
+        return {"arg": {"channel": "books", "instId": sym}, "action": "snapshot" if snapshot else "update",
+                "data": [{"bids": [[p, q, "0", "1"] for p, q in bids], "asks": [[p, q, "0", "1"] for p, q in asks],
+                          "ts": str(now), "checksum": 0, "seqId": u, "prevSeqId": -1 if snapshot else prev}]}
+
+    async def _ws_depth(self, request, venue):
+        """
+        Binance: diff di tutti i simboli (snapshot da /fapi/v1/depth). Bybit/OKX:
+        a ogni subscribe lo snapshot del simbolo, poi i suoi diff in coda allo
+        stesso canale, così l'ordine snapshot -> diff è quello del server.
+        """
+        ws = web.WebSocketResponse(heartbeat=20)
+        await ws.prepare(request)
+        q = asyncio.Queue(maxsize=10_000)
+        subs = self._depth_clients[venue][q] = None if venue == "binance" else set()
+
+        async def _subs():
+            async for msg in ws:
+                try: sub = json.loads(msg.data)
+                except Exception: continue
+                if not isinstance(sub, dict) or sub.get("op") not in ("subscribe", "unsubscribe") or subs is None:
+                    continue
+                for arg in sub.get("args") or []:
+                    sym = arg.rsplit(".", 1)[-1] if venue == "bybit" else (arg or {}).get("instId")
+                    if sub["op"] == "unsubscribe":
+                        subs.discard(sym)
+                        continue
+                    try: inst, path, _ = self.market(sym, venue)
+                    except SimError: continue
+                    subs.add(sym)
+                    u, bids, asks = self.depth[(venue, inst["pionex"])].snapshot()
+                    q.put_nowait(json.dumps(self._depth_msg(venue, sym, None, u, bids, asks, path.now_ms(), snapshot=True)))
+
+        reader = asyncio.create_task(_subs())
+        try:
+            while not ws.closed:
+                await ws.send_str(await q.get())
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            reader.cancel()
+            self._depth_clients[venue].pop(q, None)
+        return ws
+
+    async def sim_stats(self, request):
+        return web.json_response({"now_ms": self.path.now_ms(), "mid": self.path.mid(), "faults": self.faults.stats,
+                                  "exchange": self.ex.stats, "open_orders": len(self.ex.orders), "fills": self.ids["seq"],
+                                  "account": self.account(), "ws_fill_clients": len(self._fill_clients),
+                                  "symbols": {sym: {"mid": path.mid(), "exchange": ex.stats, "open_orders": len(ex.orders)}
+                                              for sym, (_, path, ex) in self.markets.items()}})
+
+    def app(self):
+        app = web.Application(middlewares=[self._inject])
+        p = self.paths
+        app.add_routes([
+            web.get(p["market_info"], self.market_info),
+            web.get(p["balance"], self.balance),
+            web.get(p["open_orders"], self.open_orders),
+            web.post(p["place_order"], self.place_order),
+            web.post(p["cancel_all"], self.cancel_all),
+            web.post(p["cancel_order"], self.cancel_order),
+            web.get(p["fills"], self.fills),
+            web.get("/fapi/v1/ticker/bookTicker", self.binance_ticker),
+            web.get("/fapi/v1/klines", self.binance_klines),
+            web.get("/fapi/v1/depth", self.binance_depth),
+            web.get("/v5/market/tickers", self.bybit_ticker),
+            web.get("/v5/market/kline", self.bybit_klines),
+            web.get("/api/v5/market/ticker", self.okx_ticker),
+            web.get("/api/v5/market/tickers", self.okx_ticker),
+            web.get("/api/v5/market/candles", self.okx_klines),
+            web.get("/ws/fills", self.ws_fills),
+            web.get("/ws/{venue}", self.ws_quotes),
+            web.get("/ws/{venue}/{stream}", self.ws_quotes),
+            web.get("/sim/stats", self.sim_stats),
+        ])
+
+        async def _start(app):
+            app[TICKER_KEY] = asyncio.create_task(self._ticker())
+            app[DEPTH_KEY] = asyncio.create_task(self._depth_ticker())
+
+        async def _stop(app):
+            app[TICKER_KEY].cancel()
+            app[DEPTH_KEY].cancel()
+
+        app.on_startup.append(_start)
+        app.on_cleanup.append(_stop)
+        return app
+
+def serve_in_thread(sim, host="127.0.0.1", port=0):
+    """Avvia il simulatore in un thread con il suo event loop (port=0: porta libera). Ritorna (port, stop)."""
+    import threading
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(sim.app())
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, host, port)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    t = threading.Thread(target=loop.run_forever, name="simulator", daemon=True)
+    t.start()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+        t.join(5)
+    return port, stop
+
+def sim_config(cfg, host, port):
+    """Copia di cfg con Pionex, WS dei fill e datafeed puntati al simulatore."""
+    http, ws = f"http://{host}:{port}", f"ws://{host}:{port}/ws"
+    out = json.loads(json.dumps(cfg))
+    out["pionex"]["base_url"] = http
+    out.setdefault("websocket", {})["url"] = f"{ws}/fills"
+    df = out.setdefault("datafeed", {})
+    df["base_urls"] = {v: http for v in VENUES}
+    df.setdefault("stream", {})["urls"] = {v: f"{ws}/{v}" for v in VENUES}
+    df.setdefault("depth", {})["urls"] = {v: f"{ws}/{v}/depth" for v in VENUES}
+    return out
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Simulatore locale Pionex + datafeed")
+    ap.add_argument("--config", default="config.yaml")
+    ap.add_argument("--csv", default=None, help="barre 1m t,o,h,l,c,v da ripetere (default: random walk)")
+    ap.add_argument("--host", default=None)
+    ap.add_argument("--port", type=int, default=None)
+    ap.add_argument("--speed", type=float, default=None)
+    ap.add_argument("--write-config", default=None, help="scrive qui una copia della config puntata al simulatore")
+    args = ap.parse_args(argv)
+    cfg = load_cfg(args.config)
+    s = cfg.setdefault("simulator", {}) or {}
+    cfg["simulator"] = s
+    if args.speed is not None: s["speed"] = args.speed
+    host = args.host or s.get("host", "127.0.0.1")
+    port = args.port or int(s.get("port", 8765))
+    csv = args.csv or s.get("csv")
+    bars = None
+    if csv:
+        from backtest import load_csv
+        b = load_csv(csv)
+        bars = list(zip(b["o"].tolist(), b["h"].tolist(), b["l"].tolist(), b["c"].tolist(), b["v"].tolist()))
+    if args.write_config:
+        with open(args.write_config, "w") as f:
+            yaml.safe_dump(sim_config(cfg, host, port), f, sort_keys=False)
+    sim = Simulator(cfg, bars)
+    print(f"simulator on http://{host}:{port} ({'replay ' + csv if csv else 'random walk'}, speed x{sim.path.speed})", flush=True)
+    web.run_app(sim.app(), host=host, port=port, print=None)
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ from util import load_cfg
 from pionex_api import Pionex
 
 def main():
-    cfg = load_cfg("config.yaml")
+    cfg = load_cfg()
     pnx = Pionex(os.getenv("PIONEX_API_KEY"), os.getenv("PIONEX_API_SECRET"), cfg)
     sym = cfg["pionex"]["symbol"]
     mi = pnx.market_info()
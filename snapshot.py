@@ -0,0 +1,30 @@
+import json, time
+from persist import write_json
+
+SNAPSHOT_VERSION = 1
+
+def save_snapshot(path, state, symbol=None, writer=None):
+    """Scrive lo snapshot in modo atomico (tmp + rename)."""
+    payload = {"v": SNAPSHOT_VERSION, "ts": time.time(), "symbol": symbol, "state": state}
+    write_json(path, payload, writer)
+
+def load_snapshot(path, max_age_s, symbol=None):
+    """
+    Ritorna (state, age_s) oppure (None, motivo) se lo snapshot manca, è di
+    un'altra versione o simbolo, o è più vecchio di max_age_s.
+    """
+    try:
+        with open(path, "r") as f:
+            payload = json.load(f)
+    except FileNotFoundError:
+        return None, "missing"
+    except Exception:
+        return None, "unreadable"
+    if payload.get("v") != SNAPSHOT_VERSION:
+        return None, f"version {payload.get('v')}"
+    if symbol is not None and payload.get("symbol") != symbol:
+        return None, f"symbol {payload.get('symbol')}"
+    age = time.time() - float(payload.get("ts", 0))
+    if age > max_age_s:
+        return None, f"stale {age:.0f}s"
+    return payload.get("state") or {}, age
@@ -0,0 +1,56 @@
+class DynamicStops:
+    """
+    SL/TP dei bracket breakout dal blocco dynamic_sl: distanza dello stop come
+    media pesata (box_sl_share) tra distanza ATR (atr * atr_mult) e distanza
+    dal lato opposto del box (con sl_buffer_pct); senza ATR né box resta lo
+    stop fisso a sl_buffer_pct dal riferimento. TP = distanza * tp_rr.
+    Il trailing sposta solo a favore lo SL delle posizioni aperte a
+    trail_mult * ATR dal mid, a passi di almeno trail_step_atr * ATR, e solo
+    quando quel livello ha superato il prezzo d'ingresso: fino ad allora resta
+    lo stop iniziale, anche se più largo di trail_mult * ATR.
+    """
+    def __init__(self, cfg):
+        d = cfg.get("dynamic_sl", {}) or {}
+        tr = cfg.get("trading", {}) or {}
+        self.use_atr = bool(d.get("use_atr", True))
+        self.atr_len = int(d.get("atr_len", 14))
+        self.atr_mult = float(d.get("atr_mult", 1.2))
+        self.use_box = bool(d.get("use_box", True))
+        self.box_share = min(1.0, max(0.0, float(d.get("box_sl_share", 0.5))))
+        self.trail = bool(d.get("trail", True))
+        self.trail_mult = float(d.get("trail_mult", 2.0))
+        self.trail_step = float(d.get("trail_step_atr", 0.25))
+        self.sl_buf = float(tr.get("sl_buffer_pct", 0.35)) / 100.0
+        self.rr = float(tr.get("tp_rr", 1.5))
+
+    def distance(self, side, ref, atr=None, box_top=None, box_bot=None):
+        """Distanza dello stop da ref; side "BUY"/"SELL"."""
+        d_atr = atr * self.atr_mult if self.use_atr and atr else None
+        d_box = None
+        if self.use_box and box_top and box_bot:
+            d_box = ref - box_bot * (1.0 - self.sl_buf) if side == "BUY" else box_top * (1.0 + self.sl_buf) - ref
+            if d_box <= 0:
+                d_box = None
+        if d_atr is not None and d_box is not None:
+            return self.box_share * d_box + (1.0 - self.box_share) * d_atr
+        if d_atr is not None or d_box is not None:
+            return d_atr if d_atr is not None else d_box
+        return ref * self.sl_buf
+
+    def levels(self, side, ref, atr=None, box_top=None, box_bot=None):
+        """(sl, tp) per un ingresso a ref."""
+        d = self.distance(side, ref, atr, box_top, box_bot)
+        if side == "BUY":
+            return ref - d, ref + d * self.rr
+        return ref + d, ref - d * self.rr
+
+    def trail_stop(self, side, entry, sl, mid, atr):
+        """Nuovo SL per una posizione aperta a entry, o None se non va spostato."""
+        if not self.trail or not atr or mid is None or entry is None:
+            return None
+        d, step = atr * self.trail_mult, atr * self.trail_step
+        if side == "BUY":
+            new = mid - d
+            return new if new > entry and (sl is None or new >= sl + step) else None
+        new = mid + d
+        return new if new < entry and (sl is None or new <= sl - step) else None
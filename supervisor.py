@@ -0,0 +1,289 @@
+# supervisor.py — spaces only, LF
+"""
+Supervisor multi-processo: divide cfg["symbols"] tra più worker (un processo
+per core, ciascuno un MultiEngine sui suoi simboli) e fa l'ingest delle quote
+una volta sola, pubblicandole ai worker su un ring in memoria condivisa
+(quotering.QuoteRing, record bid/ask/mid/ts a layout fisso).
+
+  python supervisor.py [--config config.yaml] [--workers 4]
+
+Con datafeed.stream.enabled le quote arrivano dagli stream delle venue
+(una connessione per venue per tutti i simboli), altrimenti da un poll REST
+in batch ogni supervisor.rest_poll_s. I worker scrivono in symbols/<SIMBOLO>/;
+il supervisor controlla processi e heartbeat, riavvia i worker caduti o
+bloccati con backoff esponenziale e scrive state.json alla radice: campi del
+primo simbolo (per la dashboard) + riepilogo di tutti i simboli e dei worker.
+Il rate limit Pionex di config viene diviso tra i worker.
+"""
+import os, sys, copy, json, time, signal, asyncio, argparse
+import multiprocessing as mp
+from util import load_cfg
+from datafeeds import MarketData, batch_mids, instrument_of, set_base_urls
+from ws_quotes import QuoteStream, VENUES
+from quotering import QuoteRing, RingQuoteStream
+from persist import write_json
+
+_STATUS_RANK = {"OK": 0, "WARN": 1, "PANIC": 2, "SUSPEND": 3}
+
+def split_rate_limit(rl, n):
+    """Divide rate e burst di ogni bucket di pionex.rate_limit tra n processi."""
+    rl = copy.deepcopy(rl or {})
+    def _div(b):
+        if isinstance(b, dict) and "rate" in b:
+            b["rate"] = float(b["rate"]) / n
+            b["burst"] = max(1.0, float(b.get("burst", b["rate"] * n)) / n)
+    _div(rl.get("global"))
+    for b in (rl.get("buckets") or {}).values():
+        _div(b)
+    return rl
+
+def shard(entries, n):
+    """Simboli assegnati ai worker a turno (round-robin, nell'ordine di config)."""
+    return [entries[i::n] for i in range(n)]
+
+class _Ingest(QuoteStream):
+    """QuoteStream del supervisor: ogni quote aggiornata finisce anche nel ring."""
+    def __init__(self, ring, index, **kw):
+        super().__init__(**kw)
+        self.ring = ring
+        self.index = index
+
+    def _on_quote(self, venue, bid, ask, key=None, ts=None):
+        super()._on_quote(venue, bid, ask, key=key, ts=ts)
+        key = key or self.default_key
+        with self._lock:
+            b, a, t = self._book[(venue, key)]
+        if b is not None and a is not None:
+            self.ring.publish(self.index[key], VENUES.index(venue), b, a, t)
+
+def _worker(cfg, wid, ring_name, symbols, hb, poll_s):
+    """Processo worker: MultiEngine sui simboli di cfg["symbols"], quote dal ring."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from main import MultiEngine
+    max_age_s = (cfg.get("datafeed", {}).get("stream", {}) or {}).get("max_age_s", 5.0)
+    eng = MultiEngine(cfg, quotes=lambda insts: RingQuoteStream(ring_name, symbols, insts, max_age_s=max_age_s, poll_s=poll_s),
+                      root=False)
+
+    ppid = os.getppid()
+
+    async def _beat():
+        while True:
+            hb[wid] = time.time()
+            if os.getppid() != ppid:
+                # supervisor terminato senza fermare i worker: arresto ordinato
+                os.kill(os.getpid(), signal.SIGTERM)
+            await asyncio.sleep(1.0)
+
+    async def _run():
+        t = asyncio.create_task(_beat())
+        try:
+            await eng.main()
+        finally:
+            t.cancel()
+    try:
+        eng.md.loop.run_until_complete(_run())
+    finally:
+        eng.close()
+
+class Worker:
+    def __init__(self, wid, entries):
+        self.wid = wid
+        self.entries = entries
+        self.symbols = [instrument_of(e)["pionex"] for e in entries]
+        self.proc = None
+        self.started = 0.0
+        self.restarts = 0
+        self.failures = 0
+        self.next_start = 0.0
+        self.last_exit = None
+        self.last_reason = None
+
+class Supervisor:
+    def __init__(self, cfg, workers=None):
+        self.cfg = cfg
+        s = cfg.get("supervisor", {}) or {}
+        self.entries = list(cfg.get("symbols") or [cfg["pionex"]["symbol"]])
+        self.insts = [instrument_of(e) for e in self.entries]
+        self.symbols = [i["pionex"] for i in self.insts]
+        self.index = {sym: i for i, sym in enumerate(self.symbols)}
+        n = int(workers or s.get("workers") or 0) or (os.cpu_count() or 1)
+        n = max(1, min(n, len(self.entries)))
+        self.health_every_s = float(s.get("health_every_s", 2.0))
+        self.heartbeat_timeout_s = float(s.get("heartbeat_timeout_s", 15.0))
+        self.start_grace_s = float(s.get("start_grace_s", 60.0))
+        self.backoff_s = float(s.get("restart_backoff_s", 1.0))
+        self.backoff_max_s = float(s.get("restart_backoff_max_s", 60.0))
+        self.stable_after_s = float(s.get("stable_after_s", 300.0))
+        self.report_every_s = float(s.get("report_every_s", 5.0))
+        self.rest_poll_s = float(s.get("rest_poll_s", cfg["daemon"]["loop_seconds"]))
+        self.poll_s = float(s.get("poll_ms", 5)) / 1000.0
+
+        self.ring = QuoteRing(slots=s.get("ring_slots", 4096))
+        self.ctx = mp.get_context("spawn")
+        self.hb = self.ctx.Array("d", n, lock=False)
+        self.workers = [Worker(i, e) for i, e in enumerate(shard(self.entries, n))]
+
+        df_cfg = cfg.get("datafeed", {}) or {}
+        set_base_urls(**(df_cfg.get("base_urls") or {}))
+        st_cfg = df_cfg.get("stream", {}) or {}
+        self.qs = self.md = None
+        if st_cfg.get("enabled", False):
+            self.qs = _Ingest(self.ring, self.index, urls=st_cfg.get("urls"),
+                              max_age_s=st_cfg.get("max_age_s", 5.0), instruments=self.insts)
+            self.qs.start()
+        else:
+            self.md = MarketData()
+        self._last_poll = 0.0
+        self.start = time.monotonic()
+        self.stop = False
+
+    # --- worker ---
+
+    def _worker_cfg(self, w):
+        c = copy.deepcopy(self.cfg)
+        c["symbols"] = w.entries
+        # durata e arresto sono del supervisor
+        c["daemon"]["max_runtime_seconds"] = 10 * 365 * 86_400
+        c["pionex"]["rate_limit"] = split_rate_limit(c["pionex"].get("rate_limit"), len(self.workers))
+        return c
+
+    def _spawn(self, w, now):
+        self.hb[w.wid] = 0.0
+        w.proc = self.ctx.Process(target=_worker, name=f"solusdbot-w{w.wid}", daemon=False,
+                                  args=(self._worker_cfg(w), w.wid, self.ring.name, self.symbols, self.hb, self.poll_s))
+        w.proc.start()
+        w.started = now
+        print(f"worker {w.wid} pid {w.proc.pid}: {', '.join(w.symbols)}", flush=True)
+
+    def _kill(self, w, grace_s):
+        p = w.proc
+        if p is None:
+            return
+        if p.is_alive():
+            p.terminate()
+            p.join(grace_s)
+            if p.is_alive():
+                p.kill()
+                p.join(5)
+        w.last_exit = p.exitcode
+        w.proc = None
+
+    def check(self, now):
+        """Worker morti o senza heartbeat: stop e riavvio con backoff (azzerato dopo stable_after_s senza errori)."""
+        wall = time.time()
+        for w in self.workers:
+            if w.proc is None:
+                if now >= w.next_start:
+                    self._spawn(w, now)
+                continue
+            hb = self.hb[w.wid]
+            reason = None
+            if not w.proc.is_alive():
+                reason = f"exit {w.proc.exitcode}"
+            elif hb == 0.0 and now - w.started > self.start_grace_s:
+                reason = "no heartbeat after start"
+            elif hb and wall - hb > self.heartbeat_timeout_s:
+                reason = f"heartbeat {wall - hb:.0f}s old"
+            if reason is None:
+                if w.failures and now - w.started > self.stable_after_s:
+                    w.failures = 0
+                continue
+            self._kill(w, 5.0)
+            w.restarts += 1
+            w.failures += 1
+            w.last_reason = reason
+            w.next_start = now + min(self.backoff_max_s, self.backoff_s * 2 ** (w.failures - 1))
+            print(f"worker {w.wid} restart ({reason}) in {w.next_start - now:.1f}s", flush=True)
+
+    # --- quote ---
+
+    def poll_rest(self, now):
+        """Senza stream: ticker REST in batch (una richiesta per venue), mid come bid = ask nel ring."""
+        if self.md is None or now - self._last_poll < self.rest_poll_s:
+            return
+        self._last_poll = now
+        async def _fetch():
+            return await batch_mids(await self.md.session(), self.insts)
+        try:
+            mids = self.md.loop.run_until_complete(_fetch())
+        except Exception:
+            return
+        ts = time.time()
+        for sym, per_venue in mids.items():
+            for v, m in enumerate(per_venue):
+                if m is not None:
+                    self.ring.publish(self.index[sym], v, m, m, ts)
+
+    # --- report ---
+
+    def _symbol_state(self, sym):
+        try:
+            with open(os.path.join("symbols", sym, "state.json"), "r") as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def report(self, now):
+        states = {sym: self._symbol_state(sym) for sym in self.symbols}
+        summary = {}
+        for sym, st in states.items():
+            if st is None:
+                summary[sym] = {"status": None, "reason": "no state yet"}
+                continue
+            summary[sym] = {"status": st.get("status"), "reason": st.get("reason"), "mid": st.get("mid"),
+                            "vol_pct": st.get("vol_pct"), "lev": st.get("lev"), "grid": st.get("grid"),
+                            "quote_src": st.get("quote_src"), "age_s": time.time() - st["ts"] if st.get("ts") else None,
+                            "state_path": os.path.join("symbols", sym, "state.json")}
+        worst = max((s["status"] for s in summary.values() if s.get("status")), key=lambda x: _STATUS_RANK.get(x, 0), default=None)
+        workers = [{"id": w.wid, "pid": w.proc.pid if w.proc is not None else None, "symbols": w.symbols,
+                    "alive": w.proc is not None and w.proc.is_alive(), "restarts": w.restarts, "last_exit": w.last_exit,
+                    "last_reason": w.last_reason, "heartbeat_age_s": (time.time() - self.hb[w.wid]) if self.hb[w.wid] else None}
+                   for w in self.workers]
+        first = states.get(self.symbols[0]) or {"ts": time.time(), "status": worst, "reason": "starting"}
+        write_json("state.json", {**first, "symbols": summary, "worst_status": worst,
+                                  "supervisor": {"uptime_s": now - self.start, "workers": workers,
+                                                 "ring": self.ring.stats(), "ingest": "stream" if self.qs is not None else "rest"}})
+
+    # --- ciclo di vita ---
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "stop", True))
+        runtime = float(self.cfg["daemon"]["max_runtime_seconds"])
+        last_check = last_report = 0.0
+        while not self.stop and time.monotonic() - self.start < runtime:
+            now = time.monotonic()
+            if now - last_check >= self.health_every_s:
+                self.check(now)
+                last_check = now
+            self.poll_rest(now)
+            if now - last_report >= self.report_every_s:
+                try: self.report(now)
+                except Exception as e: print(f"report failed: {e}", flush=True)
+                last_report = now
+            time.sleep(0.05)
+
+    def close(self):
+        grace = float(self.cfg["daemon"].get("sigterm_grace_seconds", 5)) + 30.0
+        for w in self.workers:
+            if w.proc is not None and w.proc.is_alive():
+                w.proc.terminate()
+        for w in self.workers:
+            self._kill(w, grace)
+        if self.qs is not None: self.qs.stop()
+        if self.md is not None: self.md.close()
+        self.ring.close()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Supervisor multi-processo dei simboli")
+    ap.add_argument("--config", default=None)
+    ap.add_argument("--workers", type=int, default=None, help="numero di worker (default supervisor.workers, 0 = core)")
+    args = ap.parse_args(argv)
+    sup = Supervisor(load_cfg(args.config), workers=args.workers)
+    try:
+        sup.run()
+    finally:
+        sup.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+# sweep.py — spaces only, LF
+"""
+Sweep parallelo dei parametri di config.yaml sopra backtest.run_backtest.
+
+  python sweep.py candles_1m.csv -p alpha.box_len=10,14,20 -p grid.k=0.3:0.8:0.1 \\
+      [--tf 1m] [--metric sharpe] [--jobs N] [--top 20] [--out best_overlay.yaml]
+
+Valori: lista "a,b,c" oppure range "start:stop:step" (stop incluso).
+Le candele sono scritte una volta in .npy e lette in mmap dai worker; ogni
+punto è salvato in cache (--cache-dir) con chiave = hash(dati, timeframe,
+config effettiva, codice di backtest.py e dei moduli locali che importa),
+quindi i rilanci calcolano solo i punti nuovi e una modifica al codice
+invalida la cache.
+"""
+import os, sys, ast, json, copy, hashlib, argparse, itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import yaml
+from util import load_cfg
+import backtest
+
+COLS = ("t", "o", "h", "l", "c", "v")
+_bars = None
+
+def parse_values(spec):
+    if ":" not in spec:
+        return [yaml.safe_load(x) for x in spec.split(",")]
+    start, stop, step = (yaml.safe_load(x) for x in spec.split(":"))
+    n = int(round((stop - start) / step)) + 1
+    vals = [start + i * step for i in range(max(0, n))]
+    return vals if all(isinstance(x, int) for x in (start, step)) else [round(v, 10) for v in vals]
+
+def set_path(cfg, dotted, value):
+    node = cfg
+    keys = dotted.split(".")
+    for k in keys[:-1]:
+        node = node.setdefault(k, {})
+    node[keys[-1]] = value
+
+def overlay(point):
+    out = {}
+    for k, v in point.items():
+        set_path(out, k, v)
+    return out
+
+def grid_points(params):
+    keys = sorted(params)
+    for combo in itertools.product(*(params[k] for k in keys)):
+        yield dict(zip(keys, combo))
+
+def data_hash(bars):
+    h = hashlib.sha256()
+    for k in COLS:
+        h.update(np.ascontiguousarray(bars[k], dtype=float).tobytes())
+    return h.hexdigest()
+
+def code_hash(root=backtest.__file__):
+    """Hash dei sorgenti di backtest.py e dei moduli della stessa cartella che importa (ricorsivo)."""
+    base = os.path.dirname(os.path.abspath(root))
+    seen, todo = set(), [os.path.abspath(root)]
+    while todo:
+        path = todo.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        with open(path, "rb") as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [a.name for a in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                dep = os.path.join(base, name.split(".")[0] + ".py")
+                if os.path.exists(dep):
+                    todo.append(dep)
+    h = hashlib.sha256()
+    for path in sorted(seen):
+        h.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def point_key(dhash, tf, cfg, chash=""):
+    blob = json.dumps({"data": dhash, "tf": tf, "cfg": cfg, "code": chash}, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+def _init_worker(npy_dir):
+    global _bars
+    _bars = {k: np.load(os.path.join(npy_dir, f"{k}.npy"), mmap_mode="r") for k in COLS}
+
+def _evaluate(cfg):
+    return backtest.run_backtest(_bars, cfg)["summary"]
+
+def _write_shared(bars, path):
+    os.makedirs(path, exist_ok=True)
+    for k in COLS:
+        np.save(os.path.join(path, f"{k}.npy"), np.ascontiguousarray(bars[k], dtype=float))
+
+def run_sweep(bars, base_cfg, params, tf="1m", jobs=None, cache_dir=".sweep_cache"):
+    """Ritorna lista di {"params", "summary", "cached"} per ogni punto della griglia."""
+    os.makedirs(cache_dir, exist_ok=True)
+    dhash = data_hash(bars)
+    chash = code_hash()
+    results, todo = [], []
+    for point in grid_points(params):
+        cfg = copy.deepcopy(base_cfg)
+        for k, v in point.items():
+            set_path(cfg, k, v)
+        key = point_key(dhash, tf, cfg, chash)
+        path = os.path.join(cache_dir, f"{key}.json")
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                results.append({"params": point, "summary": json.load(f)["summary"], "cached": True})
+        else:
+            todo.append((point, cfg, path))
+
+    if todo:
+        npy_dir = os.path.join(cache_dir, "data", dhash[:16])
+        if not os.path.exists(os.path.join(npy_dir, "v.npy")):
+            _write_shared(bars, npy_dir)
+        with ProcessPoolExecutor(max_workers=jobs or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(npy_dir,)) as ex:
+            futs = {ex.submit(_evaluate, cfg): (point, path) for point, cfg, path in todo}
+            for fut in as_completed(futs):
+                point, path = futs[fut]
+                try:
+                    summary = fut.result()
+                except Exception as e:
+                    results.append({"params": point, "summary": None, "error": str(e), "cached": False})
+                    continue
+                tmp = path + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump({"params": point, "tf": tf, "summary": summary}, f)
+                os.replace(tmp, path)
+                results.append({"params": point, "summary": summary, "cached": False})
+    return results
+
+def rank(results, metric="sharpe", descending=True):
+    ok = [r for r in results if r.get("summary") and r["summary"].get(metric) is not None]
+    return sorted(ok, key=lambda r: r["summary"][metric], reverse=descending)
+
+def format_table(ranked, params, metric, top=20):
+    keys = sorted(params)
+    cols = keys + [metric, "return_pct", "max_drawdown_pct", "trades", "cached"]
+    rows = [cols]
+    for r in ranked[:top]:
+        s = r["summary"]
+        rows.append([r["params"][k] for k in keys] + [s.get(metric), s.get("return_pct"),
+                                                       s.get("max_drawdown_pct"), s.get("trades"), r["cached"]])
+    fmt = lambda v: f"{v:.4f}" if isinstance(v, float) else str(v)
+    rows = [[fmt(v) for v in row] for row in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(cols))]
+    return "\n".join("  ".join(v.rjust(w) for v, w in zip(row, widths)) for row in rows)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Sweep parallelo dei parametri con cache su disco")
+    ap.add_argument("csv")
+    ap.add_argument("-p", "--param", action="append", default=[], help="chiave.puntata=valori")
+    ap.add_argument("--config", default="config.yaml")
+    ap.add_argument("--tf", default="1m", choices=("1m", "5m"))
+    ap.add_argument("--metric", default="sharpe")
+    ap.add_argument("--ascending", action="store_true", help="metrica da minimizzare (es. max_drawdown_pct)")
+    ap.add_argument("--jobs", type=int, default=None)
+    ap.add_argument("--top", type=int, default=20)
+    ap.add_argument("--cache-dir", default=".sweep_cache")
+    ap.add_argument("--out", default="best_overlay.yaml")
+    args = ap.parse_args(argv)
+
+    params = {}
+    for p in args.param:
+        k, _, spec = p.partition("=")
+        params[k.strip()] = parse_values(spec.strip())
+    if not params:
+        ap.error("almeno un --param")
+
+    base_cfg = load_cfg(args.config)
+    bars = backtest.resample(backtest.load_csv(args.csv), 5 if args.tf == "5m" else 1)
+    results = run_sweep(bars, base_cfg, params, tf=args.tf, jobs=args.jobs, cache_dir=args.cache_dir)
+    ranked = rank(results, args.metric, descending=not args.ascending)
+    print(format_table(ranked, params, args.metric, args.top))
+    errors = [r for r in results if r.get("error")]
+    if errors:
+        print(f"{len(errors)} points failed, e.g. {errors[0]['params']}: {errors[0]['error']}", file=sys.stderr)
+    if ranked:
+        best = ranked[0]
+        with open(args.out, "w") as f:
+            f.write(f"# best {args.metric}={best['summary'][args.metric]} ({args.tf})\n")
+            yaml.safe_dump(overlay(best["params"]), f, sort_keys=True)
+        print(f"\nbest overlay -> {args.out}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
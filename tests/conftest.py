@@ -0,0 +1,30 @@
+import os, sys, copy
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from util import load_cfg
+
+@pytest.fixture(scope="session")
+def base_cfg():
+    return load_cfg(os.path.join(ROOT, "config.yaml"))
+
+@pytest.fixture
+def cfg(base_cfg):
+    return copy.deepcopy(base_cfg)
+
+@pytest.fixture
+def sim(cfg):
+    """Simulatore in-process senza latenza né errori: (simulatore, config del bot puntata al simulatore)."""
+    import simulator
+    cfg["simulator"]["faults"] = {"default": {"latency_ms": 0, "jitter_ms": 0, "error_rate": 0.0}}
+    cfg["simulator"]["rate_limit"] = {}
+    cfg["simulator"]["quote_interval_ms"] = 50
+    s = simulator.Simulator(cfg)
+    port, stop = simulator.serve_in_thread(s)
+    try:
+        yield s, simulator.sim_config(cfg, "127.0.0.1", port)
+    finally:
+        stop()
@@ -0,0 +1,109 @@
+import random
+from collections import deque
+from statistics import pstdev
+from alpha import AlphaDetector
+
+class _Reference:
+    """Versione a finestre copiate: box su slice delle box_len barre precedenti, pstdev dei volumi."""
+    def __init__(self, box_len, strong_close, min_box_range_pct, max_box_range_pct, hyst):
+        self.box_len = box_len
+        self.strong_close = strong_close
+        self.min_box, self.max_box = min_box_range_pct / 100.0, max_box_range_pct / 100.0
+        self.hyst = hyst
+        self.hi, self.lo, self.vo = [], [], deque(maxlen=200)
+        self.box_top = self.box_bot = None
+        self._last_signal, self._persist = None, 0
+
+    def _norm_vol(self):
+        return pstdev(self.vo) if len(self.vo) >= 5 else 0.0
+
+    def update(self, o, h, l, c, v):
+        self.vo.append(v)
+        if len(self.hi) < self.box_len:
+            self.hi.append(h); self.lo.append(l)
+            return None, self.box_top, self.box_bot, 0.0
+        top, bot = max(self.hi[-self.box_len:]), min(self.lo[-self.box_len:])
+        self.hi.append(h); self.lo.append(l)
+        self.box_top, self.box_bot = top, bot
+        mid = (top + bot) / 2.0
+        pct = max(1e-9, top - bot) / max(1e-9, mid)
+        if pct < self.min_box or pct > self.max_box:
+            self._last_signal, self._persist = None, 0
+            return None, top, bot, self._norm_vol()
+        body = (o + c) / 2.0
+        long_break = c > top and (not self.strong_close or body > top)
+        short_break = c < bot and (not self.strong_close or body < bot)
+        sig = "long" if long_break else ("short" if short_break else None)
+        self._persist = self._persist + 1 if sig == self._last_signal and sig is not None else 1
+        self._last_signal = sig
+        return (sig if sig and self._persist >= max(1, self.hyst) else None), top, bot, self._norm_vol()
+
+def _bars(n, seed=7):
+    from simulator import PricePath
+    return PricePath(start_price=150.0, vol_bps=8.0, history_bars=n, seed=seed).bars[:n]
+
+def test_update_fast_matches_reference():
+    for box_len, strong, hyst in ((14, True, 2), (5, False, 2), (1, True, 1)):
+        det = AlphaDetector(norm_len=100, box_len=box_len, strong_close=strong, min_box_range_pct=0.05,
+                            max_box_range_pct=2.0, signal_hysteresis_bars=hyst)
+        ref = _Reference(box_len, strong, 0.05, 2.0, hyst)
+        fired = set()
+        for o, h, l, c, v in _bars(3000, seed=box_len):
+            got = det.update_fast(o, h, l, c, v)
+            want = ref.update(o, h, l, c, v)
+            assert got[:3] == want[:3]
+            assert abs(got[3] - want[3]) <= 1e-9 * max(1.0, want[3])
+            fired.add(got[0])
+        assert {"long", "short"} <= fired, (box_len, fired)
+
+FLAT = (100.0, 100.5, 99.5, 100.0)
+
+def _signals(bars, box_len=5, strong=True, hyst=2, min_pct=0.05, max_pct=2.0):
+    det = AlphaDetector(box_len=box_len, strong_close=strong, min_box_range_pct=min_pct,
+                        max_box_range_pct=max_pct, signal_hysteresis_bars=hyst)
+    ref = _Reference(box_len, strong, min_pct, max_pct, hyst)
+    out = []
+    for o, h, l, c in bars:
+        got = det.update_fast(o, h, l, c, 1.0)
+        assert got[:3] == ref.update(o, h, l, c, 1.0)[:3]
+        out.append(got[0])
+    return out
+
+UP1, UP2 = (100.6, 101.1, 100.6, 101.0), (101.2, 101.6, 101.2, 101.5)
+DN1, DN2 = (99.4, 99.4, 98.9, 99.0), (98.8, 98.8, 98.4, 98.5)
+
+def test_breakout_long_and_short_fire():
+    assert _signals([FLAT] * 5 + [UP1], hyst=1) == [None] * 5 + ["long"]
+    assert _signals([FLAT] * 5 + [DN1], hyst=1) == [None] * 5 + ["short"]
+    # il box è quello delle barre precedenti: la barra di rottura è fuori dal suo stesso box
+    assert _signals([FLAT] * 5 + [UP1, UP2], hyst=2)[-2:] == [None, "long"]
+    assert _signals([FLAT] * 5 + [DN1, DN2], hyst=2)[-2:] == [None, "short"]
+
+def test_strong_close_needs_body_outside_box():
+    wick = (100.3, 100.9, 100.3, 100.6)     # chiusura sopra il top, corpo a metà dentro
+    assert _signals([FLAT] * 5 + [wick], hyst=1)[-1] is None
+    assert _signals([FLAT] * 5 + [wick], hyst=1, strong=False)[-1] == "long"
+
+def test_hysteresis_persist_resets():
+    inside = (101.0, 101.05, 100.95, 101.0)
+    # long, barra dentro il box, long: la persistenza riparte da 1
+    assert _signals([FLAT] * 5 + [UP1, inside, UP2], hyst=2)[-3:] == [None, None, None]
+    # direzione opposta: riparte da 1
+    assert _signals([FLAT] * 5 + [UP1, (99.0, 99.0, 98.0, 98.2)], hyst=2, max_pct=5.0)[-2:] == [None, None]
+    # box troppo stretto azzera la persistenza anche se il prezzo esce
+    tight = (100.0, 100.01, 99.99, 100.0)
+    assert _signals([tight] * 5 + [UP1, UP2], hyst=1, min_pct=0.05)[-2:] == [None, "long"]
+    assert _signals([tight] * 5 + [UP1, UP2], hyst=2, min_pct=0.05)[-2:] == [None, None]
+
+def test_update_forms_and_state_roundtrip():
+    bars = _bars(500, seed=2)
+    a = AlphaDetector()
+    for o, h, l, c, v in bars[:300]:
+        a.update({"o": o, "h": h, "l": l, "c": c, "v": v})
+    b = AlphaDetector()
+    assert b.set_state(a.get_state())
+    for o, h, l, c, v in bars[300:]:
+        x, y = a.update(o, h, l, c, v), b.update(o=o, h=h, l=l, c=c, v=v)
+        # la varianza dei volumi viene ricalcolata esatta al ripristino: stessi valori a meno dell'arrotondamento
+        assert x[:3] == y[:3]
+        assert abs(x[3] - y[3]) <= 1e-9 * max(1.0, x[3])
@@ -0,0 +1,56 @@
+import asyncio, time
+from pionex_api import AsyncPionex
+
+def _client(cfg, conc):
+    cfg["pionex"]["max_concurrency"] = conc
+    cfg["pionex"]["rate_limit"] = {}
+    return AsyncPionex("k", "s", cfg)
+
+def test_grid_orders_go_out_concurrently(sim):
+    s, cfg = sim
+    s.faults._default["latency_ms"] = 100.0
+    s.faults._profiles = {}
+    sym = cfg["pionex"]["symbol"]
+    mid = s.path.mid()
+
+    async def run(conc):
+        px = _client(cfg, conc)
+        try:
+            t0 = time.perf_counter()
+            res = await px.aplace_grid(sym, mid * 0.98, mid * 1.02, 8, 0.1, mid)
+            return res, time.perf_counter() - t0
+        finally:
+            await px.aclose()
+
+    res, dt4 = asyncio.run(run(4))
+    assert res["ok"] and res["placed"] == 8
+    assert all(r["ok"] and AsyncPionex.order_id(r) is not None for r in res["results"])
+    sides = [r["body"]["side"] for r in res["results"]]
+    assert sides == sorted(sides)          # BUY sotto il mid, poi SELL: risultati nell'ordine dei body
+    _, dt1 = asyncio.run(run(1))
+    # 8 ordini da 100 ms: ~2 giri con 4 in volo, ~8 in serie
+    assert dt4 < 0.5 < dt1
+    assert len(s.ex.orders) == 16
+
+def test_per_order_errors_and_bracket_entry_failure(sim):
+    s, cfg = sim
+    sym = cfg["pionex"]["symbol"]
+    mid = s.path.mid()
+    place = cfg["pionex"].get("endpoints", {}).get("place_order", "/api/v1/order")
+
+    async def run():
+        px = _client(cfg, 4)
+        try:
+            ok_body = px._grid_order(sym, "BUY", round(mid * 0.97, 2), 0.1)
+            s.faults._rl_cfg = {place: {"rate": 0.001, "burst": 1}}
+            out = await px.aplace_orders([ok_body, dict(ok_body, price=round(mid * 0.96, 2))])
+            br = await px.aplace_breakout_bracket(sym, "BUY", mid, 0.1, mid * 0.99, mid * 1.02)
+            return out, br
+        finally:
+            await px.aclose()
+
+    out, br = asyncio.run(run())
+    assert sorted(r["ok"] for r in out) == [False, True]
+    bad = next(r for r in out if not r["ok"])
+    assert "429" in bad["error"] and "body" in bad and "response" not in bad
+    assert br["ok"] is False and br["error"].startswith("entry_failed") and "tp" not in br
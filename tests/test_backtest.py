@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+from backtest import pid_leverage, pid_steps
+from pid import PID, leverage_from_pid
+
+def test_pid_leverage_matches_live_loop_cadence(cfg):
+    rng = np.random.default_rng(3)
+    vol = np.abs(rng.normal(0.9, 0.4, 500))
+    active = rng.random(500) > 0.1
+    for bar_s, loop_s in ((60.0, 6.0), (300.0, 6.0), (60.0, 60.0)):
+        cfg["daemon"]["loop_seconds"] = loop_s
+        k, dt = pid_steps(bar_s, cfg)
+        p = cfg["pid"]
+        pid = PID(p["kp"], p["ki"], p["kd"], p["out_min"], p["out_max"])
+        want = []
+        u = 0.0
+        for v, a in zip(vol, active):
+            if a:
+                # loop live: k campioni con lo stesso errore nella barra, vale l'ultimo
+                for _ in range(k):
+                    u = pid.step(p["target_vol_pct"] - v, dt)
+            else:
+                u = max(p["out_min"], min(p["out_max"], p["kp"] * (p["target_vol_pct"] - v) + pid.i))
+            want.append(leverage_from_pid(u, cfg["leverage"]["min"], cfg["leverage"]["max"]))
+        got = pid_leverage(vol, active, cfg, bar_s)
+        np.testing.assert_allclose(got[active], np.asarray(want)[active], rtol=1e-9, atol=1e-12)
+
+from alpha import AlphaDetector
+from backtest import box_signals, grid_fills, bracket_exit, run_backtest
+
+def _ohlc(n, seed=5, bps=15.0):
+    from simulator import PricePath
+    b = np.asarray(PricePath(start_price=150.0, vol_bps=bps, history_bars=n, seed=seed).bars[:n], dtype=float)
+    return {"t": np.arange(n) * 60_000.0, "o": b[:, 0], "h": b[:, 1], "l": b[:, 2], "c": b[:, 3], "v": b[:, 4]}
+
+def test_box_signals_match_alpha_detector():
+    bars = _ohlc(4000)
+    for a in ({"box_len": 14, "strong_close": True, "min_box_range_pct": 0.05, "signal_hysteresis_bars": 2},
+              {"box_len": 5, "strong_close": False, "min_box_range_pct": 0.05, "signal_hysteresis_bars": 1}):
+        sig, top, bot = box_signals(bars["o"], bars["h"], bars["l"], bars["c"], **a)
+        det = AlphaDetector(box_len=a["box_len"], strong_close=a["strong_close"], min_box_range_pct=a["min_box_range_pct"],
+                            max_box_range_pct=2.0, signal_hysteresis_bars=a["signal_hysteresis_bars"])
+        want = []
+        for i in range(len(sig)):
+            s, bt, bb, _ = det.update_fast(*(float(bars[k][i]) for k in "ohlcv"))
+            want.append({"long": 1, "short": -1}.get(s, 0))
+            if i >= a["box_len"]:
+                assert (top[i], bot[i]) == (bt, bb)
+        assert sig.tolist() == want
+        assert {1, -1} <= set(want)
+
+def test_grid_fills_first_touch_per_level():
+    rng = np.random.default_rng(1)
+    n = 300
+    c = 100.0 + np.cumsum(rng.normal(0.0, 0.2, n))
+    h, l = c + rng.uniform(0, 0.3, n), c - rng.uniform(0, 0.3, n)
+    k, upto = 10, 250
+    prices = c[k] + np.linspace(-3.0, 3.0, 13)
+    qtys = np.where(prices <= c[k], 1.0, -1.0)
+    got = {float(p): (int(b), float(q)) for b, q, p in zip(*grid_fills(l, h, k, upto, prices, qtys))}
+    want = {}
+    for p, q in zip(prices, qtys):
+        for b in range(k + 1, upto + 1):
+            if (q > 0 and l[b] <= p) or (q < 0 and h[b] >= p):
+                want[float(p)] = (b, float(q))
+                break
+    assert got == want and 0 < len(got) < len(prices)
+
+def test_bracket_exit_tp_sl_and_same_bar():
+    l = np.array([99.5, 99.6, 99.0, 100.2, 97.0])
+    h = np.array([100.5, 100.4, 100.9, 102.5, 103.0])
+    assert bracket_exit(l, h, 0, 1, 98.0, 102.0) == (3, False)       # TP long
+    assert bracket_exit(l, h, 0, 1, 99.1, 102.0) == (2, True)        # SL long
+    assert bracket_exit(l, h, 3, 1, 98.0, 102.9) == (4, True)        # entrambi nella barra: vince lo SL
+    assert bracket_exit(l, h, 0, -1, 102.0, 99.05) == (2, False)     # TP short
+    assert bracket_exit(l, h, 0, -1, 101.0, 95.0) == (3, True)       # SL short
+    assert bracket_exit(l, h, 0, 1, 90.0, 110.0) == (5, False)       # mai
+
+def _bt_cfg(cfg, mode):
+    cfg["trading"].update({"mode": mode, "sltp_enabled": True, "slip_bps": 2.0})
+    cfg["alpha"].update({"enabled": True, "min_box_range_pct": 0.05, "cooloff_seconds": 0, "daily_trade_target": 1000})
+    return cfg
+
+def test_breakout_backtest_trades_follow_signals_and_exits(cfg):
+    bars = _ohlc(3000)
+    res = run_backtest(bars, _bt_cfg(cfg, "breakout"))
+    trades = res["trades"]
+    assert len(trades) > 10
+    sig, _, _ = box_signals(bars["o"], bars["h"], bars["l"], bars["c"], **cfg["alpha"])
+    slip = 2.0 / 1e4
+    for tr in trades:
+        side = 1 if tr["side"] == "BUY" else -1
+        assert sig[tr["entry_bar"]] == side
+        assert tr["entry"] == pytest.approx(bars["c"][tr["entry_bar"]] * (1 + side * slip))
+        x, sl_hit = bracket_exit(bars["l"], bars["h"], tr["entry_bar"], side, tr["sl"], tr["tp"])
+        if tr["result"] == "open":
+            assert x == len(bars["c"])
+            continue
+        assert tr["exit_bar"] == x and (tr["result"] == "win") == (tr["pl"] > 0)
+        assert tr["exit"] == pytest.approx(tr["sl"] * (1 - side * slip) if sl_hit else tr["tp"])
+        assert tr["pl"] == pytest.approx((tr["exit"] - tr["entry"]) * tr["qty"] * side)
+    assert {"win", "loss"} <= {tr["result"] for tr in trades}
+    s = res["summary"]
+    assert s["vol_sample_s"] == 60.0 and s["live_vol_sample_s"] == cfg["daemon"]["loop_seconds"]
+
+def test_grid_backtest_fills_and_equity(cfg):
+    bars = _ohlc(3000)
+    res = run_backtest(bars, _bt_cfg(cfg, "grid"))
+    f = res["fills"]
+    assert f["bar"].size > 0 and res["summary"]["regrids"] > 0 and res["summary"]["grid_fills"] == f["bar"].size
+    for b, q, p in zip(f["bar"], f["qty"], f["px"]):
+        # un limit buy si esegue solo se il low arriva al prezzo, un sell se ci arriva l'high
+        assert (bars["l"][b] <= p + 1e-9) if q > 0 else (bars["h"][b] >= p - 1e-9)
+    # equity = cassa + posizione valutata al close
+    pos = np.cumsum(np.bincount(f["bar"], weights=f["qty"], minlength=3000))
+    cash = np.cumsum(np.bincount(f["bar"], weights=-f["qty"] * f["px"], minlength=3000))
+    eq0 = cfg["risk"]["portfolio_usdt_fallback"]
+    np.testing.assert_allclose(res["equity"], eq0 + cash + pos * bars["c"])
@@ -0,0 +1,14 @@
+import json
+import os
+from bench import rescale_case
+
+def test_rescale_case_moves_every_latency_field():
+    c = {"ops": 100, "ops_s": 1000.0, "norm": 3.0, "p50_us": 1.0, "p95_us": 2.0, "p99_us": 4.0, "max_us": 8.0}
+    r = rescale_case(c, 2.0)
+    assert r == {"ops": 100, "ops_s": 2000.0, "norm": 3.0, "p50_us": 0.5, "p95_us": 1.0, "p99_us": 2.0, "max_us": 4.0}
+
+def test_saved_baseline_latencies_are_ordered():
+    with open(os.path.join(os.path.dirname(__file__), "..", "bench_baseline.json")) as f:
+        cases = json.load(f)["cases"]
+    for n, c in cases.items():
+        assert c["p50_us"] <= c["p95_us"] <= c["p99_us"] <= c["max_us"], n
@@ -0,0 +1,65 @@
+from pionex_api import Pionex
+
+class FakePionex(Pionex):
+    """Pionex con _request in memoria: ordini a riposo fissi, registra cancel e place."""
+    def __init__(self, cfg, resting):
+        cfg["pionex"]["max_concurrency"] = 1
+        cfg["pionex"]["rate_limit"] = {}
+        super().__init__("k", "s", cfg)
+        self.instruments["SOLUSDT"] = {"tick_size": 0.01, "step_size": 0.1}
+        self.resting, self.cancelled, self.placed = resting, [], []
+
+    def _request(self, method, path, params=None, body=None):
+        if path == self.paths["open_orders"]:
+            return {"orders": list(self.resting)}
+        if path == self.paths["market_info"]:
+            return {}
+        if path == self.paths["cancel_order"]:
+            self.cancelled.append(body["orderId"])
+        elif path == self.paths["place_order"]:
+            self.placed.append((body["side"], round(body["price"], 2), round(body["quantity"], 1)))
+        return {"ok": True}
+
+def _order(oid, side, price, qty, **kw):
+    return {"orderId": oid, "side": side, "type": "LIMIT", "price": str(price), "size": str(qty), **kw}
+
+def test_reconcile_keeps_matching_levels_and_diffs_the_rest(cfg):
+    # target: 100, 101, 102, 103, 104 con ref 102 -> BUY 100..102, SELL 103..104, qty 1.0
+    resting = [
+        _order("a", "BUY", 100.00, 1.0),        # identico: resta
+        _order("b", "BUY", 101.01, 1.0),        # entro 1 tick: resta
+        _order("c", "BUY", 102.05, 1.0),        # fuori tolleranza: cancellato, 102 piazzato
+        _order("d", "SELL", 103.00, 2.0),       # qty diversa: cancellato, 103 piazzato
+        _order("e", "BUY", 104.00, 1.0),        # side sbagliato: cancellato, SELL 104 piazzato
+        _order("tp", "SELL", 110.0, 1.0, reduceOnly=True),
+        {"orderId": "sl", "side": "SELL", "type": "STOP_MARKET", "stopPrice": "95", "size": "1"},
+    ]
+    px = FakePionex(cfg, resting)
+    res = px.reconcile_grid("SOLUSDT", 100.0, 104.0, 5, 1.0, 102.0, tol_ticks=1)
+    assert res["mode"] == "diff" and res["kept"] == 2
+    assert sorted(px.cancelled) == ["c", "d", "e"]
+    assert sorted(px.placed) == [("BUY", 102.0, 1.0), ("SELL", 103.0, 1.0), ("SELL", 104.0, 1.0)]
+    assert res["placed"] == 3 and res["cancelled"] == 3
+
+def test_reconcile_matches_each_resting_order_once(cfg):
+    # due livelli target a 1 tick da un solo ordine: il più vicino lo tiene, l'altro è piazzato
+    px = FakePionex(cfg, [_order("a", "BUY", 100.01, 1.0)])
+    res = px.reconcile_grid("SOLUSDT", 100.0, 100.02, 3, 1.0, 101.0, tol_ticks=1)
+    assert res["kept"] == 1 and px.cancelled == []
+    assert sorted(px.placed) == [("BUY", 100.0, 1.0), ("BUY", 100.02, 1.0)]
+
+def test_reconcile_skips_the_cycle_when_open_orders_fail(cfg):
+    px = FakePionex(cfg, [_order("a", "BUY", 100.0, 1.0), _order("tp", "SELL", 110.0, 1.0, reduceOnly=True)])
+    calls = []
+    real = px._request
+    def throttled(method, path, params=None, body=None):
+        calls.append(path)
+        if path == px.paths["open_orders"]:
+            raise RuntimeError("rate limit: stale after 2.0s")
+        return real(method, path, params, body)
+    px._request = throttled
+    cfg["grid"]["reconcile"] = True
+    res = px.sync_replace_grid("SOLUSDT", 100.0, 104.0, 5, 1.0, 102.0)
+    assert res["ok"] is False and res["mode"] == "skipped"
+    # nessun cancel_all né ordine: TP/SL dei bracket restano
+    assert px.paths["cancel_all"] not in calls and px.cancelled == [] and px.placed == []
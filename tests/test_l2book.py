@@ -0,0 +1,173 @@
+import asyncio, random, time
+import pytest
+import datafeeds
+import l2book
+from l2book import BookSide, L2Book, DepthStream, micro_weights, estimate_slippage
+from ws_quotes import VENUES
+
+def _ref_levels(d, bid, n=None):
+    lv = sorted(((p, q) for p, q in d.items() if q > 0), reverse=bid)
+    return lv[:n]
+
+def test_snapshot_plus_diffs_match_dict_book():
+    rng = random.Random(11)
+    book = L2Book(max_levels=1000)
+    bids = {round(100 - 0.01 * i, 2): rng.uniform(0.1, 5) for i in range(1, 40)}
+    asks = {round(100 + 0.01 * i, 2): rng.uniform(0.1, 5) for i in range(1, 40)}
+    book.snapshot(list(bids.items()) + [(90.0, 0.0)], list(asks.items()), seq=1)
+    for seq in range(2, 3000):
+        db = [(round(100 - 0.01 * rng.randint(1, 60), 2), rng.choice((0.0, rng.uniform(0.1, 5)))) for _ in range(3)]
+        da = [(round(100 + 0.01 * rng.randint(1, 60), 2), rng.choice((0.0, rng.uniform(0.1, 5)))) for _ in range(3)]
+        before = book.best()
+        top = book.update(db, da, seq=seq)
+        bids.update(db); asks.update(da)
+        assert book.bids.levels() == _ref_levels(bids, True)
+        assert book.asks.levels() == _ref_levels(asks, False)
+        if book.best() != before:
+            assert top
+    assert book.seq == 2999 and book.stats["updates"] == 2998
+
+def test_max_levels_keeps_the_best():
+    side = BookSide(bid=False, max_levels=3)
+    side.load([(105, 1), (101, 1), (103, 1), (102, 1)])
+    assert [p for p, _ in side.levels()] == [101, 102, 103]
+    assert side.set(104, 1) is False and len(side) == 3
+    assert side.set(100, 2) is True
+    assert side.levels() == [(100, 2), (101, 1), (102, 1)]
+    assert side.set(100, 0) is True and side.best() == 101
+
+def test_microprice_depth_and_slippage():
+    book = L2Book()
+    book.snapshot([(99.0, 3.0), (98.0, 1.0)], [(101.0, 1.0), (102.0, 5.0)], seq=1)
+    assert book.microprice([1.0]) == pytest.approx(99.0 + 2.0 * 3.0 / 4.0)
+    assert book.depth_notional(150.0) == pytest.approx(99.0 * 3 + 101.0 * 1)
+    est = estimate_slippage([book], "BUY", 2.0)
+    assert est["avg"] == pytest.approx(101.5) and est["complete"]
+    assert est["bps"] == pytest.approx((101.5 / 100.0 - 1.0) * 1e4)
+    assert not estimate_slippage([book], "SELL", 10.0)["complete"]
+    assert len(micro_weights(3, 0.5)) == 3
+
+def _ev(sym, U, u, pu, b=(), a=()):
+    return {"stream": f"{sym.lower()}@depth@100ms",
+            "data": {"e": "depthUpdate", "s": sym, "U": U, "u": u, "pu": pu, "b": [list(x) for x in b], "a": [list(x) for x in a]}}
+
+def test_binance_snapshot_and_U_u_pu_sync(monkeypatch):
+    ds = DepthStream()
+    key = ds.default_key
+    sym = ds._insts[key]["binance"]
+    book = ds.books[("binance", key)]
+    snaps, requests = [], []
+
+    async def fake_fetch(session, url, params=None):
+        requests.append(params)
+        gate, snap = snaps.pop(0)
+        await gate.wait()
+        return snap
+    monkeypatch.setattr(datafeeds, "fetch_json", fake_fetch)
+
+    async def scenario():
+        gate = asyncio.Event()
+        snaps.append((gate, {"lastUpdateId": 100, "bids": [["99", "1"], ["98", "2"]], "asks": [["101", "1"]]}))
+        # diff in arrivo mentre lo snapshot REST è in corso: accodati
+        await ds._binance(_ev(sym, 90, 95, 89, b=[("97", "9")]), None, None)
+        await ds._binance(_ev(sym, 96, 102, 95, b=[("99", "3")]), None, None)
+        await ds._binance(_ev(sym, 103, 105, 102, a=[("100.5", "1")]), None, None)
+        await asyncio.sleep(0)
+        assert book.seq is None and len(requests) == 1
+        gate.set()
+        await asyncio.sleep(0.01)
+        # u < lastUpdateId scartato, U <= lastUpdateId <= u applicato, poi pu == u precedente
+        assert book.seq == 105
+        assert book.bids.levels() == [(99.0, 3.0), (98.0, 2.0)]
+        assert book.best() == (99.0, 100.5)
+        await ds._binance(_ev(sym, 106, 107, 105, b=[("98", "0")]), None, None)
+        assert book.seq == 107 and book.bids.levels() == [(99.0, 3.0)]
+        assert ds.quotes()["binance"]["bid"] == 99.0
+
+        # buco (pu != ultimo u): book azzerato e nuovo snapshot
+        gate2 = asyncio.Event()
+        snaps.append((gate2, {"lastUpdateId": 150, "bids": [["95", "1"]], "asks": [["96", "1"]]}))
+        await ds._binance(_ev(sym, 120, 130, 119), None, None)
+        await asyncio.sleep(0)
+        assert book.seq is None and book.stats["resyncs"] == 1 and len(requests) == 2
+        assert "binance" not in ds.quotes()
+        gate2.set()
+        await asyncio.sleep(0.01)
+        # il diff accodato è più vecchio dello snapshot: resta lo snapshot in attesa del primo diff valido
+        assert book.seq == 150 and key in ds._first
+        # U > lastUpdateId: tra snapshot e primo diff mancano update, si risincronizza
+        snaps.append((gate2, {"lastUpdateId": 170, "bids": [["95", "2"]], "asks": [["96", "2"]]}))
+        await ds._binance(_ev(sym, 155, 160, 154), None, None)
+        assert book.seq is None and book.stats["resyncs"] == 2 and len(requests) == 2
+        await asyncio.sleep(0.01)
+        assert book.seq == 170 and len(requests) == 3
+
+    asyncio.run(scenario())
+
+class _FakeWS:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, msg):
+        self.sent.append(msg)
+
+def test_bybit_and_okx_sequence_gaps_resubscribe():
+    ds = DepthStream()
+    key = ds.default_key
+    by, ok = ds._insts[key]["bybit"], ds._insts[key]["okx"]
+    ws = _FakeWS()
+
+    def bybit(kind, u, b=(), a=()):
+        return {"topic": f"orderbook.50.{by}", "type": kind, "data": {"s": by, "u": u, "b": b, "a": a}}
+
+    def okx(action, seq, prev, b=(), a=()):
+        return {"arg": {"channel": "books", "instId": ok}, "action": action,
+                "data": [{"bids": b, "asks": a, "seqId": seq, "prevSeqId": prev}]}
+
+    async def scenario():
+        await ds._bybit(bybit("delta", 5, b=[["1", "1"]]), ws, None)        # prima dello snapshot: ignorato
+        assert ds.books[("bybit", key)].seq is None
+        await ds._bybit(bybit("snapshot", 10, b=[["99", "1"]], a=[["101", "1"]]), ws, None)
+        await ds._bybit(bybit("delta", 11, b=[["99.5", "2"]]), ws, None)
+        await ds._bybit(bybit("delta", 11, b=[["99.7", "2"]]), ws, None)   # duplicato
+        assert ds.books[("bybit", key)].best() == (99.5, 101.0)
+        await ds._bybit(bybit("delta", 13), ws, None)
+        assert ds.books[("bybit", key)].seq is None and len(ws.sent) == 2
+
+        await ds._okx(okx("snapshot", 1000, -1, b=[["99", "1", "0", "1"]], a=[["101", "1", "0", "1"]]), ws, None)
+        await ds._okx(okx("update", 1001, 1000, a=[["100.5", "1", "0", "1"]]), ws, None)
+        assert ds.books[("okx", key)].best() == (99.0, 100.5)
+        await ds._okx(okx("update", 1005, 1003), ws, None)
+        assert ds.books[("okx", key)].seq is None and len(ws.sent) == 4
+
+    asyncio.run(scenario())
+
+def _wait(cond, timeout=10.0):
+    t_end = time.time() + timeout
+    while time.time() < t_end:
+        if cond():
+            return True
+        time.sleep(0.05)
+    return False
+
+def test_depth_stream_against_simulator(sim):
+    s, cfg = sim
+    old = datafeeds.BINANCE_F
+    datafeeds.set_base_urls(binance=cfg["datafeed"]["base_urls"]["binance"])
+    ds = DepthStream(urls=cfg["datafeed"]["depth"]["urls"], max_levels=20)
+    ds.start()
+    try:
+        assert _wait(lambda: set(ds.quotes()) == set(VENUES))
+        for v, q in ds.quotes().items():
+            assert q["bid"] < q["micro"] < q["ask"]
+            b = ds.books[(v, ds.default_key)]
+            assert 0 < len(b.bids) <= 20 and 0 < len(b.asks) <= 20
+        mid, _, _, _, alive = ds.aggregate_quote()
+        assert alive == 3 and abs(mid / s.path.mid() - 1.0) < 5e-3
+        est = ds.slippage("BUY", 1.0)
+        # rif. = mid consolidato: con il rumore per venue un ask può stare sotto, bps piccolo anche negativo
+        assert est["complete"] and est["filled"] == 1.0 and abs(est["bps"]) < 50
+    finally:
+        ds.stop()
+        ds._thread.join(5)
+        datafeeds.BINANCE_F = old
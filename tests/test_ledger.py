@@ -0,0 +1,97 @@
+import pytest
+from ledger import Ledger
+from stops import DynamicStops
+
+T0 = 1_700_000_000_000
+
+@pytest.fixture
+def lad(tmp_path):
+    l = Ledger(str(tmp_path / "ledger.db"), legacy_json=None)
+    yield l
+    l.close()
+
+def test_tp_fill_closes_position_as_win(lad):
+    pid = lad.record_entry("BUY", 2.0, 100.0, sl=98.0, tp=104.0, ts=T0, tp_oid=11, sl_oid=12)
+    assert [p["id"] for p in lad.open_positions()] == [pid]
+    assert lad.apply_fill({"orderId": 11, "price": "104.5", "size": "2", "side": "SELL"}, "k1", ts=T0 + 1000)
+    assert lad.open_positions() == []
+    (c,) = lad.closed_positions()
+    assert c["result"] == "win" and c["exit"] == 104.5 and c["pl"] == pytest.approx(9.0)
+    s = lad.stats(T0 + 1000)
+    assert s["last_result"] == "win" and s["streak"] == 1 and s["pnl_total"] == pytest.approx(9.0)
+
+def test_sl_fill_closes_short_as_loss_and_extends_streak(lad):
+    lad.record_entry("SELL", 1.0, 100.0, sl=102.0, tp=96.0, ts=T0, tp_oid="a", sl_oid="b")
+    lad.record_entry("SELL", 1.0, 100.0, sl=102.0, tp=96.0, ts=T0, tp_oid="c", sl_oid="d")
+    assert lad.apply_fill({"order_id": "b", "price": 102.5, "quantity": 1, "ts": T0}, "k1", ts=T0)
+    assert lad.apply_fill({"orderId": "d", "price": 102.0, "qty": 1, "time": T0}, "k2", ts=T0)
+    assert [c["result"] for c in lad.closed_positions()] == ["loss", "loss"]
+    s = lad.stats(T0)
+    assert s["streak"] == 2 and s["pnl_total"] == pytest.approx(-4.5)
+    assert lad.day_stats(T0)["losses"] == 2
+
+def test_fill_is_idempotent_per_key(lad):
+    lad.record_entry("BUY", 1.0, 100.0, sl=98.0, tp=104.0, ts=T0, tp_oid=1, sl_oid=2)
+    fill = {"orderId": 1, "price": 104.0, "size": 1}
+    assert lad.apply_fill(fill, "same", ts=T0)
+    lad.record_entry("BUY", 1.0, 100.0, sl=98.0, tp=104.0, ts=T0, tp_oid=1, sl_oid=3)
+    # lo stesso fill riconsegnato non chiude la nuova posizione con lo stesso oid
+    assert not lad.apply_fill(fill, "same", ts=T0)
+    assert len(lad.open_positions()) == 1
+
+def test_unrelated_or_partial_fill_leaves_positions_open(lad):
+    lad.record_entry("BUY", 1.0, 100.0, sl=98.0, tp=104.0, ts=T0, tp_oid=1, sl_oid=2)
+    assert not lad.apply_fill({"orderId": 99, "price": 100.0, "size": 1}, "x", ts=T0)
+    assert not lad.apply_fill({"orderId": 1, "size": 1}, "y", ts=T0)
+    assert not lad.apply_fill({"orderId": 1, "price": 104.0, "size": 0.4}, "p1", ts=T0)
+    assert len(lad.open_positions()) == 1 and lad.stats(T0)["pnl_total"] == 0.0
+    # il resto esegue a un altro prezzo: chiude sulla qty intera al prezzo medio
+    assert lad.apply_fill({"orderId": 1, "price": 105.0, "size": 0.6}, "p2", ts=T0 + 1)
+    (c,) = lad.closed_positions()
+    assert c["result"] == "win" and c["exit"] == pytest.approx(104.6) and c["pl"] == pytest.approx(4.6)
+
+def test_partial_tp_then_stop_for_the_rest_closes_once(lad):
+    lad.record_entry("BUY", 2.0, 100.0, sl=98.0, tp=104.0, ts=T0, tp_oid=1, sl_oid=2)
+    assert not lad.apply_fill({"orderId": 1, "price": 104.0, "size": 0.5}, "a", ts=T0)
+    assert lad.apply_fill({"orderId": 2, "price": 98.0, "size": 1.5}, "b", ts=T0)
+    (c,) = lad.closed_positions()
+    assert c["exit"] == pytest.approx(99.5) and c["pl"] == pytest.approx(-1.0)
+    assert lad.stats(T0)["pnl_total"] == pytest.approx(-1.0)
+
+def test_trailed_stop_oid_closes_position(lad):
+    pid = lad.record_entry("BUY", 1.0, 100.0, sl=98.0, tp=104.0, ts=T0, tp_oid=1, sl_oid=2)
+    lad.update_stop(pid, 99.5, sl_oid=7)
+    assert not lad.apply_fill({"orderId": 2, "price": 98.0, "size": 1}, "old", ts=T0)
+    assert lad.apply_fill({"orderId": 7, "price": 99.5, "size": 1}, "new", ts=T0)
+    (c,) = lad.closed_positions()
+    assert c["result"] == "loss" and c["sl"] == 99.5 and c["pl"] == pytest.approx(-0.5)
+
+def test_trailed_stop_exit_in_profit_is_a_win(lad, cfg):
+    st = DynamicStops(cfg)
+    for k in ("a", "b"):
+        lad.record_entry("BUY", 1.0, 100.0, sl=98.0, tp=106.0, ts=T0, tp_oid=k + "tp", sl_oid=k + "sl")
+        assert lad.apply_fill({"orderId": k + "sl", "price": 98.0, "size": 1}, k, ts=T0)
+    assert lad.streak_mult(cfg) == cfg["risk_ladder"]["loss_penalty_mult"]
+
+    pid = lad.record_entry("BUY", 1.0, 100.0, sl=98.0, tp=106.0, ts=T0, tp_oid="ctp", sl_oid="csl")
+    sl = st.trail_stop("BUY", 100.0, 98.0, mid=104.0, atr=1.0)
+    assert sl == pytest.approx(104.0 - st.trail_mult) and sl > 100.0
+    lad.update_stop(pid, sl, sl_oid="csl2")
+    assert lad.apply_fill({"orderId": "csl2", "price": sl, "size": 1}, "c", ts=T0)
+    (c,) = [c for c in lad.closed_positions() if c["id"] == pid]
+    assert c["result"] == "win" and c["pl"] == pytest.approx(sl - 100.0)
+
+    # short trailato chiuso dal mid che attraversa lo stop (senza fill)
+    pid = lad.record_entry("SELL", 2.0, 100.0, sl=102.0, tp=94.0, ts=T0)
+    sl = st.trail_stop("SELL", 100.0, 102.0, mid=96.0, atr=1.0)
+    lad.update_stop(pid, sl)
+    assert lad.mark_exit_if_crossed(sl + 0.01, ts=T0)
+    (c,) = [c for c in lad.closed_positions() if c["id"] == pid]
+    assert c["result"] == "win" and c["pl"] == pytest.approx(2 * (100.0 - sl))
+
+    s = lad.stats(T0)
+    assert s["last_result"] == "win" and s["streak"] == 2
+    assert s["pnl_total"] == pytest.approx(-4.0 + (104.0 - st.trail_mult - 100.0) + 2 * (4.0 - st.trail_mult))
+    d = lad.day_stats(T0)
+    assert (d["wins"], d["losses"]) == (2, 2) and d["pnl"] == pytest.approx(s["pnl_total"])
+    assert lad.streak_mult(cfg) > 1.0
@@ -0,0 +1,36 @@
+from metrics import Metrics
+
+def _families(text):
+    """[(nome famiglia, [righe campione])] nell'ordine di uscita; ogni campione deve seguire il TYPE della sua famiglia."""
+    fams = []
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            name, kind = line.split()[2:4]
+            fams.append((name, kind, []))
+            continue
+        name, kind, rows = fams[-1]
+        metric = line.split("{", 1)[0]
+        suffixes = ("_bucket", "_sum", "_count") if kind == "histogram" else ("",)
+        assert any(metric == name + s for s in suffixes), (name, line)
+        rows.append(line)
+    return fams
+
+def test_prometheus_families_are_contiguous():
+    m = Metrics()
+    m.observe("loop", 3.0)
+    m.call("endpoint", "GET /a", 5.0)
+    m.call("endpoint", "POST /b", 7.0, error=True)
+    m.call("endpoint", "POST /b", 9.0)
+    m.call("venue", "binance", 1.0, error=True)
+    fams = _families(m.prometheus("x"))
+    names = [f[0] for f in fams]
+    assert len(names) == len(set(names))
+    assert names[0] == "x_stage_latency_ms"
+    for kind in ("endpoint", "venue"):
+        i = names.index(f"x_{kind}_calls_total")
+        assert names[i:i + 3] == [f"x_{kind}_calls_total", f"x_{kind}_errors_total", f"x_{kind}_latency_ms"]
+    rows = dict((f[0], f[2]) for f in fams)
+    assert rows["x_endpoint_calls_total"] == ['x_endpoint_calls_total{endpoint="GET /a"} 1',
+                                              'x_endpoint_calls_total{endpoint="POST /b"} 2']
+    assert rows["x_endpoint_errors_total"] == ['x_endpoint_errors_total{endpoint="GET /a"} 0',
+                                               'x_endpoint_errors_total{endpoint="POST /b"} 1']
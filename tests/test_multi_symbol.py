@@ -0,0 +1,91 @@
+import asyncio, copy, json, os, signal
+import aiohttp
+import pytest
+import datafeeds
+from datafeeds import instrument_of, batch_mids
+from pionex_api import Pionex
+
+ETH = {"pionex": "ETHUSDT", "okx": "ETH-USDT-SWAP", "tick_size": 0.01, "step_size": 0.0001}
+
+@pytest.fixture
+def cfg(base_cfg, monkeypatch):
+    """Config a due simboli: anche il simulatore della fixture `sim` ne serve due."""
+    c = copy.deepcopy(base_cfg)
+    c["symbols"] = ["SOLUSDT", ETH]
+    c["simulator"]["start_prices"] = {"ETHUSDT": 3000.0}
+    # set_base_urls cambia i globali dei datafeed: ripristinati a fine test
+    for k in ("BINANCE_F", "BYBIT", "OKX"):
+        monkeypatch.setattr(datafeeds, k, getattr(datafeeds, k))
+    return c
+
+def test_instrument_of_maps_every_venue():
+    assert instrument_of("SOLUSDT") == {"pionex": "SOLUSDT", "binance": "SOLUSDT", "bybit": "SOLUSDT", "okx": "SOL-USDT-SWAP"}
+    assert instrument_of({"pionex": "1000PEPEUSDT", "bybit": "1000PEPEUSDT", "okx": "PEPE-USDT-SWAP", "step_size": 1.0}) == {
+        "pionex": "1000PEPEUSDT", "binance": "1000PEPEUSDT", "bybit": "1000PEPEUSDT", "okx": "PEPE-USDT-SWAP", "step_size": 1.0}
+    assert instrument_of(ETH)["tick_size"] == 0.01
+
+def test_batch_mids_one_request_per_venue(sim):
+    s, c = sim
+    datafeeds.set_base_urls(**c["datafeed"]["base_urls"])
+    insts = [instrument_of(e) for e in c["symbols"]]
+
+    async def go():
+        async with aiohttp.ClientSession() as session:
+            return await batch_mids(session, insts)
+    out = asyncio.run(go())
+    assert set(out) == {"SOLUSDT", "ETHUSDT"}
+    for sym, ref in (("SOLUSDT", 150.0), ("ETHUSDT", 3000.0)):
+        mids = out[sym]
+        assert len(mids) == 3 and all(m is not None for m in mids)
+        # ogni venue quota il suo strumento, non quello del primo simbolo
+        assert all(abs(m / ref - 1.0) < 0.05 for m in mids), (sym, mids)
+
+def test_pionex_cache_keys_are_per_symbol(sim):
+    _, c = sim
+    px = Pionex("k", "s", cfg=c)
+    px.instruments = {i["pionex"]: i for i in map(instrument_of, c["symbols"])}
+    try:
+        assert px.market_info("ETHUSDT") == {"tick_size": 0.01, "step_size": 0.0001}
+        assert px.market_info("SOLUSDT") == {"tick_size": 0.001, "step_size": 0.001}
+        assert px.list_open_orders("SOLUSDT") == [] and px.list_open_orders("ETHUSDT") == []
+        res = px.place_orders([{"symbol": "ETHUSDT", "side": "BUY", "type": "LIMIT", "price": 2000.0,
+                                "quantity": 0.01, "timeInForce": "GTC"}])
+        assert res[0]["ok"], res
+        assert [o["symbol"] for o in px.list_open_orders("ETHUSDT")] == ["ETHUSDT"]
+        assert px.list_open_orders("SOLUSDT") == []
+        keys = set(px.cache._data)
+        assert {("open_orders", "SOLUSDT"), ("open_orders", "ETHUSDT"),
+                ("market_info", "SOLUSDT"), ("market_info", "ETHUSDT")} <= keys
+    finally:
+        px.close()
+
+def test_two_symbols_run_against_the_simulator(sim, tmp_path, monkeypatch):
+    from main import MultiEngine
+    s, c = sim
+    monkeypatch.chdir(tmp_path)
+    c["daemon"]["max_runtime_seconds"] = 4
+    c["daemon"]["loop_seconds"] = 1
+    # senza stream delle quote: i due engine leggono i ticker REST dallo stesso batch per venue
+    c["datafeed"]["stream"]["enabled"] = False
+    prev = signal.getsignal(signal.SIGTERM)
+    eng = MultiEngine(c)
+    try:
+        assert [e.symbol for e in eng.engines] == ["SOLUSDT", "ETHUSDT"]
+        assert eng.engines[0].home is None and eng.engines[1].home == os.path.join("symbols", "ETHUSDT")
+        eng.md.loop.run_until_complete(eng.main())
+        assert eng.md._batches > 0
+    finally:
+        eng.close()
+        signal.signal(signal.SIGTERM, prev)
+    # il primo simbolo scrive alla radice, l'altro sotto symbols/ETHUSDT (ledger e snapshot compresi)
+    for root in (tmp_path, tmp_path / "symbols" / "ETHUSDT"):
+        assert (root / "state.json").exists() and (root / "ledger.db").exists() and (root / "snapshot.json").exists(), root
+    with open(tmp_path / "state.json") as f:
+        st = json.load(f)
+    assert set(st["symbols"]) == {"SOLUSDT", "ETHUSDT"}
+    mids = {k: v["mid"] for k, v in st["symbols"].items()}
+    assert abs(mids["SOLUSDT"] / 150.0 - 1) < 0.05 and abs(mids["ETHUSDT"] / 3000.0 - 1) < 0.05, mids
+    # ciascun engine ha messo la sua griglia sul suo book del simulatore
+    orders = {sym: ex.orders for sym, (_, _, ex) in s.markets.items()}
+    assert orders["SOLUSDT"] and orders["ETHUSDT"]
+    assert all(o.get("symbol", sym) == sym for sym, oo in orders.items() for o in oo.values())
@@ -0,0 +1,93 @@
+import json
+import os
+import time
+import pytest
+import persist
+from persist import WriteBehind, write_json, write_text
+
+@pytest.fixture
+def wb():
+    w = WriteBehind()
+    yield w
+    w.stop()
+
+def test_write_json_goes_through_tmp_and_rename(tmp_path, monkeypatch):
+    path = str(tmp_path / "state.json")
+    write_json(path, {"a": 1})
+    seen = []
+    real = os.replace
+    def spy(src, dst):
+        # al momento del rename il tmp è completo e il file vecchio è ancora intatto
+        with open(src) as f, open(dst) as g:
+            seen.append((src, dst, json.load(f), json.load(g)))
+        real(src, dst)
+    monkeypatch.setattr(persist.os, "replace", spy)
+    write_json(path, {"a": 2, "t": (1, 2)})
+    assert seen == [(path + ".tmp", path, {"a": 2, "t": [1, 2]}, {"a": 1})]
+    assert os.listdir(tmp_path) == ["state.json"]
+    with open(path) as f:
+        assert f.read() == '{"a":2,"t":[1,2]}'
+
+def test_failed_rename_keeps_the_old_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "state.json")
+    write_json(path, {"a": 1})
+    def boom(src, dst):
+        raise OSError("disk full")
+    monkeypatch.setattr(persist.os, "replace", boom)
+    with pytest.raises(OSError):
+        write_json(path, {"a": 2})
+    with open(path) as f:
+        assert json.load(f) == {"a": 1}
+
+def test_writer_receives_path_and_object(tmp_path):
+    calls = []
+    write_json("x.json", {"a": 1}, writer=lambda p, o, indent=None: calls.append((p, o, indent)), indent=2)
+    write_text("m.prom", "up 1\n", writer=lambda p, t: calls.append((p, t)))
+    assert calls == [("x.json", {"a": 1}, 2), ("m.prom", "up 1\n")]
+    assert os.listdir(tmp_path) == []
+
+def test_submits_coalesce_and_lag_counts_from_the_first(tmp_path, wb):
+    path = str(tmp_path / "r.json")
+    for i in range(5):
+        wb.submit(path, {"i": i})
+    wb.submit(str(tmp_path / "m.prom"), "up 1\n")
+    time.sleep(0.05)
+    st = wb.stats()
+    assert (st["submitted"], st["coalesced"], st["pending"]) == (6, 4, 2)
+    assert st["lag_s"] >= 0.05
+    wb.start()
+    assert wb.flush(timeout=5)
+    st = wb.stats()
+    assert (st["written"], st["unchanged"], st["errors"], st["pending"], st["lag_s"]) == (2, 0, 0, 0, 0.0)
+    assert st["max_lag_ms"] >= 50.0 and st["bytes"] == len('{"i":4}') + len("up 1\n")
+    with open(path) as f:
+        assert json.load(f) == {"i": 4}
+    with open(tmp_path / "m.prom") as f:
+        assert f.read() == "up 1\n"
+
+def test_unchanged_content_is_skipped_until_the_file_disappears(tmp_path, wb):
+    wb.start()
+    path = str(tmp_path / "r.json")
+    wb.submit(path, {"a": 1}, indent=2)
+    wb.flush(timeout=5)
+    mtime = os.stat(path).st_mtime_ns
+    wb.submit(path, {"a": 1}, indent=2)
+    wb.flush(timeout=5)
+    st = wb.stats()
+    assert (st["written"], st["unchanged"]) == (1, 1)
+    assert os.stat(path).st_mtime_ns == mtime
+    os.remove(path)
+    wb.submit(path, {"a": 1}, indent=2)
+    wb.flush(timeout=5)
+    assert wb.stats()["written"] == 2
+    with open(path) as f:
+        assert f.read() == json.dumps({"a": 1}, indent=2)
+
+def test_write_errors_are_counted_not_raised(tmp_path, wb):
+    wb.start()
+    wb.submit(str(tmp_path / "missing" / "r.json"), {"a": 1})
+    wb.submit(str(tmp_path / "ok.json"), {"a": 1})
+    assert wb.flush(timeout=5)
+    st = wb.stats()
+    assert (st["errors"], st["written"]) == (1, 1)
+    assert "missing" in st["last_error"]
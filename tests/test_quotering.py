@@ -0,0 +1,75 @@
+import time
+import pytest
+from quotering import QuoteRing, QuoteRingReader, RingQuoteStream, _HDR, _REC, _SEQ
+from datafeeds import instrument
+
+@pytest.fixture
+def ring():
+    r = QuoteRing(slots=8)
+    yield r
+    r.close()
+
+def _off(ring, seq):
+    return _HDR.size + ((seq - 1) % ring.slots) * _REC.size
+
+def test_poll_returns_new_records_in_order(ring):
+    rd = QuoteRingReader(ring.name)
+    try:
+        assert rd.poll() == []
+        ring.publish(1, 2, 99.0, 101.0, ts=5.0)
+        ring.publish(0, 0, 10.0, 12.0, ts=6.0)
+        assert rd.poll() == [(1, 2, 99.0, 101.0, 100.0, 5.0), (0, 0, 10.0, 12.0, 11.0, 6.0)]
+        assert rd.poll() == [] and rd.stats == {"read": 2, "overruns": 0}
+        # un lettore nuovo parte dai record ancora nel ring
+        for i in range(10):
+            ring.publish(0, 0, 100.0 + i, 101.0 + i, ts=1.0)
+        late = QuoteRingReader(ring.name)
+        try:
+            assert [r[2] for r in late.poll()] == [102.0 + i for i in range(8)]
+        finally:
+            late.close()
+    finally:
+        rd.close()
+
+def test_slow_reader_counts_overrun_and_keeps_latest(ring):
+    rd = QuoteRingReader(ring.name)
+    try:
+        for i in range(20):
+            ring.publish(0, 1, float(i), float(i) + 1, ts=1.0)
+        got = rd.poll(max_n=3)
+        assert [r[2] for r in got] == [12.0, 13.0, 14.0]
+        assert rd.stats["overruns"] == 12
+        assert [r[2] for r in rd.poll()] == [15.0, 16.0, 17.0, 18.0, 19.0]
+    finally:
+        rd.close()
+
+def test_torn_or_overwritten_slot_is_skipped(ring):
+    rd = QuoteRingReader(ring.name)
+    try:
+        for i in range(1, 5):
+            ring.publish(0, 0, float(i), float(i) + 1, ts=1.0)
+        # seq 2 in scrittura (seq dello slot azzerato), seq 3 già riscritto da un giro successivo
+        _SEQ.pack_into(ring.buf, _off(ring, 2), 0)
+        _SEQ.pack_into(ring.buf, _off(ring, 3), 3 + ring.slots)
+        assert [r[2] for r in rd.poll()] == [1.0, 4.0]
+        assert rd.stats == {"read": 2, "overruns": 2}
+    finally:
+        rd.close()
+
+def test_ring_quote_stream_feeds_the_book(ring):
+    insts = [instrument("SOLUSDT"), instrument("BTCUSDT")]
+    qs = RingQuoteStream(ring.name, ["BTCUSDT", "SOLUSDT", "ETHUSDT"], insts, poll_s=0.001)
+    qs.start()
+    try:
+        ring.publish(1, 0, 150.0, 150.2)
+        ring.publish(0, 1, 60000.0, 60002.0)
+        ring.publish(2, 2, 3000.0, 3001.0)        # simbolo non gestito da questo worker
+        end = time.monotonic() + 5
+        while len(qs._book) < 2 and time.monotonic() < end:
+            time.sleep(0.005)
+        assert qs.quotes(key="SOLUSDT")["binance"]["mid"] == pytest.approx(150.1)
+        assert qs.quotes(key="BTCUSDT")["bybit"]["mid"] == pytest.approx(60001.0)
+        assert set(k for _, k in qs._book) == {"SOLUSDT", "BTCUSDT"}
+    finally:
+        qs.stop()
+        qs._thread.join(5)
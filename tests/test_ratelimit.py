@@ -0,0 +1,88 @@
+import threading, time
+import pytest
+from ratelimit import RequestScheduler, RateLimitDropped, PROTECT, ENTRY, GRID, READ
+
+def _spawn(rs, path, prio, out):
+    def run():
+        try:
+            rs.acquire(path, prio)
+            out.append(prio)
+        except RateLimitDropped as e:
+            out.append(("dropped", prio, str(e)))
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    return t
+
+def _wait_depth(rs, n, timeout=2.0):
+    end = time.monotonic() + timeout
+    while sum(rs.stats()["depth"].values()) < n:
+        assert time.monotonic() < end, "coda non raggiunta"
+        time.sleep(0.005)
+
+def test_higher_class_goes_first():
+    rs = RequestScheduler(buckets={"default": {"rate": 20, "burst": 1}}, max_wait_s={"entry": 5, "grid": 5, "read": 5})
+    rs.acquire("/p", PROTECT)   # consuma il burst: le successive restano in coda
+    out, threads = [], []
+    for i, prio in enumerate((READ, GRID, ENTRY, PROTECT)):
+        threads.append(_spawn(rs, "/p", prio, out))
+        _wait_depth(rs, i + 1)
+    for t in threads:
+        t.join(5)
+    assert out == [PROTECT, ENTRY, GRID, READ]
+    assert rs.stats()["classes"]["read"]["n"] == 1
+
+def test_endpoint_with_tokens_is_not_blocked_by_higher_class():
+    rs = RequestScheduler(buckets={"/slow": {"rate": 0.5, "burst": 1}, "default": {"rate": 100, "burst": 10}},
+                          max_wait_s={"read": 5})
+    rs.acquire("/slow", PROTECT)
+    out = []
+    t = _spawn(rs, "/slow", PROTECT, out)
+    _wait_depth(rs, 1)
+    t0 = time.monotonic()
+    rs.acquire("/fast", READ)
+    assert time.monotonic() - t0 < 0.5 and out == []
+    t.join(5)
+    assert out == [PROTECT]
+
+def test_full_queue_evicts_lowest_class_or_drops_incoming():
+    rs = RequestScheduler(buckets={"default": {"rate": 1, "burst": 1}}, max_queue=2,
+                          max_wait_s={"entry": 5, "grid": 5, "read": 5})
+    rs.acquire("/p", PROTECT)
+    out, threads = [], []
+    threads.append(_spawn(rs, "/p", READ, out)); _wait_depth(rs, 1)
+    threads.append(_spawn(rs, "/p", GRID, out)); _wait_depth(rs, 2)
+    # coda piena: un PROTECT scalza il READ in coda
+    threads.append(_spawn(rs, "/p", PROTECT, out))
+    threads[0].join(2)
+    assert out == [("dropped", READ, "evicted")]
+    # un READ in arrivo con la coda piena di classi più alte viene scartato subito
+    with pytest.raises(RateLimitDropped, match="queue full"):
+        rs.acquire("/p", READ)
+    for t in threads:
+        t.join(5)
+    assert out[1:] == [PROTECT, GRID]
+    assert rs.stats()["classes"]["read"]["dropped"] == 2
+
+def test_stale_request_is_dropped():
+    rs = RequestScheduler(buckets={"default": {"rate": 0.5, "burst": 1}}, max_wait_s={"grid": 0.1})
+    rs.acquire("/p", PROTECT)
+    with pytest.raises(RateLimitDropped, match="stale"):
+        rs.acquire("/p", GRID)
+    s = rs.stats()
+    assert s["classes"]["grid"]["dropped"] == 1 and sum(s["depth"].values()) == 0
+
+def test_pionex_priority_classes(cfg):
+    from pionex_api import Pionex
+    px = Pionex("k", "s", cfg)
+    place = px.paths["place_order"]
+    entry, tp, sl = px.bracket_orders("SOLUSDT", "BUY", 100.0, 1.0, 98.0, 103.0, entry_kind="LIMIT", reduce_only=True)
+    assert entry["reduceOnly"] and entry["timeInForce"] == "IOC"
+    assert px._priority("POST", place, entry) == ENTRY
+    assert px._priority("POST", place, tp) == PROTECT
+    assert px._priority("POST", place, sl) == PROTECT
+    m_entry, _, _ = px.bracket_orders("SOLUSDT", "SELL", 100.0, 1.0, 102.0, 97.0)
+    assert px._priority("POST", place, m_entry) == ENTRY
+    assert px._priority("POST", place, px._grid_order("SOLUSDT", "BUY", 99.0, 1.0)) == GRID
+    assert px._priority("POST", px.paths["cancel_order"], {"orderId": 1}) == PROTECT
+    assert px._priority("GET", px.paths["open_orders"], None) == READ
+    px.close()
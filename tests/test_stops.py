@@ -0,0 +1,34 @@
+import pytest
+from stops import DynamicStops
+
+def _stops(cfg, **kw):
+    cfg["dynamic_sl"].update({"atr_mult": 1.2, "trail_mult": 1.2, "trail_step_atr": 0.25, "box_sl_share": 0.5, **kw})
+    cfg["trading"]["sl_buffer_pct"] = 0.35
+    return DynamicStops(cfg)
+
+def test_blended_stop_is_not_pulled_in_before_price_moves(cfg):
+    st = _stops(cfg)
+    sl, _ = st.levels("BUY", 150.0, atr=0.5, box_top=150.0, box_bot=148.5)
+    assert sl == pytest.approx(148.69, abs=0.01)
+    assert st.trail_stop("BUY", 150.0, sl, 150.0, 0.5) is None
+    sl_s, _ = st.levels("SELL", 150.0, atr=0.5, box_top=151.5, box_bot=150.0)
+    assert st.trail_stop("SELL", 150.0, sl_s, 150.0, 0.5) is None
+
+def test_trails_only_in_favour_past_entry_and_by_step(cfg):
+    st = _stops(cfg)
+    # 0.6 di trail: sotto 150.6 il livello non supera l'ingresso
+    assert st.trail_stop("BUY", 150.0, 148.69, 150.55, 0.5) is None
+    assert st.trail_stop("BUY", 150.0, 148.69, 150.8, 0.5) == pytest.approx(150.2)
+    # passo minimo 0.125 e mai all'indietro
+    assert st.trail_stop("BUY", 150.0, 150.2, 150.9, 0.5) is None
+    assert st.trail_stop("BUY", 150.0, 150.2, 150.7, 0.5) is None
+    assert st.trail_stop("BUY", 150.0, 150.2, 151.0, 0.5) == pytest.approx(150.4)
+    assert st.trail_stop("SELL", 150.0, 151.31, 149.0, 0.5) == pytest.approx(149.6)
+    assert st.trail_stop("SELL", 150.0, 149.6, 149.5, 0.5) is None
+    assert st.trail_stop("BUY", None, 148.69, 160.0, 0.5) is None
+    assert _stops(cfg, trail=False).trail_stop("BUY", 150.0, 148.69, 160.0, 0.5) is None
+
+def test_trail_mult_has_its_own_default(cfg):
+    cfg["dynamic_sl"].pop("trail_mult", None)
+    cfg["dynamic_sl"]["atr_mult"] = 0.8
+    assert DynamicStops(cfg).trail_mult == 2.0
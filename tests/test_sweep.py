@@ -0,0 +1,17 @@
+import sweep
+
+def test_code_hash_follows_local_imports(tmp_path):
+    (tmp_path / "bt.py").write_text("import os\nfrom dep import f\n")
+    (tmp_path / "dep.py").write_text("import other\ndef f(): return 1\n")
+    (tmp_path / "other.py").write_text("X = 1\n")
+    (tmp_path / "unused.py").write_text("Y = 1\n")
+    root = str(tmp_path / "bt.py")
+    h0 = sweep.code_hash(root)
+    (tmp_path / "unused.py").write_text("Y = 2\n")
+    assert sweep.code_hash(root) == h0
+    (tmp_path / "other.py").write_text("X = 2\n")
+    assert sweep.code_hash(root) != h0
+
+def test_point_key_includes_code_version():
+    cfg = {"grid": {"k": 0.5}}
+    assert sweep.point_key("d", "1m", cfg, "a") != sweep.point_key("d", "1m", cfg, "b")
@@ -0,0 +1,79 @@
+import json
+from timeseries import TimeSeriesStore, Segments
+
+T0 = 1_700_000_400_000 - 1_700_000_400_000 % 3_600_000   # inizio di un'ora
+
+def _store(tmp_path):
+    return TimeSeriesStore(str(tmp_path / "series"), last_path=str(tmp_path / "report.json"), write_every_s=1e9)
+
+def _rows(tmp_path, r):
+    out = []
+    for p in Segments(str(tmp_path / "series"), f"rollup_{r}", []).paths():
+        with open(p) as f:
+            out += [json.loads(line) for line in f.readlines()[1:]]
+    return out
+
+def test_bucket_spanning_two_runs_gives_one_row(tmp_path):
+    s = _store(tmp_path)
+    for i, mid in enumerate((100.0, 102.0)):
+        s.append(T0 + i * 60_000, mid, vol_pct=1.0, div_bps=2.0, lev=3.0)
+    s.close()
+    assert _rows(tmp_path, "5m") == [] and _rows(tmp_path, "1h") == []
+
+    s = _store(tmp_path)
+    for i, mid in enumerate((99.0, 101.0), start=2):
+        s.append(T0 + i * 60_000, mid, vol_pct=3.0, div_bps=4.0, lev=5.0)
+    s.append(T0 + 300_000, 105.0)       # nuovo bucket 5m: chiude il primo
+    s.close()
+    ((t, n, o, h, l, c, v_avg, v_max, d_avg, d_max, lev_avg),) = _rows(tmp_path, "5m")
+    assert (t, n, o, h, l, c) == (T0, 4, 100.0, 102.0, 99.0, 101.0)
+    assert (v_avg, v_max, d_avg, d_max, lev_avg) == (2.0, 3.0, 3.0, 4.0, 4.0)
+    assert [r[0] for r in s.dashboard_payload()["rollups"]["5m"]] == [T0]
+    assert _rows(tmp_path, "1h") == []
+
+    s = _store(tmp_path)
+    s.append(T0 + 3_600_000, 106.0)      # nuova ora: chiude 1h e il secondo 5m
+    s.close()
+    ((t, n, o, h, l, c, *_),) = _rows(tmp_path, "1h")
+    assert (t, n, o, h, l, c) == (T0, 5, 100.0, 105.0, 99.0, 105.0)
+    assert [r[0] for r in _rows(tmp_path, "5m")] == [T0, T0 + 300_000]
+    assert [r[0] for r in s.dashboard_payload()["rollups"]["5m"]] == [T0, T0 + 300_000]
+
+def test_short_runs_resume_the_last_segment(tmp_path):
+    # cron ogni 15 minuti, series/ ripristinata dalla cache: 30 run coprono 7.5 h
+    def run(k):
+        s = TimeSeriesStore(str(tmp_path / "series"), last_path=str(tmp_path / "report.json"),
+                            write_every_s=1e9, max_age_s=3600, keep=14)
+        for i in range(15):
+            s.append(T0 + k * 900_000 + i * 60_000, 100.0 + i)
+        s.close()
+    for k in range(30):
+        run(k)
+    raw = Segments(str(tmp_path / "series"), "raw", []).paths()
+    assert len(raw) == 8        # un segmento per ora, non uno per run
+    rows = []
+    for p in raw:
+        with open(p) as f:
+            lines = f.readlines()
+        assert json.loads(lines[0]) == {"fields": ["t", "mid", "vol_pct", "div_bps", "lev"]}
+        rows += [json.loads(line) for line in lines[1:]]
+    assert [r[0] for r in rows] == [T0 + i * 60_000 for i in range(450)]
+
+def test_resume_skips_truncated_or_foreign_segments(tmp_path):
+    d = str(tmp_path)
+    seg = Segments(d, "raw", ["t", "mid"], max_age_s=3600)
+    seg.append([T0, 1.0])
+    seg.close()
+    (p,) = seg.paths()
+    with open(p, "a") as f:
+        f.write('[1,2')                 # run interrotto a metà riga
+    seg = Segments(d, "raw", ["t", "mid"], max_age_s=3600)
+    seg.append([T0 + 1000, 2.0])
+    seg.close()
+    with open(p) as f:
+        assert f.read().splitlines()[1:] == [f"[{T0},1.0]", "[1,2", f"[{T0 + 1000},2.0]"]
+    # campi diversi: nuovo segmento
+    seg = Segments(d, "raw", ["t", "mid", "x"], max_age_s=3600)
+    seg.append([T0 + 2000, 3.0, 0])
+    seg.close()
+    assert len(seg.paths()) == 2
@@ -0,0 +1,90 @@
+import asyncio, json, threading, time
+from ledger import fill_fields
+from ws_fills import FillBus, FillRouter, FillsWS, fill_key, is_fill
+
+def _fill(oid, price=100.0, size=1.0, **kw):
+    return {"orderId": oid, "price": price, "size": size, **kw}
+
+def test_dedupe_by_key_and_window():
+    bus = FillBus(dedupe_window=2)
+    assert len(bus.publish([_fill(1, seq=1), _fill(1, seq=1)])) == 1
+    assert bus.publish([{"id": "x", "orderId": 2, "price": 1}, {"id": "x", "orderId": 3, "price": 2}])[0]["orderId"] == 2
+    assert bus.stats()["duplicates"] == 2
+    bus.publish([_fill(4), _fill(5)])
+    # uscito dalla finestra di dedupe: torna a essere nuovo
+    assert len(bus.publish([_fill(1, seq=1)])) == 1
+    assert [f["orderId"] for f in bus.drain()] == [1, 2, 4, 5, 1] and bus.drain() == []
+
+def test_sequence_gap_requests_resync_once():
+    bus = FillBus()
+    bus.publish([_fill(1)], seq=1)
+    bus.publish([_fill(2)], seq=2)
+    assert not bus.take_resync()
+    bus.publish([_fill(3, seq=6)])
+    s = bus.stats()
+    assert s["gaps"] == 1 and s["missing"] == 3 and s["last_seq"] == 6
+    assert bus.take_resync() and not bus.take_resync()
+    # fill in ritardo o via REST non spostano la sequenza
+    bus.publish([_fill(4, seq=4)])
+    bus.publish([_fill(5, seq=99)], source="rest")
+    assert bus.stats()["last_seq"] == 6 and not bus.take_resync()
+
+def test_queue_overflow_drops_oldest_and_resyncs():
+    bus = FillBus(maxlen=2)
+    bus.publish([_fill(i) for i in range(5)])
+    assert [f["orderId"] for f in bus.drain()] == [3, 4]
+    assert bus.stats()["dropped"] == 3 and bus.take_resync()
+
+def test_router_gap_resyncs_every_bus():
+    a, b = FillBus(), FillBus()
+    r = FillRouter({"A": a, "B": b})
+    r.publish([_fill(1, symbol="A", seq=1), _fill(2, symbol="B", seq=2), _fill(3, seq=3)])
+    assert [f["orderId"] for f in a.drain()] == [1, 3] and [f["orderId"] for f in b.drain()] == [2]
+    r.publish([_fill(4, symbol="B", seq=5), _fill(5, symbol="C", seq=6)])
+    assert a.take_resync() and b.take_resync()
+    assert r.stats()["unrouted"] == 1 and r.stats()["missing"] == 1
+
+def test_fill_key_uses_ledger_field_fallbacks():
+    a = {"orderId": 7, "price": 10.0, "size": 2, "timestamp": 5}
+    b = {"order_id": 7, "price": 10.0, "qty": 2, "ts": 5}
+    assert fill_key(a) == fill_key(b) == "7|10.0|2|5"
+    assert fill_key({"order_id": 7, "price": 10.0, "quantity": 3, "time": 5}) != fill_key(a)
+    assert fill_fields(b) == (7, 10.0, 2, 5)
+
+def test_is_fill_rejects_control_messages():
+    assert is_fill(_fill(1)) and is_fill({"order_id": 1, "qty": 1})
+    for msg in ({"op": "pong"}, {"event": "subscribed", "channel": "fills"}, {"error": "bad"},
+                {"orderId": 1, "status": "ACK"}, {"price": 1, "size": 1}, [1], "x"):
+        assert not is_fill(msg)
+
+def test_fills_ws_publishes_only_fills():
+    from websockets.asyncio.server import serve
+    msgs = [{"op": "pong"}, {"event": "subscribed"}, {"error": "rate"},
+            _fill(1), {"fills": [_fill(2), {"ack": True}], "seq": 1}, "not json"]
+    ready, port = threading.Event(), []
+
+    async def handler(ws):
+        for m in msgs:
+            await ws.send(m if isinstance(m, str) else json.dumps(m))
+        await asyncio.sleep(5)
+
+    def server():
+        async def main():
+            async with serve(handler, "127.0.0.1", 0) as srv:
+                port.append(srv.sockets[0].getsockname()[1])
+                ready.set()
+                await asyncio.sleep(10)
+        asyncio.run(main())
+    threading.Thread(target=server, daemon=True).start()
+    assert ready.wait(5)
+
+    got = []
+    ws = FillsWS(f"ws://127.0.0.1:{port[0]}", on_fills=got.extend)
+    ws.start()
+    end = time.monotonic() + 5
+    while len(got) < 2 and time.monotonic() < end:
+        time.sleep(0.02)
+    time.sleep(0.1)
+    ws.stop()
+    assert [f["orderId"] for f in got] == [1, 2]
+    assert ws.bus.stats()["published"] == 2
@@ -0,0 +1,68 @@
+import time
+from ws_quotes import QuoteStream, parse_bybit, REMOVED, VENUES
+
+def _wait(cond, timeout=10.0):
+    t_end = time.time() + timeout
+    while time.time() < t_end:
+        if cond():
+            return True
+        time.sleep(0.05)
+    return False
+
+def test_parse_bybit_removed_level():
+    snap = {"type": "snapshot", "data": {"b": [["150.1", "3"]], "a": []}}
+    assert parse_bybit(snap) == (150.1, REMOVED)
+    delta = {"type": "delta", "data": {"b": [["150.1", "0"]], "a": [["150.3", "2"]]}}
+    assert parse_bybit(delta) == (REMOVED, 150.3)
+    assert parse_bybit({"type": "delta", "data": {"a": [["150.4", "1"]]}}) == (None, 150.4)
+
+def test_removed_side_drops_venue_quote():
+    qs = QuoteStream(max_age_s=5.0)
+    qs._on_quote("bybit", 150.0, 150.2)
+    assert "bybit" in qs.quotes()
+    qs._on_quote("bybit", REMOVED, None)
+    assert "bybit" not in qs.quotes()
+    # il lato torna con il messaggio successivo, l'altro resta quello noto
+    qs._on_quote("bybit", 150.1, None)
+    q = qs.quotes()["bybit"]
+    assert (q["bid"], q["ask"]) == (150.1, 150.2)
+
+def test_quote_stream_against_simulator(sim):
+    s, cfg = sim
+    st = cfg["datafeed"]["stream"]
+    qs = QuoteStream(urls=st["urls"], max_age_s=5.0)
+    wakeups = []
+    qs.add_listener(lambda: wakeups.append(1))
+    qs.start()
+    try:
+        assert _wait(lambda: set(qs.quotes()) == set(VENUES))
+        mid, vol_pct, div_bps, ts, alive = qs.aggregate_quote()
+        assert alive == 3
+        # rumore per venue di pochi bps attorno al mid del percorso
+        assert abs(mid / s.path.mid() - 1.0) < 5e-3
+        assert div_bps >= 0.0
+        assert wakeups
+        assert all(q["age_s"] < 5.0 for q in qs.quotes().values())
+    finally:
+        qs.stop()
+        qs._thread.join(5)
+
+def test_quote_stream_multi_symbol(cfg):
+    import simulator
+    from datafeeds import instrument_of
+    cfg["symbols"] = ["SOLUSDT", "ETHUSDT"]
+    cfg["simulator"]["start_prices"] = {"ETHUSDT": 3000.0}
+    cfg["simulator"]["faults"] = {"default": {"latency_ms": 0, "jitter_ms": 0, "error_rate": 0.0}}
+    s = simulator.Simulator(cfg)
+    port, stop = simulator.serve_in_thread(s)
+    qs = QuoteStream(urls=simulator.sim_config(cfg, "127.0.0.1", port)["datafeed"]["stream"]["urls"],
+                     instruments=[instrument_of(e) for e in cfg["symbols"]])
+    qs.start()
+    try:
+        assert _wait(lambda: len(qs.quotes(key="ETHUSDT")) == 3 and len(qs.quotes(key="SOLUSDT")) == 3)
+        assert qs.aggregate_quote(key="ETHUSDT")[0] > 1000.0
+        assert qs.aggregate_quote(key="SOLUSDT")[0] < 1000.0
+    finally:
+        qs.stop()
+        qs._thread.join(5)
+        stop()
@@ -0,0 +1,216 @@
+import os, json, time, glob
+from collections import deque
+from persist import write_json
+
+FIELDS = ("t", "mid", "vol_pct", "div_bps", "lev")
+ROLLUP_FIELDS = ("t", "n", "mid_o", "mid_h", "mid_l", "mid_c",
+                 "vol_pct_avg", "vol_pct_max", "div_bps_avg", "div_bps_max", "lev_avg")
+RES_S = {"1m": 60, "5m": 300, "1h": 3600}
+
+class Segments:
+    """
+    File JSONL a segmenti: la prima riga di ogni segmento è l'header con i campi,
+    le successive sono array compatti. Si ruota oltre max_bytes o max_age_s e si
+    tengono solo gli ultimi `keep` segmenti. Un nuovo processo riprende l'ultimo
+    segmento finché è entro i limiti: i run brevi del cron non consumano un
+    segmento ciascuno.
+    """
+    def __init__(self, dirpath, name, fields, max_bytes=1_000_000, max_age_s=86_400, keep=14):
+        self.dir = dirpath
+        self.name = name
+        self.fields = list(fields)
+        self.max_bytes = int(max_bytes)
+        self.max_age_s = float(max_age_s)
+        self.keep = int(keep)
+        self._f = None
+        self._start = None
+        self._size = 0
+        os.makedirs(dirpath, exist_ok=True)
+
+    def paths(self):
+        return sorted(glob.glob(os.path.join(self.dir, f"{self.name}-*.jsonl")),
+                      key=lambda p: int(p.rsplit("-", 1)[1].split(".")[0]))
+
+    def _open(self, t_ms):
+        self.close()
+        path = os.path.join(self.dir, f"{self.name}-{int(t_ms)}.jsonl")
+        self._f = open(path, "a")
+        self._start = t_ms
+        header = json.dumps({"fields": self.fields}, separators=(",", ":")) + "\n"
+        self._f.write(header)
+        self._size = len(header)
+        for old in self.paths()[:-self.keep]:
+            try: os.remove(old)
+            except Exception: pass
+
+    def _resume(self, t_ms):
+        """Riapre in coda l'ultimo segmento se ha lo stesso header ed è sotto max_bytes/max_age_s."""
+        paths = self.paths()
+        if not paths:
+            return False
+        path = paths[-1]
+        start = int(path.rsplit("-", 1)[1].split(".")[0])
+        try:
+            size = os.path.getsize(path)
+            with open(path, "rb") as f:
+                header = json.loads(f.readline() or b"null")
+                f.seek(max(0, size - 1))
+                tail = f.read(1)
+        except Exception:
+            return False
+        if (not isinstance(header, dict) or header.get("fields") != self.fields
+                or size >= self.max_bytes or not 0 <= (t_ms - start) / 1000.0 < self.max_age_s):
+            return False
+        self._f = open(path, "a")
+        self._start = start
+        self._size = size
+        if tail != b"\n":      # riga troncata da un run interrotto: la si chiude, i lettori la scartano
+            self._f.write("\n")
+            self._size += 1
+        return True
+
+    def append(self, row):
+        t_ms = row[0]
+        if self._f is None:
+            self._resume(t_ms)
+        if (self._f is None or self._size >= self.max_bytes
+                or (t_ms - self._start) / 1000.0 >= self.max_age_s):
+            self._open(t_ms)
+        line = json.dumps(row, separators=(",", ":")) + "\n"
+        self._f.write(line)
+        self._size += len(line)
+
+    def flush(self):
+        if self._f is not None:
+            self._f.flush()
+
+    def close(self):
+        if self._f is not None:
+            try: self._f.close()
+            except Exception: pass
+            self._f = None
+
+class _Bucket:
+    __slots__ = ("t0", "n", "o", "h", "l", "c", "vs", "vm", "ds", "dm", "ls", "ln")
+
+    def __init__(self, t0, mid):
+        self.t0 = t0; self.n = 0
+        self.o = self.h = self.l = self.c = mid
+        self.vs = self.vm = self.ds = self.dm = self.ls = 0.0; self.ln = 0
+
+    def add(self, mid, vol_pct, div_bps, lev):
+        self.n += 1
+        if mid > self.h: self.h = mid
+        if mid < self.l: self.l = mid
+        self.c = mid
+        v = vol_pct or 0.0; d = div_bps or 0.0
+        self.vs += v; self.vm = max(self.vm, v)
+        self.ds += d; self.dm = max(self.dm, d)
+        if lev is not None:
+            self.ls += lev; self.ln += 1
+
+    def state(self):
+        return [getattr(self, k) for k in self.__slots__]
+
+    @classmethod
+    def from_state(cls, st):
+        b = cls.__new__(cls)
+        for k, v in zip(cls.__slots__, st):
+            setattr(b, k, v)
+        return b
+
+    def row(self):
+        n = max(1, self.n)
+        return [self.t0, self.n, self.o, self.h, self.l, self.c,
+                self.vs / n, self.vm, self.ds / n, self.dm, (self.ls / self.ln) if self.ln else None]
+
+class TimeSeriesStore:
+    """
+    Storico di report: punti grezzi in segmenti ruotati, rollup 1m/5m/1h
+    pre-aggregati (OHLC del mid, media/max di vol_pct e div_bps, media lev) e un
+    file limitato agli ultimi N punti per la dashboard (report.json).
+    """
+    def __init__(self, dirpath="series", last_path="report.json", last_n=500, rollup_last_n=288,
+                 resolutions=("1m", "5m", "1h"), max_bytes=1_000_000, max_age_s=86_400, keep=14,
+                 write_every_s=15.0, writer=None):
+        self.last_path = last_path
+        self.writer = writer
+        self.write_every_s = float(write_every_s)
+        self.raw = Segments(dirpath, "raw", FIELDS, max_bytes, max_age_s, keep)
+        self.rollups = {r: Segments(dirpath, f"rollup_{r}", ROLLUP_FIELDS, max_bytes, max_age_s * RES_S[r] / 60.0, keep)
+                        for r in resolutions}
+        self._buckets = {r: None for r in resolutions}
+        self._last = deque(maxlen=int(last_n))
+        self._last_rollups = {r: deque(maxlen=int(rollup_last_n)) for r in resolutions}
+        self._last_write = 0.0
+        self._dirty = False
+        self._seed()
+
+    def _seed(self):
+        """Riprende dal file della dashboard del run precedente la coda degli ultimi punti e i bucket ancora aperti."""
+        try:
+            with open(self.last_path, "r") as f:
+                data = json.load(f)
+        except Exception:
+            return
+        for d in (data.get("mid_series") or []) if isinstance(data, dict) else []:
+            if isinstance(d, dict) and d.get("t") is not None and d.get("mid") is not None:
+                self._last.append({k: d.get(k) for k in FIELDS})
+        for r, rows in ((data.get("rollups") or {}) if isinstance(data, dict) else {}).items():
+            if r in self._last_rollups:
+                self._last_rollups[r].extend(rows)
+        for r, st in ((data.get("open_buckets") or {}) if isinstance(data, dict) else {}).items():
+            if r in self._buckets and isinstance(st, list) and len(st) == len(_Bucket.__slots__):
+                self._buckets[r] = _Bucket.from_state(st)
+
+    def append(self, ts, mid, vol_pct=None, div_bps=None, lev=None):
+        if mid is None:
+            return
+        t_ms = int(ts * 1000) if ts < 1e12 else int(ts)
+        self.raw.append([t_ms, mid, vol_pct, div_bps, lev])
+        self._last.append({"t": t_ms, "mid": mid, "vol_pct": vol_pct, "div_bps": div_bps, "lev": lev})
+        for r, b in self._buckets.items():
+            t0 = t_ms - t_ms % (RES_S[r] * 1000)
+            if b is not None and b.t0 != t0:
+                self._emit(r, b)
+                b = None
+            if b is None:
+                b = self._buckets[r] = _Bucket(t0, mid)
+            b.add(mid, vol_pct, div_bps, lev)
+        self._dirty = True
+        if time.monotonic() - self._last_write >= self.write_every_s:
+            self.write_last()
+
+    def _emit(self, r, b):
+        row = b.row()
+        self.rollups[r].append(row)
+        self._last_rollups[r].append(row)
+
+    def dashboard_payload(self):
+        return {"mid_series": list(self._last),
+                "rollup_fields": list(ROLLUP_FIELDS),
+                "rollups": {r: list(q) for r, q in self._last_rollups.items()},
+                "open_buckets": {r: b.state() for r, b in self._buckets.items() if b is not None}}
+
+    def write_last(self):
+        self._last_write = time.monotonic()
+        if not self._dirty:
+            return
+        write_json(self.last_path, self.dashboard_payload(), self.writer)
+        self.raw.flush()
+        for s in self.rollups.values():
+            s.flush()
+        self._dirty = False
+
+    def close(self):
+        """
+        Scrive il file della dashboard con i bucket ancora aperti: il run successivo
+        li riprende, così un bucket a cavallo di due run produce una sola riga.
+        """
+        self._dirty = True
+        try:
+            self.write_last()
+        finally:
+            self.raw.close()
+            for s in self.rollups.values():
+                s.close()
@@ -1,9 +1,19 @@
-import yaml, time, json
+import os, yaml, time, json
 
-def load_cfg(path="config.yaml"):
-    with open(path,"r") as f:
+def load_cfg(path=None):
+    """path None: $SOLUSDBOT_CONFIG se impostata (es. config del simulatore), altrimenti config.yaml."""
+    with open(path or os.environ.get("SOLUSDBOT_CONFIG", "config.yaml"),"r") as f:
         return yaml.safe_load(f)
 
+def deep_merge(base, over):
+    """Fonde over in base (dict annidati, in place) e ritorna base."""
+    for k, v in (over or {}).items():
+        if isinstance(v, dict) and isinstance(base.get(k), dict):
+            deep_merge(base[k], v)
+        else:
+            base[k] = v
+    return base
+
 def now_iso(ts=None):
     ts = ts or time.time()
     return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
@@ -1,41 +1,234 @@
 import json, time, threading
+from collections import deque
 import websockets, asyncio
+from persist import write_json
+from ledger import fill_fields
+
+# dal 14 il client asyncio di websockets accetta additional_headers (extra_headers solo nel client legacy)
+_HEADERS_KW = "additional_headers" if int(websockets.__version__.split(".")[0]) >= 14 else "extra_headers"
+
+def fill_key(f):
+    fid = f.get("id", f.get("fillId", f.get("tradeId")))
+    if fid is not None:
+        return str(fid)
+    return "|".join(str(v) for v in fill_fields(f))
+
+def is_fill(f):
+    """Un messaggio è un fill solo con order id e prezzo o size (ack, pong ed errori no)."""
+    if not isinstance(f, dict):
+        return False
+    oid, price, qty, _ = fill_fields(f)
+    return oid is not None and (price is not None or qty is not None)
+
+def fill_seq(f, default=None):
+    s = f.get("seq", f.get("sequence", default))
+    try: return int(s) if s is not None else None
+    except Exception: return None
+
+class FillBus:
+    """
+    Bus dei fill in-process tra il thread WS (publish) e il loop (drain).
+    Dedupe per id (finestra limitata), rilevamento dei buchi di sequenza e coda
+    limitata: se il loop non drena in tempo i più vecchi vengono scartati e si
+    chiede un resync via REST (take_resync()).
+    """
+    def __init__(self, maxlen=1000, dedupe_window=10_000, track_seq=True):
+        self.maxlen = int(maxlen)
+        self.track_seq = bool(track_seq)
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._recent = deque(maxlen=self.maxlen)
+        self._seen = set()
+        self._seen_order = deque()
+        self._dedupe_window = int(dedupe_window)
+        self._last_seq = None
+        self._resync = False
+        self._stats = {"published": 0, "duplicates": 0, "gaps": 0, "missing": 0, "dropped": 0, "rest": 0}
+        self._listeners = []
+
+    def add_listener(self, fn):
+        """fn() viene chiamata (dal thread che pubblica) quando arrivano fill nuovi."""
+        self._listeners.append(fn)
+
+    def publish(self, fills, seq=None, source="ws"):
+        """Ritorna i fill nuovi (non duplicati)."""
+        new = []
+        with self._lock:
+            for f in fills or []:
+                if not isinstance(f, dict):
+                    continue
+                k = fill_key(f)
+                if k in self._seen:
+                    self._stats["duplicates"] += 1
+                    continue
+                self._seen.add(k); self._seen_order.append(k)
+                if len(self._seen_order) > self._dedupe_window:
+                    self._seen.discard(self._seen_order.popleft())
+                s = fill_seq(f, seq) if source == "ws" and self.track_seq else None
+                if s is not None:
+                    if self._last_seq is not None and s > self._last_seq + 1:
+                        self._stats["gaps"] += 1
+                        self._stats["missing"] += s - self._last_seq - 1
+                        self._resync = True
+                    if self._last_seq is None or s > self._last_seq:
+                        self._last_seq = s
+                if source != "ws":
+                    self._stats["rest"] += 1
+                self._queue.append(f)
+                self._recent.append(f)
+                new.append(f)
+            self._stats["published"] += len(new)
+            while len(self._queue) > self.maxlen:
+                self._queue.popleft()
+                self._stats["dropped"] += 1
+                self._resync = True
+        if new:
+            for fn in self._listeners:
+                try: fn()
+                except Exception: pass
+        return new
+
+    def drain(self):
+        with self._lock:
+            out = list(self._queue)
+            self._queue.clear()
+        return out
+
+    def request_resync(self):
+        with self._lock:
+            self._resync = True
+
+    def take_resync(self):
+        """True (una volta) se dall'ultima chiamata si sono persi fill: buco di sequenza o coda piena."""
+        with self._lock:
+            r, self._resync = self._resync, False
+        return r
+
+    def recent(self, n=None):
+        with self._lock:
+            out = list(self._recent)
+        return out[-n:] if n else out
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "queued": len(self._queue), "last_seq": self._last_seq}
+
+class FillRouter:
+    """
+    Un solo stream di fill per più simboli: la sequenza è globale e si controlla
+    qui (un buco chiede il resync a tutti i bus), poi ogni fill va al FillBus del
+    suo simbolo. I fill senza simbolo vanno al bus di `default`.
+    """
+    def __init__(self, buses, default=None):
+        self.buses = dict(buses)
+        self.default = default if default is not None else next(iter(self.buses))
+        self._lock = threading.Lock()
+        self._last_seq = None
+        self._stats = {"gaps": 0, "missing": 0, "unrouted": 0}
+
+    def publish(self, fills, seq=None, source="ws"):
+        groups = {}
+        with self._lock:
+            for f in fills or []:
+                if not isinstance(f, dict):
+                    continue
+                s = fill_seq(f, seq) if source == "ws" else None
+                if s is not None:
+                    if self._last_seq is not None and s > self._last_seq + 1:
+                        self._stats["gaps"] += 1
+                        self._stats["missing"] += s - self._last_seq - 1
+                        for b in self.buses.values():
+                            b.request_resync()
+                    if self._last_seq is None or s > self._last_seq:
+                        self._last_seq = s
+                sym = f.get("symbol") or self.default
+                if sym not in self.buses:
+                    self._stats["unrouted"] += 1
+                    continue
+                groups.setdefault(sym, []).append(f)
+        new = []
+        for sym, fs in groups.items():
+            new += self.buses[sym].publish(fs, source=source)
+        return new
+
+    def recent(self, n=None):
+        out = sorted((f for b in self.buses.values() for f in b.recent()), key=lambda f: fill_seq(f, 0) or 0)
+        return out[-n:] if n else out
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "last_seq": self._last_seq}
 
 class FillsWS:
-    def __init__(self, url, headers=None, out_path="ws_fills.json"):
+    def __init__(self, url, headers=None, out_path=None, on_fills=None, bus=None, export_every_s=30.0):
         self.url = url
         self.headers = headers or {}
         self.out_path = out_path
+        self.on_fills = on_fills
+        self.bus = bus if bus is not None else FillBus()
+        self.export_every_s = float(export_every_s)
+        self._last_export = 0.0
         self._stop = threading.Event()
         self._thread = None
+        self._loop = None
+        self._ws = None
+
+    def _export(self):
+        """Export periodico opzionale degli ultimi fill (solo per debug/dashboard)."""
+        now = time.monotonic()
+        if not self.out_path or now - self._last_export < self.export_every_s:
+            return
+        self._last_export = now
+        try:
+            write_json(self.out_path, {"ts": time.time(), "fills": self.bus.recent()})
+        except Exception:
+            pass
 
     async def _run(self):
         while not self._stop.is_set():
             try:
-                async with websockets.connect(self.url, extra_headers=self.headers, ping_interval=20) as ws:
+                async with websockets.connect(self.url, ping_interval=20, **{_HEADERS_KW: self.headers}) as ws:
+                    self._ws = ws
+                    if self._stop.is_set():
+                        break
                     async for msg in ws:
                         try:
                             data = json.loads(msg)
                         except Exception:
                             continue
-                        fills = []
+                        fills, seq = [], None
                         if isinstance(data, dict) and "fills" in data:
-                            fills = data["fills"]
-                        elif isinstance(data, dict):
+                            fills, seq = [f for f in data["fills"] or [] if is_fill(f)], data.get("seq")
+                        elif is_fill(data):
                             fills = [data]
                         if fills:
-                            payload = {"ts": time.time(), "fills": fills}
-                            with open(self.out_path,"w") as f:
-                                json.dump(payload, f, indent=2)
+                            new = self.bus.publish(fills, seq=seq)
+                            if new and self.on_fills:
+                                try: self.on_fills(new)
+                                except Exception: pass
+                            self._export()
             except Exception:
                 await asyncio.sleep(1.0)
+            finally:
+                self._ws = None
 
     def start(self):
         if self._thread and self._thread.is_alive(): return
         def _bg():
-            asyncio.run(self._run())
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._loop.run_until_complete(self._run())
+            finally:
+                self._loop.close()
         self._thread = threading.Thread(target=_bg, daemon=True)
         self._thread.start()
 
-    def stop(self):
+    def stop(self, timeout=2.0):
+        """Chiude la connessione: senza fill in arrivo il loop non vedrebbe lo stop."""
         self._stop.set()
+        loop, ws = self._loop, self._ws
+        if loop is not None and ws is not None:
+            try: asyncio.run_coroutine_threadsafe(ws.close(), loop)
+            except Exception: pass
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
@@ -0,0 +1,169 @@
+import json, time, threading
+import websockets, asyncio
+from datafeeds import consensus, default_instrument
+
+BINANCE_WS = "wss://fstream.binance.com/ws"
+BYBIT_WS   = "wss://stream.bybit.com/v5/public/linear"
+OKX_WS     = "wss://ws.okx.com:8443/ws/v5/public"
+
+VENUES = ("binance", "bybit", "okx")
+
+# lato del top-of-book rimosso dalla venue (diverso da None = lato non presente nel messaggio)
+REMOVED = object()
+
+def parse_binance(data):
+    # <symbol>@bookTicker: {"b": bid, "a": ask, ...}; stream combinato: {"stream": ..., "data": {...}}
+    data = data.get("data", data)
+    if "b" in data and "a" in data:
+        return float(data["b"]), float(data["a"])
+    return None
+
+def parse_bybit(data):
+    # orderbook.1.<symbol>: {"type": "snapshot"|"delta", "data": {"b": [[px, sz]], "a": [[px, sz]]}}
+    # snapshot con un lato vuoto o delta che azzera il livello senza sostituirlo: lato REMOVED
+    d = data.get("data")
+    if not isinstance(d, dict):
+        return None
+    snap = data.get("type") == "snapshot"
+    def side(rows):
+        rows = rows or []
+        live = [r for r in rows if float(r[1]) > 0]
+        if live:
+            return float(live[0][0])
+        return REMOVED if rows or snap else None
+    return side(d.get("b")), side(d.get("a"))
+
+def parse_okx(data):
+    # bbo-tbt: {"arg": {...}, "data": [{"bids": [[px, sz, ...]], "asks": [[px, sz, ...]], "ts": ...}]}
+    arr = data.get("data")
+    if not arr:
+        return None
+    i = arr[0]
+    bids, asks = i.get("bids") or [], i.get("asks") or []
+    return (float(bids[0][0]) if bids else None), (float(asks[0][0]) if asks else None)
+
+def symbol_of(venue, data):
+    """Simbolo della venue a cui si riferisce il messaggio (None se non indicato)."""
+    try:
+        if venue == "binance":
+            return data.get("data", data).get("s")
+        if venue == "bybit":
+            return data.get("topic", "").rsplit(".", 1)[-1] or None
+        return data.get("arg", {}).get("instId")
+    except AttributeError:
+        return None
+
+class QuoteStream:
+    """
+    Top-of-book in streaming da Binance/Bybit/OKX. Tiene in memoria l'ultimo
+    bid/ask per (venue, strumento); aggregate_quote() non fa alcuna richiesta di rete.
+    instruments: lista di datafeeds.instrument() su una sola connessione per
+    venue (stream combinato / subscribe multipla); le chiavi sono i simboli Pionex.
+    Gli URL sono sovrascrivibili (es. server WS locale per i test).
+    """
+    src = "ws"
+
+    def __init__(self, urls=None, max_age_s=5.0, venues=VENUES, vol=None, instruments=None):
+        urls = urls or {}
+        self.instruments = list(instruments or [default_instrument()])
+        self._keys = {v: {i[v]: i["pionex"] for i in self.instruments} for v in VENUES}
+        self.default_key = self.instruments[0]["pionex"]
+        streams = [f"{i['binance'].lower()}@bookTicker" for i in self.instruments]
+        self.urls = {
+            "binance": urls.get("binance") or (f"{BINANCE_WS}/{streams[0]}" if len(streams) == 1
+                                               else f"{BINANCE_WS.rsplit('/', 1)[0]}/stream?streams={'/'.join(streams)}"),
+            "bybit":   urls.get("bybit") or BYBIT_WS,
+            "okx":     urls.get("okx") or OKX_WS,
+        }
+        self.venues = tuple(venues)
+        self.max_age_s = float(max_age_s)
+        self.vol = vol
+        self._book = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners = []
+
+    def add_listener(self, fn, key=None):
+        """fn() viene chiamata dal thread WS a ogni quote ricevuta (di `key`, o di tutti se None); deve essere non bloccante."""
+        self._listeners.append((fn, key))
+
+    def _subscribe_msg(self, venue):
+        if venue == "bybit":
+            return {"op": "subscribe", "args": [f"orderbook.1.{i['bybit']}" for i in self.instruments]}
+        if venue == "okx":
+            return {"op": "subscribe", "args": [{"channel": "bbo-tbt", "instId": i["okx"]} for i in self.instruments]}
+        return None
+
+    def _on_quote(self, venue, bid, ask, key=None, ts=None):
+        """bid/ask None = lato invariato, REMOVED = lato sparito (la venue esce dal consensus finché non torna)."""
+        key = key or self.default_key
+        with self._lock:
+            prev = self._book.get((venue, key))
+            if prev:
+                bid = bid if bid is not None else prev[0]
+                ask = ask if ask is not None else prev[1]
+            bid = None if bid is REMOVED else bid
+            ask = None if ask is REMOVED else ask
+            self._book[(venue, key)] = (bid, ask, ts or time.time())
+        for fn, k in self._listeners:
+            if k is not None and k != key:
+                continue
+            try: fn()
+            except Exception: pass
+
+    async def _venue(self, venue):
+        parse = {"binance": parse_binance, "bybit": parse_bybit, "okx": parse_okx}[venue]
+        while not self._stop.is_set():
+            try:
+                async with websockets.connect(self.urls[venue], ping_interval=20) as ws:
+                    sub = self._subscribe_msg(venue)
+                    if sub:
+                        await ws.send(json.dumps(sub))
+                    async for msg in ws:
+                        if self._stop.is_set():
+                            return
+                        try:
+                            data = json.loads(msg)
+                            q = parse(data)
+                        except Exception:
+                            continue
+                        if q:
+                            sym = symbol_of(venue, data)
+                            key = self._keys[venue].get(sym) if sym is not None else None
+                            if sym is not None and key is None:
+                                continue
+                            self._on_quote(venue, *q, key=key)
+            except Exception:
+                await asyncio.sleep(1.0)
+
+    async def _run(self):
+        await asyncio.gather(*(self._venue(v) for v in self.venues))
+
+    def start(self):
+        if self._thread and self._thread.is_alive(): return
+        def _bg():
+            asyncio.run(self._run())
+        self._thread = threading.Thread(target=_bg, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def quotes(self, now=None, key=None):
+        """Ritorna {venue: {"bid", "ask", "mid", "age_s"}} per le venue ricevute dello strumento `key`."""
+        now = now or time.time()
+        key = key or self.default_key
+        with self._lock:
+            book = dict(self._book)
+        return {v: {"bid": b, "ask": a, "mid": (a + b) / 2.0, "age_s": now - t}
+                for (v, k), (b, a, t) in book.items() if k == key and b is not None and a is not None}
+
+    def ages(self, now=None, key=None):
+        return {v: q["age_s"] for v, q in self.quotes(now, key).items()}
+
+    def aggregate_quote(self, sample=True, key=None, vol=None):
+        """Stessa tupla di datafeeds.aggregate_quote_sync(), solo con quote non più vecchie di max_age_s."""
+        now = time.time()
+        mids = [q["mid"] for q in self.quotes(now, key).values() if q["age_s"] <= self.max_age_s]
+        return consensus(mids, ts=now, vol=vol or self.vol, sample=sample)